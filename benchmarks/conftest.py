@@ -0,0 +1,35 @@
+"""Fixtures for the pytest-benchmark suite, running spyglass on the simulated camera.
+
+    python -m pytest benchmarks --benchmark-autosave
+    python -m pytest benchmarks --benchmark-compare --benchmark-compare-fail=median:20%
+"""
+import sys
+
+import pytest
+
+from spyglass import simulator
+
+SFTP_INFO = ('user', 'password', 'localhost', '/dashcam')
+
+
+@pytest.fixture
+def simulated(monkeypatch):
+    """``picamera2`` and ``libcamera`` are the simulator for the duration of the test."""
+    for name, module in simulator.modules().items():
+        monkeypatch.setitem(sys.modules, name, module)
+
+
+@pytest.fixture
+def camera(simulated):
+    camera = simulator.Picamera2(main_size=(1920, 1080), lores_size=(640, 480), fps=30)
+    yield camera
+    camera.stop_recording()
+
+
+@pytest.fixture
+def dvr(camera, tmp_path):
+    from spyglass.dvr import DVR
+
+    clips_folder = tmp_path / 'clips'
+    clips_folder.mkdir()
+    return DVR(camera, str(clips_folder), (1920, 1080), 30, 20, 10, 0, None, 0.1, 65.0, SFTP_INFO)
@@ -0,0 +1,54 @@
+"""Frame-callback jitter of a running spyglass, from the profiler's ``interval`` stage.
+
+Start spyglass with ``--profile``, once with and once without
+``--worker_processes``, and run this against each while uploads and GPS are
+active::
+
+    python3 benchmarks/frame_jitter.py --url http://127.0.0.1:8080 --seconds 120
+
+The spread between the median and the 99th percentile frame interval is the
+jitter, dropped frames are counted over the whole run.
+"""
+import argparse
+import json
+import statistics
+import time
+import urllib.request
+
+
+def get_profile(url):
+    with urllib.request.urlopen(f'{url}/profile', timeout=5) as response:
+        return json.load(response)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8080')
+    parser.add_argument('--seconds', type=float, default=60)
+    parser.add_argument('--every', type=float, default=5, help='Seconds between samples of the rolling window.')
+    args = parser.parse_args()
+
+    first = get_profile(args.url)
+    samples = []
+    deadline = time.monotonic() + args.seconds
+    while time.monotonic() < deadline:
+        time.sleep(args.every)
+        interval = get_profile(args.url)['stages'].get('interval')
+        if interval:
+            samples.append(interval)
+    last = get_profile(args.url)
+
+    report = {
+        'frame_duration_ms': last['frame_duration_us'] / 1000 if last.get('frame_duration_us') else None,
+        'frames': last['frames'] - first['frames'],
+        'dropped': last['dropped'] - first['dropped'],
+    }
+    if samples:
+        report['interval_ms'] = {key: round(statistics.median(s[key] for s in samples), 3)
+                                 for key in ('p50', 'p90', 'p99', 'max')}
+        report['jitter_ms'] = round(report['interval_ms']['p99'] - report['interval_ms']['p50'], 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Compare direct clip writes with the tmpfs write-behind on a loop device.
+
+Creates a file backed block device, formats it, and writes the same amount
+of clip data twice: once the way ffmpeg does (small writes interleaved with
+GPS appends) and once through :class:`spyglass.staging.WriteBehind`. The
+sectors the block device saw (``/sys/block/loopN/stat``) give the write
+amplification.
+
+Needs root (losetup, mkfs, mount)::
+
+    sudo python3 benchmarks/sd_write_behind.py --clips 6 --clip_mb 20
+"""
+import argparse
+import json
+import os
+import subprocess
+import tempfile
+import time
+
+from spyglass.staging import WriteBehind
+
+SECTOR_SIZE = 512
+FFMPEG_WRITE_SIZE = 32 * 1024
+
+
+def sectors_written(device):
+    with open(f'/sys/block/{os.path.basename(device)}/stat') as f:
+        return int(f.read().split()[6])
+
+
+def drop_caches():
+    subprocess.run(['sync'], check=True)
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3\n')
+
+
+def write_direct(folder, clips, clip_bytes):
+    """Small writes straight to the card with a GPS line in between, like ffmpeg and gather_gps."""
+    gps_path = os.path.join(folder, 'gps_data.csv')
+    chunk = os.urandom(FFMPEG_WRITE_SIZE)
+    for i in range(clips):
+        tmp = os.path.join(folder, f'TMP_clip_{i}.mp4')
+        with open(tmp, 'wb') as f:
+            for n in range(clip_bytes // FFMPEG_WRITE_SIZE):
+                f.write(chunk)
+                f.flush()
+                if n % 64 == 0:
+                    with open(gps_path, 'a') as gps:
+                        gps.write(f'{time.time()},41.38 2.17\n')
+            os.fsync(f.fileno())
+        os.rename(tmp, os.path.join(folder, f'clip_{i}.mp4'))
+
+
+def write_staged(folder, staging_folder, clips, clip_bytes):
+    write_behind = WriteBehind(staging_folder)
+    gps_path = os.path.join(folder, 'gps_data.csv')
+    chunk = os.urandom(FFMPEG_WRITE_SIZE)
+    for i in range(clips):
+        tmp = write_behind.staging_path(f'TMP_clip_{i}.mp4')
+        with open(tmp, 'wb') as f:
+            for n in range(clip_bytes // FFMPEG_WRITE_SIZE):
+                f.write(chunk)
+                if n % 64 == 0:
+                    write_behind.append(gps_path, f'{time.time()},41.38 2.17\n')
+        write_behind.move(tmp, os.path.join(folder, f'clip_{i}.mp4'))
+    write_behind.stop()
+    return write_behind.stats()
+
+
+def run(device, mountpoint, name, write):
+    subprocess.run(['mkfs.ext4', '-q', '-F', device], check=True)
+    subprocess.run(['mount', device, mountpoint], check=True)
+    try:
+        drop_caches()
+        before = sectors_written(device)
+        start = time.monotonic()
+        extra = write(mountpoint)
+        subprocess.run(['sync'], check=True)
+        seconds = time.monotonic() - start
+        written = (sectors_written(device) - before) * SECTOR_SIZE
+    finally:
+        subprocess.run(['umount', mountpoint], check=True)
+    return name, seconds, written, extra
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clips', type=int, default=6)
+    parser.add_argument('--clip_mb', type=int, default=20)
+    parser.add_argument('--image_mb', type=int, default=1024)
+    args = parser.parse_args()
+
+    clip_bytes = args.clip_mb * 1024 * 1024
+    payload = args.clips * clip_bytes
+
+    with tempfile.TemporaryDirectory() as workdir, tempfile.TemporaryDirectory(dir='/dev/shm') as staging:
+        image = os.path.join(workdir, 'card.img')
+        mountpoint = os.path.join(workdir, 'card')
+        os.mkdir(mountpoint)
+        with open(image, 'wb') as f:
+            f.truncate(args.image_mb * 1024 * 1024)
+        device = subprocess.run(['losetup', '--find', '--show', image], check=True,
+                                capture_output=True, text=True).stdout.strip()
+        try:
+            results = [
+                run(device, mountpoint, 'direct', lambda folder: write_direct(folder, args.clips, clip_bytes)),
+                run(device, mountpoint, 'write_behind',
+                    lambda folder: write_staged(folder, staging, args.clips, clip_bytes)),
+            ]
+        finally:
+            subprocess.run(['losetup', '--detach', device], check=True)
+
+    report = {}
+    for name, seconds, written, extra in results:
+        report[name] = {
+            'seconds': round(seconds, 2),
+            'mb_per_second': round(payload / seconds / 1e6, 2),
+            'bytes_written': written,
+            'write_amplification': round(written / payload, 3),
+        }
+        if extra:
+            report[name]['write_behind'] = extra
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
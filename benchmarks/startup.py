@@ -0,0 +1,80 @@
+"""Measure how long spyglass takes to start.
+
+``--help`` and ``--list-controls`` are timed as a subprocess. With
+``--record``, spyglass is started with the remaining arguments and ``/startup``
+is polled until the first recorded frame, on a Pi with a camera::
+
+    python3 benchmarks/startup.py --runs 5
+    python3 benchmarks/startup.py --runs 3 --record -- --clip_duration 10 --port 8080
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+SPYGLASS = [sys.executable, '-m', 'spyglass']
+
+
+def time_command(args):
+    start = time.monotonic()
+    subprocess.run(SPYGLASS + args, capture_output=True)
+    return time.monotonic() - start
+
+
+def time_recording(args, port, timeout):
+    process = subprocess.Popen(SPYGLASS + args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/startup', timeout=1) as response:
+                    marks = json.load(response)
+                if 'first_recorded_frame' in marks:
+                    return marks
+            except OSError:
+                pass
+            time.sleep(0.1)
+        return None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def summary(values):
+    return {'median': round(statistics.median(values), 3), 'min': round(min(values), 3), 'max': round(max(values), 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--record', action='store_true', help='Also time a real start up to the first recorded frame.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--timeout', type=float, default=60)
+    parser.add_argument('spyglass_args', nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    spyglass_args = [a for a in args.spyglass_args if a != '--']
+
+    report = {
+        'help': summary([time_command(['--help']) for _ in range(args.runs)]),
+        'list_controls': summary([time_command(['--list-controls']) for _ in range(args.runs)]),
+    }
+
+    if args.record:
+        runs = [time_recording(spyglass_args + ['--port', str(args.port)], args.port, args.timeout)
+                for _ in range(args.runs)]
+        runs = [r for r in runs if r]
+        report['record'] = {}
+        for name in ('imports', 'camera_started', 'recording', 'first_recorded_frame'):
+            values = [r[name] for r in runs if name in r]
+            if values:
+                report['record'][name] = summary(values)
+        report['record']['failed_runs'] = args.runs - len(runs)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
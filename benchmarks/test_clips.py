@@ -0,0 +1,65 @@
+"""Clip rotation, and finding clips in a day of recordings."""
+import datetime
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+CLIP_DURATION = 10
+
+
+@pytest.mark.parametrize('staged', [False, True], ids=['card', 'staging'])
+def test_clip_rotation(benchmark, camera, dvr, tmp_path, staged):
+    """Stop the encoder, rename the clip, queue it and start the next one (one second clips)."""
+    from spyglass.simulator import FfmpegOutput
+    from spyglass.staging import WriteBehind
+
+    queued = []
+    dvr.upload_clips_manager = type('Uploads', (), {'add_file_to_queue': lambda self, file_path: queued.append(file_path)})()
+    if staged:
+        dvr.write_behind = WriteBehind(str(tmp_path / 'staging'))
+    day_folder = os.path.join(dvr.clips_folder, '2024-05-01')
+    os.mkdir(day_folder)
+    encoder = dvr._get_recording_encoder()
+    recorded = []
+
+    def record_clip():
+        name = f'TMP_clip_{len(recorded)}.mp4'
+        recorded.append(name)
+        path = dvr.write_behind.staging_path(name) if staged else os.path.join(day_folder, name)
+        camera.start_recording(encoder, FfmpegOutput(path), name='main')
+        camera.run_frames(30)
+        encoder.stop()
+        dvr._finish_file(path, os.path.join(day_folder, name.replace('TMP_', '', 1)), staged)
+
+    benchmark.pedantic(record_clip, rounds=20)
+    if staged:
+        dvr.write_behind.stop()
+    assert len(queued) == len(recorded)
+
+
+@pytest.fixture
+def day_of_clips(tmp_path):
+    """24 hours of 10 second clips with their thumbnails, like a full day folder."""
+    from spyglass.clips import THUMBNAIL_SUFFIX, clip_id_for
+
+    day = datetime.datetime(2024, 5, 1)
+    folder = tmp_path / day.strftime('%Y-%m-%d')
+    folder.mkdir()
+    for second in range(0, 24 * 3600, CLIP_DURATION):
+        clip_id = clip_id_for(day + datetime.timedelta(seconds=second))
+        (folder / (clip_id + '.mp4')).touch()
+        (folder / (clip_id + THUMBNAIL_SUFFIX)).touch()
+    return str(tmp_path), day.timestamp()
+
+
+@pytest.mark.parametrize('minutes, expected', [(10, 60), (24 * 60, 8640)], ids=['10min', 'day'])
+def test_find_covering_clips(benchmark, day_of_clips, minutes, expected):
+    from spyglass.export import find_covering_clips
+
+    clips_folder, start = day_of_clips
+    if minutes < 24 * 60:
+        start += 12 * 3600
+    clips = benchmark(find_covering_clips, clips_folder, start, start + minutes * 60, CLIP_DURATION)
+    assert len(clips) == expected
@@ -0,0 +1,35 @@
+"""Cost of the pre_callback on every 1080p frame: the text overlay and the DVR's frame hook."""
+import time
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('cv2')
+
+
+@pytest.fixture
+def timestamp(camera, dvr):
+    from spyglass.timestamp import Timestamp
+
+    timestamp = Timestamp(camera, dvr)
+    # Keep vcgencmd out of the measurement
+    timestamp.last_update_time = time.time() + 3600
+    timestamp.last_temp = 52.3
+    dvr.last_gps_data = '41.3874 2.1686'
+    return timestamp
+
+
+def test_overlay(benchmark, camera, timestamp):
+    request = camera.capture_frame()
+    benchmark(timestamp._apply_timestamp, request)
+
+
+def test_pre_callback(benchmark, camera, timestamp):
+    # Overlay, control queue and frame bookkeeping, as the camera calls it
+    request = camera.capture_frame()
+    benchmark(timestamp.apply_timestamp, request)
+
+
+def test_frame_delivery(benchmark, camera, timestamp):
+    # A second of frames through the callback with nothing encoding
+    benchmark(camera.run_frames, 30)
@@ -0,0 +1,48 @@
+"""Startup recovery scan over a card holding a week of 10 second clips."""
+import datetime
+import os
+import time
+
+import pytest
+
+from spyglass.simulator import box
+
+pytest.importorskip('pytest_benchmark')
+
+DAYS = 7
+CLIP_DURATION = 10
+
+
+@pytest.fixture
+def clips_folder(tmp_path):
+    from spyglass.clips import clip_id_for
+
+    start = datetime.datetime(2024, 5, 1)
+    for day in range(DAYS):
+        folder = tmp_path / (start + datetime.timedelta(days=day)).strftime('%Y-%m-%d')
+        folder.mkdir()
+        for second in range(0, 24 * 3600, CLIP_DURATION):
+            clip_id = clip_id_for(start + datetime.timedelta(days=day, seconds=second))
+            (folder / (clip_id + '.mp4')).touch()
+    return tmp_path
+
+
+def test_recovery_scan(benchmark, clips_folder):
+    from spyglass.recovery import ClipRecovery
+
+    last_day = sorted(os.listdir(clips_folder))[-1]
+    orphan = clips_folder / last_day / f'TMP_clip_{last_day}_23-59-55.mp4'
+    data = box(b'ftyp') + box(b'moov') + box(b'moof') + box(b'mdat', bytes(100000)) + box(b'moof')
+
+    def write_orphan():
+        orphan.write_bytes(data)
+        past = time.time() - 60
+        os.utime(orphan, (past, past))
+        return (ClipRecovery(str(clips_folder), lambda path: os.remove(path)),), {}
+
+    def scan(recovery):
+        recovery.run()
+        return recovery
+
+    benchmark.pedantic(scan, setup=write_orphan, rounds=5)
+    assert not orphan.exists()
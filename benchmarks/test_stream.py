@@ -0,0 +1,56 @@
+"""Cost of /stream clients on the camera thread.
+
+Every client gets its own MJPEG encoder and a ``StreamingOutput`` that hands
+frames to the event loop, as in ``server.stream``.
+"""
+import asyncio
+import threading
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+pytest.importorskip('fastapi')
+
+FRAMES = 30
+
+
+@pytest.fixture
+def loop():
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield loop
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@pytest.mark.parametrize('clients', [1, 4, 8])
+def test_stream_fan_out(benchmark, camera, loop, clients):
+    from spyglass.server import StreamingOutput
+    from spyglass.simulator import FileOutput, MJPEGEncoder
+
+    received = [0] * clients
+
+    async def client(index, output):
+        while True:
+            await output.read()
+            received[index] += 1
+
+    encoders = []
+    readers = []
+    for index in range(clients):
+        output = StreamingOutput(loop)
+        readers.append(asyncio.run_coroutine_threadsafe(client(index, output), loop))
+        encoder = MJPEGEncoder()
+        camera.start_encoder(encoder, FileOutput(output), name='lores')
+        encoders.append(encoder)
+
+    benchmark(camera.run_frames, FRAMES)
+
+    asyncio.run_coroutine_threadsafe(asyncio.sleep(0.1), loop).result()
+    camera.stop_encoder(encoders)
+    for reader in readers:
+        reader.cancel()
+    asyncio.run_coroutine_threadsafe(asyncio.sleep(0.01), loop).result()
+    assert all(count > 0 for count in received)
@@ -0,0 +1,48 @@
+"""The upload path of a clip against a local SFTP stand-in: connect, create the day folder, put, delete."""
+import os
+
+import pytest
+
+pytest.importorskip('pytest_benchmark')
+
+CLIP_BYTES = 4 * 1024 * 1024
+CLIPS = 5
+
+
+@pytest.fixture
+def uploader(tmp_path):
+    from spyglass.simulator import FakeSFTPClient
+    from spyglass.upload_clips import UploadClips
+
+    clips_folder = tmp_path / 'clips'
+    (clips_folder / '2024-05-01').mkdir(parents=True)
+    server = tmp_path / 'server'
+    server.mkdir()
+    uploader = UploadClips(str(clips_folder), 'user', 'password', 'localhost', '/dashcam')
+    uploader.sftp = FakeSFTPClient(str(server))
+    uploader.create_sftp_connection = lambda: uploader.sftp
+    return uploader
+
+
+def test_upload_clips(benchmark, uploader):
+    day_folder = os.path.join(uploader.clip_folder, '2024-05-01')
+    data = os.urandom(CLIP_BYTES)
+    written = []
+
+    def write_clips():
+        paths = []
+        for i in range(CLIPS):
+            path = os.path.join(day_folder, f'clip_2024-05-01_12-00-{i:02d}.mp4')
+            with open(path, 'wb') as f:
+                f.write(data)
+            paths.append(path)
+        written.extend(paths)
+        return (paths,), {}
+
+    def upload(paths):
+        for path in paths:
+            uploader.upload_clip(path, uploader.remote_dir_for(path))
+
+    benchmark.pedantic(upload, setup=write_clips, rounds=10)
+    assert os.listdir(day_folder) == []
+    assert len(uploader.sftp.uploaded) == len(written)
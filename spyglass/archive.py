@@ -0,0 +1,324 @@
+"""Re-compress aging clips into a compact archive tier.
+
+Clips older than ``after_hours`` are rewritten by ffmpeg, one at a time, and
+replace the original under the same name so ``/videos`` and ``/export`` keep
+finding them:
+
+* ``keyframes`` keeps only the keyframes, without decoding anything. With the
+  default ``--fragment_duration`` that is one frame per second at full
+  resolution.
+* ``transcode`` re-encodes the clip in software at a lower resolution and
+  quality. It keeps full motion, but costs a lot more CPU.
+
+With ``evict_static``, clips the recorder found static (see ``--static_threshold``)
+are deleted with their proxy instead, only the thumbnails and the activity
+sidecar remain.
+
+ffmpeg runs at the lowest CPU and I/O priority and only while the car is
+parked. It is stopped (``SIGSTOP``) whenever the CPU is hot, the load is high
+or the camera drops frames, and continued once that has passed. Stopping the
+archiver ends ffmpeg as well, whether it is running or held stopped.
+"""
+import datetime
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import time
+
+from .clips import (CLIP_EXTENSION, CLIP_ID_PATTERN, DAY_FORMAT, PROXY_SUFFIX, TIMING_SUFFIX, clip_start_time,
+                    locked_clips, read_activity, sidecar_path)
+from .recovery import DAY_FOLDER_PATTERN
+
+ARCHIVE_MODES = ('keyframes', 'transcode')
+# Clip ids already archived, one per line, in every day folder
+ARCHIVED_LIST = "archived.txt"
+ARCHIVE_TMP_SUFFIX = ".archive.tmp"
+
+ARCHIVE_CODEC_OPTIONS = {
+    'keyframes': ['-c', 'copy', '-bsf:v', 'noise=drop=not(key)'],
+    'transcode': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '30', '-vf', 'scale=-2:480'],
+}
+# Same container as the recordings, see FRAGMENTED_MP4_OPTIONS in dvr.py
+ARCHIVE_CONTAINER_OPTIONS = ['-movflags', '+frag_keyframe+empty_moov+default_base_moof', '-f', 'mp4']
+
+PARKED_SPEED = 3  # km/h, below this the GPS reports noise
+THERMAL_ZONE = "/sys/class/thermal/thermal_zone0/temp"
+
+
+def archive_command(mode, source, destination):
+    command = ['ffmpeg', '-loglevel', 'warning', '-y', '-i', source, '-map', '0:v', '-threads', '1',
+               *ARCHIVE_CODEC_OPTIONS[mode], *ARCHIVE_CONTAINER_OPTIONS, destination]
+    # Idle I/O class, the recorder always wins the card
+    if shutil.which('ionice'):
+        command = ['ionice', '-c', '3'] + command
+    return ['nice', '-n', '19'] + command
+
+
+def cpu_temperature(path=THERMAL_ZONE):
+    """CPU temperature in °C, or None if the kernel does not report it."""
+    try:
+        with open(path) as f:
+            return int(f.read()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+def read_archived(day_folder):
+    try:
+        with open(os.path.join(day_folder, ARCHIVED_LIST)) as f:
+            return set(f.read().split())
+    except FileNotFoundError:
+        return set()
+
+
+def find_candidates(clips_folder, before):
+    """Clips that started before ``before`` (epoch seconds) and are not archived yet, oldest first."""
+    candidates = []
+    with os.scandir(clips_folder) as days:
+        day_folders = sorted(entry.path for entry in days if entry.is_dir() and DAY_FOLDER_PATTERN.match(entry.name))
+
+    for day_folder in day_folders:
+        if datetime.datetime.strptime(os.path.basename(day_folder), DAY_FORMAT).timestamp() >= before:
+            break
+        # Incidents are kept as recorded
+        archived = read_archived(day_folder) | locked_clips(day_folder)
+        clips = []
+        with os.scandir(day_folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(ARCHIVE_TMP_SUFFIX):
+                    # Left behind by a restart in the middle of a clip
+                    os.remove(entry.path)
+                    continue
+                clip_id, extension = os.path.splitext(entry.name)
+                if extension != CLIP_EXTENSION or not CLIP_ID_PATTERN.match(clip_id) or clip_id in archived:
+                    continue
+                start = clip_start_time(clip_id).timestamp()
+                if start < before:
+                    clips.append((start, entry.path))
+        candidates.extend(path for _, path in sorted(clips))
+    return candidates
+
+
+class ClipArchiver:
+    """Rewrites clips older than ``after_hours`` into the archive tier in idle windows.
+
+    ``speed`` returns the last GPS speed in km/h (or None). The car counts as
+    parked once it has not moved for ``parked_minutes``, which without a GPS
+    is always the case after ``parked_minutes``. ``dropped_frames`` returns
+    the camera's dropped frame count so far, if it is being profiled.
+    ``throttled`` returns why background work must wait, e.g. from the
+    :class:`~spyglass.governor.Governor`, or None.
+    """
+
+    def __init__(self, clips_folder, after_hours, mode='keyframes', max_temperature=70.0, parked_minutes=5,
+                 speed=lambda: None, dropped_frames=None, max_load=None, poll_interval=5, evict_static=False,
+                 throttled=None):
+        if mode not in ARCHIVE_MODES:
+            raise ValueError(f"unknown archive mode: {mode}")
+        self.clips_folder = clips_folder
+        self.after_hours = after_hours
+        self.mode = mode
+        self.max_temperature = max_temperature
+        self.parked_minutes = parked_minutes
+        self.speed = speed
+        self.dropped_frames = dropped_frames
+        self.max_load = max_load if max_load is not None else max(1, (os.cpu_count() or 1) - 1)
+        self.poll_interval = poll_interval
+        self.evict_static = evict_static
+        self.throttled = throttled
+
+        self.moved_at = time.monotonic()
+        self._last_drops = None
+        self._candidates = []
+        # Not retried until the next start
+        self._failed = set()
+        self._stopped = threading.Event()
+        # The running ffmpeg, if any
+        self._process = None
+        self.stats = {
+            'archived': 0,
+            'evicted': 0,
+            'bytes_saved': 0,
+            'failed': 0,
+            'pauses': 0,
+            'state': 'starting',
+        }
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="archiver", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self, timeout=5):
+        """Stop archiving and ffmpeg with it, even while it is held stopped."""
+        self._stopped.set()
+        process = self._process
+        if process is None or process.poll() is not None:
+            return
+        # A stopped process only acts on SIGTERM once it is continued
+        process.send_signal(signal.SIGCONT)
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    def parked(self):
+        speed = self.speed()
+        now = time.monotonic()
+        if speed is not None and speed >= PARKED_SPEED:
+            self.moved_at = now
+        return now - self.moved_at >= self.parked_minutes * 60
+
+    def busy_reason(self):
+        """Why ffmpeg must not run right now, or None."""
+        if self.throttled:
+            reason = self.throttled()
+            if reason:
+                return reason
+        temperature = cpu_temperature()
+        if temperature is not None and temperature >= self.max_temperature:
+            return f"CPU at {temperature:.1f}°C"
+        load = os.getloadavg()[0]
+        if load >= self.max_load:
+            return f"load {load:.2f}"
+        if self.dropped_frames is not None:
+            drops = self.dropped_frames()
+            last, self._last_drops = self._last_drops, drops
+            if last is not None and drops > last:
+                return f"{drops - last} frames dropped"
+        return None
+
+    def run(self):
+        while not self._stopped.is_set():
+            if not self.parked():
+                self.stats['state'] = 'driving'
+            elif self.busy_reason():
+                self.stats['state'] = 'busy'
+            else:
+                self.stats['state'] = 'idle'
+                clip = self._next_clip()
+                if clip:
+                    self.stats['state'] = 'archiving'
+                    self.archive(clip)
+                    continue
+            self._stopped.wait(self.poll_interval)
+
+    def _next_clip(self):
+        if not self._candidates:
+            before = time.time() - self.after_hours * 3600
+            try:
+                self._candidates = [clip for clip in find_candidates(self.clips_folder, before)
+                                    if clip not in self._failed]
+            except OSError as e:
+                logging.error(f"Failed to look for clips to archive: {e}")
+            # Nothing old enough yet, look again once a clip could have aged
+            if not self._candidates:
+                self._stopped.wait(60)
+                return None
+        return self._candidates.pop(0)
+
+    def archive(self, clip_file):
+        """Rewrite one clip, returns True once it is in the archive tier."""
+        try:
+            source = os.stat(clip_file)
+        except FileNotFoundError:
+            # Uploaded and removed in the meantime
+            return False
+        if self.evict_static:
+            activity = read_activity(clip_file)
+            if activity and activity.get("static"):
+                return self.evict(clip_file)
+        tmp_file = os.path.splitext(clip_file)[0] + ARCHIVE_TMP_SUFFIX
+
+        try:
+            self._process = subprocess.Popen(archive_command(self.mode, clip_file, tmp_file),
+                                             stdin=subprocess.DEVNULL)
+            returncode = self._supervise(self._process)
+            if returncode != 0 and self._stopped.is_set():
+                return False
+            if returncode != 0:
+                logging.error(f"Archiving {clip_file} failed with ffmpeg exit code {returncode}")
+                self._failed.add(clip_file)
+                self.stats['failed'] += 1
+                return False
+
+            current = os.stat(clip_file)
+            if (current.st_size, current.st_mtime) != (source.st_size, source.st_mtime):
+                logging.warning(f"{clip_file} changed while it was archived, leaving it alone")
+                return False
+            saved = source.st_size - os.path.getsize(tmp_file)
+            if saved > 0:
+                os.replace(tmp_file, clip_file)
+                # Its frames and byte offsets were those of the original
+                timing_file = sidecar_path(clip_file, TIMING_SUFFIX)
+                if os.path.exists(timing_file):
+                    os.remove(timing_file)
+            self._mark_archived(clip_file)
+        except OSError as e:
+            logging.error(f"Failed to archive {clip_file}: {e}")
+            self._failed.add(clip_file)
+            self.stats['failed'] += 1
+            return False
+        finally:
+            self._process = None
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+        self.stats['archived'] += 1
+        self.stats['bytes_saved'] += max(0, saved)
+        logging.info(f"Archived {clip_file}, {source.st_size} -> {source.st_size - max(0, saved)} bytes")
+        return True
+
+    def evict(self, clip_file):
+        """Delete a static clip, its proxy and its frame timing."""
+        freed = 0
+        for path in (clip_file, sidecar_path(clip_file, PROXY_SUFFIX), sidecar_path(clip_file, TIMING_SUFFIX)):
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                freed += size
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logging.error(f"Failed to evict {path}: {e}")
+                self.stats['failed'] += 1
+                return False
+        self.stats['evicted'] += 1
+        self.stats['bytes_saved'] += freed
+        logging.info(f"Evicted static clip {clip_file}, {freed} bytes freed")
+        return True
+
+    def _pause_reason(self):
+        return self.busy_reason() or (None if self.parked() else "driving")
+
+    def _supervise(self, process):
+        """Wait for ffmpeg, holding it stopped while recording needs the Pi."""
+        while True:
+            try:
+                return process.wait(self.poll_interval)
+            except subprocess.TimeoutExpired:
+                pass
+            if self._stopped.is_set():
+                process.kill()
+                return process.wait()
+
+            reason = self._pause_reason()
+            if reason:
+                logging.info(f"Pausing the archiver: {reason}")
+                process.send_signal(signal.SIGSTOP)
+                self.stats['pauses'] += 1
+                while self._pause_reason() and not self._stopped.wait(self.poll_interval):
+                    pass
+                process.send_signal(signal.SIGCONT)
+
+    def _mark_archived(self, clip_file):
+        clip_id = os.path.splitext(os.path.basename(clip_file))[0]
+        with open(os.path.join(os.path.dirname(clip_file), ARCHIVED_LIST), "a") as f:
+            f.write(clip_id + "\n")
+
+    def report(self):
+        return dict(self.stats, mode=self.mode, after_hours=self.after_hours, queued=len(self._candidates))
@@ -0,0 +1,127 @@
+"""Adaptive bitrate for the recording encoder.
+
+Run as ``python -m spyglass.bitrate <trace.csv>`` to replay a recorded
+clip-size trace through the controller.
+"""
+import argparse
+import csv
+import json
+
+MEBIBIT = 1024 * 1024
+TRACE_FIELDS = ['time', 'seconds', 'bytes', 'bitrate', 'complexity']
+
+
+def base_bitrate(resolution, fps, qf):
+    """Bitrate for a 1080p30-equivalent quality factor, scaled to resolution and fps."""
+    res_qf = (resolution[0] * resolution[1]) / (1920 * 1080)
+    fps_qf = fps / 30
+    return int(fps_qf * qf * res_qf * MEBIBIT)
+
+
+class BitrateController:
+    """Picks the bitrate of the next clip.
+
+    * Scene complexity (0..1) scales the base bitrate between
+      ``0.5 * base`` (night, parked) and ``1.5 * base`` (busy road).
+    * With a retention target the bitrate is capped so that the free disk
+      space lasts ``retention_hours`` of recording.
+    * The bytes each clip really took are compared to the requested
+      bitrate. The encoder often undershoots in easy scenes, and the cap is
+      corrected for that.
+    * Changes are smoothed so that the bitrate does not oscillate.
+    """
+
+    def __init__(self, base, min_bitrate=None, max_bitrate=None, retention_hours=0, smoothing=0.5):
+        self.base = base
+        self.min_bitrate = min_bitrate or base // 4
+        self.max_bitrate = max_bitrate or int(base * 1.5)
+        self.retention_hours = retention_hours
+        self.smoothing = smoothing
+
+        self.bitrate = base
+        self.efficiency = 1.0  # bytes written / bytes requested, smoothed
+
+    def rebase(self, base):
+        """Scale the limits and the current bitrate to a new base, e.g. after a resolution change."""
+        scale = base / self.base
+        self.base = base
+        self.min_bitrate = int(self.min_bitrate * scale)
+        self.max_bitrate = int(self.max_bitrate * scale)
+        self.bitrate = int(self.bitrate * scale)
+
+    def next_bitrate(self, clip_bytes, clip_seconds, free_bytes=None, complexity=None):
+        if clip_seconds > 0 and self.bitrate > 0:
+            measured = clip_bytes * 8 / clip_seconds / self.bitrate
+            measured = min(2.0, max(0.2, measured))
+            self.efficiency += self.smoothing * (measured - self.efficiency)
+
+        target = self.base
+        if complexity is not None:
+            target = self.base * (0.5 + complexity)
+
+        if self.retention_hours and free_bytes is not None:
+            budget = free_bytes * 8 / (self.retention_hours * 3600)
+            target = min(target, budget / self.efficiency)
+
+        self.bitrate += self.smoothing * (target - self.bitrate)
+        self.bitrate = int(min(self.max_bitrate, max(self.min_bitrate, self.bitrate)))
+        return self.bitrate
+
+
+def read_trace(path):
+    with open(path, newline='') as f:
+        return [{k: float(v) for k, v in row.items() if k in TRACE_FIELDS and v != ''} for row in csv.DictReader(f)]
+
+
+def simulate(trace, controller, free_bytes):
+    """Replay a clip-size trace recorded with other bitrates.
+
+    Every clip is assumed to scale linearly with the bitrate it is encoded
+    at, i.e. to keep the bytes/bitrate ratio it had when it was recorded.
+    """
+    bitrates = []
+    total_bytes = 0
+    recorded_seconds = 0
+    for clip in trace:
+        bitrate = controller.bitrate
+        ratio = clip['bytes'] * 8 / (clip['bitrate'] * clip['seconds'])
+        clip_bytes = ratio * bitrate * clip['seconds'] / 8
+        if clip_bytes > free_bytes:
+            break
+
+        free_bytes -= clip_bytes
+        total_bytes += clip_bytes
+        recorded_seconds += clip['seconds']
+        bitrates.append(bitrate)
+        controller.next_bitrate(clip_bytes, clip['seconds'], free_bytes, clip.get('complexity'))
+
+    return {
+        'clips': len(bitrates),
+        'recorded_hours': recorded_seconds / 3600,
+        'bytes': int(total_bytes),
+        'free_bytes': int(free_bytes),
+        'mean_bitrate': int(sum(bitrates) / len(bitrates)) if bitrates else 0,
+        'min_bitrate': min(bitrates, default=0),
+        'max_bitrate': max(bitrates, default=0),
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m spyglass.bitrate',
+                                     description='Replay a clip-size trace through the adaptive bitrate controller.')
+    parser.add_argument('trace', help='CSV written by spyglass with --adaptive_bitrate (bitrate_trace.csv)')
+    parser.add_argument('--base_bitrate', type=int, default=base_bitrate((1920, 1080), 30, 20))
+    parser.add_argument('--min_bitrate', type=int, default=None)
+    parser.add_argument('--max_bitrate', type=int, default=None)
+    parser.add_argument('--retention_hours', type=float, default=0)
+    parser.add_argument('--free_gb', type=float, default=32)
+    parsed_args = parser.parse_args(args)
+
+    controller = BitrateController(parsed_args.base_bitrate, parsed_args.min_bitrate,
+                                   parsed_args.max_bitrate, parsed_args.retention_hours)
+    result = simulate(read_trace(parsed_args.trace), controller, parsed_args.free_gb * 1024 ** 3)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,102 @@
+import math
+import os
+import time
+
 import libcamera
 from spyglass.camera_options import process_controls
+from spyglass.startup import process_start_time
 from picamera2 import Picamera2, Preview
 
+# picamera2's default for video configurations
+DEFAULT_BUFFER_COUNT = 6
+# Frames in flight between the ISP and the encoders, pre_callback included
+BUFFER_SECONDS = 0.1
+MIN_BUFFER_COUNT = 3
+MAX_BUFFER_COUNT = 8
+# Bytes per pixel of the formats spyglass configures
+FORMAT_BYTES = {'XBGR8888': 4, 'XRGB8888': 4, 'BGR888': 3, 'RGB888': 3, 'YUV420': 1.5}
+
+
+def buffer_count_for(fps):
+    """Buffers to keep ``BUFFER_SECONDS`` of frames in flight, plus one being filled and one queued."""
+    return max(MIN_BUFFER_COUNT, min(MAX_BUFFER_COUNT, 2 + math.ceil(fps * BUFFER_SECONDS)))
+
+
+def stream_bytes(stream):
+    if not stream:
+        return 0
+    width, height = stream['size']
+    return int(width * height * FORMAT_BYTES.get(stream.get('format'), 4))
+
+
+def cma_info(meminfo='/proc/meminfo'):
+    """CmaTotal and CmaFree in bytes, or None where the kernel has no CMA."""
+    values = {}
+    try:
+        with open(meminfo) as f:
+            for line in f:
+                name, value = line.split(':', 1)
+                if name in ('CmaTotal', 'CmaFree'):
+                    values[name] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        return None
+    return values or None
+
+
+def pipeline_report(config, headless=False):
+    """Camera buffer memory of ``config``, and how much less it takes than picamera2's defaults.
+
+    The defaults are ``DEFAULT_BUFFER_COUNT`` buffers of both streams, with a
+    lores stream of 640x480 if there is none. The buffers are allocated from
+    CMA, so ``saved_bytes`` comes straight out of ``CmaFree``. None if
+    ``config`` is not a video configuration.
+    """
+    try:
+        buffer_count = int(config['buffer_count'])
+        main = stream_bytes(config['main'])
+        lores = stream_bytes(config.get('lores'))
+    except (KeyError, TypeError, ValueError):
+        return None
+    default_lores = lores or stream_bytes({'size': (640, 480), 'format': 'YUV420'})
+    buffers = buffer_count * (main + lores)
+    default = DEFAULT_BUFFER_COUNT * (main + default_lores)
+    times = os.times()
+    return {
+        'preview': not headless,
+        'lores': config.get('lores', None) is not None,
+        'buffer_count': buffer_count,
+        'buffer_bytes': buffers,
+        'saved_bytes': default - buffers,
+        'cma': cma_info(),
+        # Since the process started, compare it between runs with and without --headless
+        'cpu_percent': round(100 * (times.user + times.system) / max(time.monotonic() - process_start_time(), 1e-3), 1),
+    }
+
+def reconfigure_camera(picam2, main_size=None, lores_size=None, frame_rate=None):
+    """Configure the running camera with new stream sizes or frame rate, returns the seconds it was stopped.
+
+    Every encoder is stopped, the streams they were started on change size.
+    """
+    config = picam2.camera_configuration()
+    controls = dict(config['controls'])
+    if frame_rate:
+        # FrameRate is turned into FrameDurationLimits, the old limits would win
+        controls.pop('FrameDurationLimits', None)
+        controls['FrameRate'] = frame_rate
+    lores = config.get('lores')
+
+    stopped_at = time.monotonic()
+    picam2.stop_encoder()
+    picam2.stop()
+    picam2.configure(picam2.create_video_configuration(main={'size': tuple(main_size or config['main']['size'])},
+                                                       lores={'size': tuple(lores_size or lores['size'])} if lores else None,
+                                                       controls=controls,
+                                                       transform=config.get('transform'),
+                                                       buffer_count=config['buffer_count']))
+    picam2.start()
+    return time.monotonic() - stopped_at
+
+
 def init_camera(
         clip_width: int,
         clip_height: int,
@@ -16,7 +111,10 @@ def init_camera(
         flip_vertical=False,
         control_list: list[list[str]]=[],
         tuning_filter=None,
-        tuning_filter_dir=None):
+        tuning_filter_dir=None,
+        headless=False,
+        lores=True,
+        buffer_count=0):
 
     tuning = None
 
@@ -27,7 +125,11 @@ def init_camera(
         tuning = Picamera2.load_tuning_file(**params)
 
     picam2 = Picamera2(tuning=tuning)
-    picam2.start_preview(Preview.DRM, x=100, y=100, width=640, height=480)
+    if headless:
+        # Nothing to show on, the preview would only cost CPU and memory bandwidth
+        picam2.start_preview(Preview.NULL)
+    else:
+        picam2.start_preview(Preview.DRM, x=100, y=100, width=640, height=480)
 
     controls = {'FrameRate': fps}
 
@@ -44,14 +146,19 @@ def init_camera(
 
     transform = libcamera.Transform(hflip=int(flip_horizontal or upsidedown), vflip=int(flip_vertical or upsidedown))
 
+    if not buffer_count:
+        # With a preview, the lores encoder and the overlay, picamera2's default leaves room to spare
+        buffer_count = buffer_count_for(fps) if headless else DEFAULT_BUFFER_COUNT
+
     # mode = picam2.sensor_modes[1]
 
     # print(mode)
 
     picam2.configure(picam2.create_video_configuration(main={'size': (clip_width, clip_height)}, 
-                                                       lores={"size": (stream_width, stream_height)}, 
+                                                       lores={"size": (stream_width, stream_height)} if lores else None, 
                                                        controls=controls, 
-                                                       transform=transform))
+                                                       transform=transform,
+                                                       buffer_count=buffer_count))
                                                     #    sensor={'output_size': mode['size'], 'bit_depth': mode['bit_depth']}))
 
     return picam2
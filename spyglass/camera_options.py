@@ -1,65 +1,122 @@
 import libcamera
 import ast
+import functools
+import hashlib
+import html
+import json
+import os
 
-def parse_dictionary_to_html_page(camera, parsed_controls='None', processed_controls='None'):
-    html =  """
+STYLE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'resources', 'controls_style.css')
+
+PAGE_HEAD = """
             <!DOCTYPE html>
             <html lang="en">
-            """
-    html += f"""
                 <head>
                     <meta charset="UTF-8">
                     <meta name="viewport" content="width=device-width, initial-scale=1.0">
                     <title>Camera Settings</title>
-                    <style>{get_style()}</style>
+                    <style>{style}</style>
                 </head>
-            """
-    html += f"""
                 <body>
                     <h1>Available camera options</h1>
+            """
+
+PAGE_CONTROLS = """
                     <h3>Parsed Controls: {parsed_controls}</h3>
                     <h3>Processed Controls: {processed_controls}</h3>
             """
-    for control, values in camera.camera_controls.items():
-        html += f"""
+
+CONTROL_CARD = """
                     <div class="card-container">
                         <div class="card">
                             <h2>{control}</h2>
                             <div class="card-content">
                             <div class="setting">
                                 <span class="label">Min:</span>
-                                <span class="value">{values[0]}</span>
+                                <span class="value">{min}</span>
                             </div>
                             <div class="setting">
                                 <span class="label">Max:</span>
-                                <span class="value">{values[1]}</span>
+                                <span class="value">{max}</span>
                             </div>
                             <div class="setting">
                                 <span class="label">Default:</span>
-                                <span class="value">{values[2]}</span>
+                                <span class="value">{default}</span>
                             </div>
                             </div>
                         </div>
                     </div>
                 """
-    html += """
+
+PAGE_TAIL = """
                 </body>
             </html>
             """
-    return html
 
+
+class ControlsCache:
+    """Everything derived from ``camera.camera_controls``.
+
+    picamera2 replaces the ``camera_controls`` dict when the camera is
+    reconfigured, so the cache is rebuilt only when it gets a different dict.
+    """
+
+    def __init__(self):
+        self._source = None
+        self.lower_keys = {}
+        self.cards_html = ''
+        self.json = b'{}'
+        self.etag = ''
+
+    def get(self, camera):
+        controls = camera.camera_controls
+        if controls is not self._source:
+            self._rebuild(controls)
+        return self
+
+    def _rebuild(self, controls):
+        self.lower_keys = {k.lower(): k for k in controls.keys()}
+        self.cards_html = ''.join(
+            CONTROL_CARD.format(control=control, min=values[0], max=values[1], default=values[2])
+            for control, values in controls.items())
+        self.json = json.dumps({
+            control: {'min': values[0], 'max': values[1], 'default': values[2]}
+            for control, values in controls.items()
+        }, default=str).encode('utf-8')
+        self.etag = '"%s"' % hashlib.sha1(self.json).hexdigest()
+        self._source = controls
+
+
+controls_cache = ControlsCache()
+
+
+def parse_dictionary_to_html_page(camera, parsed_controls='None', processed_controls='None'):
+    cache = controls_cache.get(camera)
+    return ''.join([
+        get_page_head(),
+        PAGE_CONTROLS.format(parsed_controls=html.escape(str(parsed_controls)),
+                             processed_controls=html.escape(str(processed_controls))),
+        cache.cards_html,
+        PAGE_TAIL,
+    ])
+
+@functools.lru_cache(maxsize=None)
+def get_page_head():
+    return PAGE_HEAD.format(style=get_style())
+
+@functools.lru_cache(maxsize=None)
 def get_style():
-    with (open('resources/controls_style.css', 'r')) as f:
+    with (open(STYLE_PATH, 'r')) as f:
         return f.read()
 
 def process_controls(camera, controls: list[tuple[str, str]]) -> dict[str, any]:
-    controls_dict_lower = { k.lower(): k for k in camera.camera_controls.keys() }
     if controls == None:
         return {}
+    controls_dict_lower = controls_cache.get(camera).lower_keys
     processed_controls = {}
     for key, value in controls:
         key = key.lower().strip()
-        if key.lower() in controls_dict_lower.keys():
+        if key in controls_dict_lower:
             value = value.lower().strip()
             k = controls_dict_lower[key]
             v = parse_from_string(value)
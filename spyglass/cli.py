@@ -3,25 +3,16 @@
 Parse command line arguments in, invoke server.
 """
 import argparse
+import functools
 import logging
 import re
 import sys
 
-import libcamera
-
-# from picamera2.encoders import MJPEGEncoder, H264Encoder
-# from picamera2.outputs import FileOutput
-
-
-
+# Camera, web server, OpenCV and upload libraries take seconds to import on a
+# Pi Zero. They are imported in main() once the arguments are known to be valid.
+from spyglass import startup
 from spyglass.exif import option_to_exif_orientation
 from spyglass.__version__ import __version__
-from spyglass.camera import init_camera
-# from spyglass.server import StreamingOutput
-from spyglass.server import run_server
-from spyglass import camera_options
-from spyglass.dvr import DVR
-from spyglass.timestamp import Timestamp 
 
 MAX_WIDTH = 1920
 MAX_HEIGHT = 1920
@@ -53,13 +44,29 @@ def main(args=None):
     controls = parsed_args.controls
     if parsed_args.controls_string:
         controls += [c.split('=') for c in parsed_args.controls_string.split(',')]
+    if parsed_args.live_upload and parsed_args.static_threshold > 0 and parsed_args.static_upload_policy != 'always':
+        # A live upload starts with the clip, before its activity is known
+        logging.warning("--static_upload_policy only holds back proxies with --live_upload, "
+                        "full resolution clips are uploaded while they are recorded")
     if parsed_args.list_controls:
+        from spyglass import camera_options
         print('Available controls:\n'+camera_options.get_libcamera_controls_string(0))
         return
-    
 
+    if parsed_args.simulate:
+        # Must come before anything imports picamera2 or libcamera
+        from spyglass import simulator
+        simulator.install()
 
-    picam2 = init_camera(
+    from spyglass.camera import init_camera
+    from spyglass.dvr import DVR
+    from spyglass.timestamp import Timestamp
+    from spyglass.profiler import FrameProfiler
+    startup.mark("imports")
+
+    # Called again to reopen the camera after POST /recording/pause released it
+    open_camera = functools.partial(
+        init_camera,
         clip_width,
         clip_height,
         stream_width,
@@ -73,13 +80,21 @@ def main(args=None):
         parsed_args.flip_vertical,
         controls,
         parsed_args.tuning_filter,
-        parsed_args.tuning_filter_dir)
+        parsed_args.tuning_filter_dir,
+        headless=parsed_args.headless,
+        lores=needs_lores(parsed_args),
+        buffer_count=parsed_args.buffer_count)
+    picam2 = open_camera()
 
 
     clip_duration = parsed_args.clip_duration
 
     sftp_info = (parsed_args.sftp_user, parsed_args.sftp_password, parsed_args.sftp_server, parsed_args.sftp_dir)
 
+    profiler = None
+    if parsed_args.profile:
+        profiler = FrameProfiler(parsed_args.profile_window, parsed_args.profile_dump)
+
     dvr = DVR(picam2, 
               parsed_args.clips_folder, 
               (clip_width, clip_height), 
@@ -89,18 +104,77 @@ def main(args=None):
               , parsed_args.gps_serial_port, 
               parsed_args.disk_alert_threshold, 
               parsed_args.cpu_temp_alert_threshold, 
-              sftp_info)
+              sftp_info,
+              profiler=profiler,
+              thumbnail_interval=parsed_args.thumbnail_interval,
+              proxy_bitrate=parsed_args.proxy_bitrate,
+              full_upload_policy=parsed_args.full_upload_policy,
+              adaptive_bitrate=parsed_args.adaptive_bitrate,
+              retention_hours=parsed_args.retention_hours,
+              staging_folder=parsed_args.staging_folder,
+              worker_processes=parsed_args.worker_processes,
+              live_upload=parsed_args.live_upload,
+              fragment_duration=parsed_args.fragment_duration,
+              archive_after_hours=parsed_args.archive_after_hours,
+              archive_mode=parsed_args.archive_mode,
+              archive_max_temperature=parsed_args.archive_max_temperature,
+              archive_parked_minutes=parsed_args.archive_parked_minutes,
+              static_threshold=parsed_args.static_threshold,
+              static_upload_policy=parsed_args.static_upload_policy,
+              evict_static=parsed_args.evict_static,
+              event_pre_roll=parsed_args.event_pre_roll,
+              event_post_roll=parsed_args.event_post_roll,
+              governor_levels=parsed_args.governor_levels,
+              governor_temperatures=parsed_args.governor_temperatures,
+              governor_hysteresis=parsed_args.governor_hysteresis,
+              governor_max_load=parsed_args.governor_max_load,
+              camera_factory=open_camera)
     
+    from spyglass.camera import pipeline_report
+    report = pipeline_report(picam2.camera_configuration(), parsed_args.headless)
+    if report:
+        logging.info(f"Camera pipeline: {report}")
+
     timestamp = Timestamp(picam2, dvr)
     picam2.start()
+    startup.mark("camera_started")
+    # Record first, the web server and the network come up while it runs
+    dvr.start()
+
+    # The web server is only needed once the camera is running
+    from spyglass.server import run_server
+    from spyglass.hls import HlsStream
+
+    hls_stream = None
+    if parsed_args.hls_bitrate > 0:
+        hls_stream = HlsStream(picam2, parsed_args.fps, parsed_args.hls_bitrate, parsed_args.hls_segments)
 
 
     try:
-        run_server(bind_address, port, picam2, dvr, stream_url, snapshot_url, orientation_exif)
+        run_server(bind_address, port, picam2, dvr, stream_url, snapshot_url, orientation_exif, hls_stream=hls_stream,
+                   loop_lag_threshold=parsed_args.loop_lag_threshold, headless_camera=parsed_args.headless)
     finally:
-        picam2.stop_recording()
+        # Not picam2 if recording was paused and resumed
+        dvr.picam2.stop_recording()
+        if profiler:
+            profiler.dump()
+        if dvr.write_behind:
+            dvr.write_behind.stop()
+        if dvr.archiver:
+            # Also ends an ffmpeg it holds stopped, which would be left behind
+            dvr.archiver.stop()
+        if dvr.supervisor:
+            dvr.supervisor.stop()
+
+
 
 
+def needs_lores(parsed_args):
+    """Whether anything uses the lores stream. Headless, only thumbnails, scene statistics, proxies and HLS do."""
+    if not parsed_args.headless:
+        return True
+    return (parsed_args.thumbnail_interval > 0 or parsed_args.adaptive_bitrate or parsed_args.static_threshold > 0
+            or parsed_args.proxy_bitrate > 0 or parsed_args.hls_bitrate > 0)
 
 
 def resolution_type(arg_value, pat=re.compile(r"^\d+x\d+$")):
@@ -115,6 +189,21 @@ def control_type(arg_value: str):
         raise argparse.ArgumentTypeError(f"invalid control: Missing value: {arg_value}")
 
 
+def float_list_type(arg_value):
+    try:
+        return [float(v) for v in arg_value.split(',') if v.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid value: comma separated numbers expected: {arg_value}")
+
+
+def governor_levels_type(arg_value):
+    from spyglass.governor import parse_levels
+    try:
+        return parse_levels(arg_value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"invalid value: {e}")
+
+
 def orientation_type(arg_value):
     if arg_value in option_to_exif_orientation:
         return option_to_exif_orientation[arg_value]
@@ -123,6 +212,7 @@ def orientation_type(arg_value):
 
 
 def parse_autofocus(arg_value):
+    import libcamera
     if arg_value == 'manual':
         return libcamera.controls.AfModeEnum.Manual
     elif arg_value == 'continuous':
@@ -132,6 +222,7 @@ def parse_autofocus(arg_value):
 
 
 def parse_autofocus_speed(arg_value):
+    import libcamera
     if arg_value == 'normal':
         return libcamera.controls.AfSpeedEnum.Normal
     elif arg_value == 'fast':
@@ -176,6 +267,10 @@ def get_parser():
                         help='Sets the URL for the mjpeg stream')
     parser.add_argument('-sn', '--snapshot_url', type=str, default='/snapshot',
                         help='Sets the URL for snapshots (single frame of stream)')
+    parser.add_argument('--hls_bitrate', type=int, default=0,
+                        help='Bitrate of the H.264 HLS stream at /hls/live.m3u8, e.g. 1000000 (0 disables HLS).')
+    parser.add_argument('--hls_segments', type=int, default=6,
+                        help='Number of one second HLS segments kept in memory.')
     parser.add_argument('-af', '--autofocus', type=str, default='continuous', choices=['manual', 'continuous'],
                         help='Autofocus mode')
     parser.add_argument('-l', '--lensposition', type=float, default=0.0,
@@ -213,6 +308,14 @@ def get_parser():
     parser.add_argument('-tfd', '--tuning_filter_dir', type=str, default=None, nargs='?',const="",
                         help='Set the directory to look for tuning filters.')
     parser.add_argument('--list-controls', action='store_true', help='List available camera controls and exits.')
+    parser.add_argument('--headless', action='store_true',
+                        help='No preview window. The lores stream, and with it /stream and /snapshot, is only\n'
+                             'configured if thumbnails, --adaptive_bitrate, --static_threshold, proxies or HLS need it.')
+    parser.add_argument('--buffer_count', type=int, default=0,
+                        help='Camera buffers per stream. 0 keeps picamera2\'s 6, with --headless it picks them\n'
+                             'from --fps.')
+    parser.add_argument('--simulate', action='store_true',
+                        help='Use a simulated camera with synthetic frames instead of picamera2.')
     parser.add_argument('--clips_folder', type=str, default="clips", help='Folder to store DVR clips.')
     parser.add_argument('-qf', '--quality_factor', type=int, default=20, help='Quality factor for the video recording.')
     parser.add_argument('--clip_duration', type=int, default=10, help='Duration of each clip in seconds.')
@@ -220,6 +323,52 @@ def get_parser():
     parser.add_argument('--clip_fps', type=int, default=30, help='Frames per second of the video recording.')
     parser.add_argument('--clip_resolution', type=resolution_type, default='1920x1080',
                         help='Resolution of the images width x height. Maximum is 1920x1920.')
+    parser.add_argument('--thumbnail_interval', type=float, default=0,
+                        help='Seconds between the frames sampled for clip thumbnails and sprite sheets (0 disables).')
+    parser.add_argument('--adaptive_bitrate', action='store_true',
+                        help='Adjust the recording bit rate between clips to scene complexity and disk space.')
+    parser.add_argument('--retention_hours', type=float, default=0,
+                        help='With --adaptive_bitrate, keep the bit rate low enough for the free disk space '
+                             'to last this many hours of recording (0 ignores disk space).')
+    parser.add_argument('--proxy_bitrate', type=int, default=0,
+                        help='Bitrate of a low resolution proxy clip recorded from the stream resolution '
+                             'next to every clip (0 disables proxies).')
+    parser.add_argument('--staging_folder', type=str, default=None,
+                        help='Record clips into this folder (a tmpfs such as /dev/shm/spyglass) and write them\n'
+                             'to --clips_folder afterwards in large sequential chunks. Saves SD card wear.')
+    parser.add_argument('--fragment_duration', type=float, default=1.0,
+                        help='Seconds between keyframes. Clips are fragmented MP4 with one fragment per keyframe.')
+    parser.add_argument('--archive_after_hours', type=float, default=0,
+                        help='Re-compress clips older than this many hours while the car is parked (0 disables it).')
+    parser.add_argument('--archive_mode', type=str, default='keyframes', choices=['keyframes', 'transcode'],
+                        help='How clips are re-compressed.\n'
+                             '  keyframes - keep only the keyframes, no decoding\n'
+                             '  transcode - re-encode at 480p, full motion but CPU heavy')
+    parser.add_argument('--archive_max_temperature', type=float, default=70.0,
+                        help='Pause archiving while the CPU is at least this hot (°C).')
+    parser.add_argument('--archive_parked_minutes', type=float, default=5,
+                        help='Minutes without GPS movement before the car counts as parked and archiving starts.')
+    parser.add_argument('--event_pre_roll', type=float, default=0,
+                        help='Seconds of recording kept in memory and saved when an incident is marked with\n'
+                             'POST /events. 0, the default, disables the memory buffer, incidents still lock\n'
+                             'their clips.')
+    parser.add_argument('--event_post_roll', type=float, default=10,
+                        help='Seconds after a marked incident whose clips are locked and uploaded first.')
+    parser.add_argument('--governor_temperatures', type=float_list_type, default=[],
+                        help='CPU temperatures (°C) at which the governor enters each of --governor_levels, comma\n'
+                             'separated and ascending, e.g. 70,75,78,80. Empty disables the temperature levels.')
+    parser.add_argument('--governor_levels', type=governor_levels_type, default=None,
+                        help='What the governor gives up at each level, in order (default: '
+                             'stream_fps,viewers,bitrate,background).\n'
+                             '  stream_fps - send MJPEG viewers 5 frames a second\n'
+                             '  viewers    - disconnect MJPEG viewers\n'
+                             '  bitrate    - record clips at half their bit rate\n'
+                             '  frame_rate - run the camera at half its frame rate\n'
+                             '  background - pause uploads and archiving')
+    parser.add_argument('--governor_hysteresis', type=float, default=5.0,
+                        help='Degrees below its temperature the CPU must cool down to before a level is left.')
+    parser.add_argument('--governor_max_load', type=float, default=0,
+                        help='Load average that adds a governor level (0 ignores the load).')
     parser.add_argument('--gps_serial_port', type=str, default='/dev/ttyACM0', help='Serial port for GPS data.')
 
     parser.add_argument('--disk_alert_threshold', type=float, default=0.10, help="Disk Space Threshold to Send warning.")
@@ -229,6 +378,35 @@ def get_parser():
     parser.add_argument('--sftp_password', type=str, default="root", help="SFTP Server password.")
     parser.add_argument('--sftp_server', type=str, default="127.0.0.1", help="SFTP Server url.")
     parser.add_argument('--sftp_dir', type=str, default="/", help="SFTP Server dir to store clips.")
+    parser.add_argument('--full_upload_policy', type=str, default='always', choices=['always', 'wifi', 'on_request'],
+                        help='When to upload full resolution clips. Proxies are always uploaded first.\n'
+                             '  always     - upload every clip\n'
+                             '  wifi       - only while the default route is a wireless interface\n'
+                             '  on_request - only after POST /videos/<clip_id>/upload')
+    parser.add_argument('--static_threshold', type=float, default=0,
+                        help='Clips whose activity (the largest frame to frame difference of the stream resolution,\n'
+                             '0 to 1) stays below this are static. 0 disables the activity score.')
+    parser.add_argument('--static_upload_policy', type=str, default='on_request', choices=['always', 'wifi', 'on_request'],
+                        help='When to upload static clips and their proxies, after all other clips. Same values as '
+                             '--full_upload_policy.')
+    parser.add_argument('--evict_static', action='store_true',
+                        help='With --archive_after_hours, delete static clips instead of archiving them.')
+    parser.add_argument('--live_upload', action='store_true',
+                        help='Upload full resolution clips fragment by fragment while they are recorded.\n'
+                             'They are sent before their activity is known, --static_upload_policy does not\n'
+                             'apply to them.')
+
+    parser.add_argument('--worker_processes', action='store_true',
+                        help='Run uploads, GPS and status reports in separate processes instead of threads.')
+    parser.add_argument('--loop_lag_threshold', type=float, default=0.1,
+                        help='Log when the web server event loop is blocked for longer than this many seconds, '
+                             'see /loop (0 disables).')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time every frame through overlay, encoders and outputs. Results at /profile.')
+    parser.add_argument('--profile_window', type=int, default=300,
+                        help='Number of recent frames used for the profiling percentiles.')
+    parser.add_argument('--profile_dump', type=str, default=None,
+                        help='File to periodically write collapsed stacks to, for flame graph tools.')
 
 
 
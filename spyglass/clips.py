@@ -0,0 +1,88 @@
+import datetime
+import json
+import os
+import re
+
+CLIP_PREFIX = "clip_"
+TMP_PREFIX = "TMP_"
+CLIP_EXTENSION = ".mp4"
+CLIP_TIME_FORMAT = "%Y-%m-%d_%H-%M-%S"
+DAY_FORMAT = "%Y-%m-%d"
+
+THUMBNAIL_SUFFIX = ".thumb.jpg"
+SPRITE_SUFFIX = ".sprite.jpg"
+PROXY_SUFFIX = ".proxy.mp4"
+ACTIVITY_SUFFIX = ".activity.json"
+TIMING_SUFFIX = ".timing"
+# Clip ids kept on the card after upload and never archived, one per line, in every day folder
+LOCKED_LIST = "locked.txt"
+
+CLIP_ID_PATTERN = re.compile(r"^clip_(\d{4}-\d{2}-\d{2})_\d{2}-\d{2}-\d{2}$")
+
+
+def clip_id_for(start_time: datetime.datetime) -> str:
+    return CLIP_PREFIX + start_time.strftime(CLIP_TIME_FORMAT)
+
+
+def clip_start_time(clip_id: str) -> datetime.datetime:
+    if not CLIP_ID_PATTERN.match(clip_id):
+        raise ValueError(f"invalid clip id: {clip_id}")
+    return datetime.datetime.strptime(clip_id[len(CLIP_PREFIX):], CLIP_TIME_FORMAT)
+
+
+def clip_path(clips_folder: str, clip_id: str, suffix: str = CLIP_EXTENSION) -> str:
+    """Path of a clip (or one of its sidecar files) inside its day folder.
+
+    Raises ``ValueError`` for ids that are not clip names, so a request can
+    never escape the clips folder.
+    """
+    match = CLIP_ID_PATTERN.match(clip_id)
+    if not match:
+        raise ValueError(f"invalid clip id: {clip_id}")
+    return os.path.join(clips_folder, match.group(1), clip_id + suffix)
+
+
+def sidecar_path(clip_file: str, suffix: str) -> str:
+    base, _ = os.path.splitext(clip_file)
+    return base + suffix
+
+
+def activity_path(clip_file: str) -> str:
+    """Activity sidecar of a clip, shared by the clip and its proxy."""
+    if clip_file.endswith(PROXY_SUFFIX):
+        clip_file = clip_file[:-len(PROXY_SUFFIX)] + CLIP_EXTENSION
+    return sidecar_path(clip_file, ACTIVITY_SUFFIX)
+
+
+def read_activity(clip_file: str):
+    """Scene statistics recorded with a clip, or None if there are none."""
+    try:
+        with open(activity_path(clip_file)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _clip_id_of(clip_file: str) -> str:
+    name = os.path.basename(clip_file)
+    if name.endswith(PROXY_SUFFIX):
+        return name[:-len(PROXY_SUFFIX)]
+    return os.path.splitext(name)[0]
+
+
+def lock_clip(clip_file: str) -> None:
+    with open(os.path.join(os.path.dirname(clip_file), LOCKED_LIST), "a") as f:
+        f.write(_clip_id_of(clip_file) + "\n")
+
+
+def locked_clips(day_folder: str) -> set:
+    try:
+        with open(os.path.join(day_folder, LOCKED_LIST)) as f:
+            return set(f.read().split())
+    except FileNotFoundError:
+        return set()
+
+
+def is_locked(clip_file: str) -> bool:
+    """Whether a clip, or the clip of a proxy, belongs to an incident."""
+    return _clip_id_of(clip_file) in locked_clips(os.path.dirname(clip_file))
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+from collections import deque
+
+_MISSING = object()
+
+
+def values_match(reported, requested, tolerance=0.05):
+    """Compare a value from frame metadata with a requested control value.
+
+    The sensor quantizes some controls (e.g. ``ExposureTime`` to whole lines),
+    so numbers only need to be within ``tolerance`` of each other.
+    """
+    if isinstance(requested, (list, tuple)) and isinstance(reported, (list, tuple)):
+        return len(reported) == len(requested) and all(
+            values_match(a, b, tolerance) for a, b in zip(reported, requested))
+    if isinstance(requested, bool) or isinstance(reported, bool):
+        return reported == requested
+    if isinstance(requested, (int, float)) and isinstance(reported, (int, float)):
+        return abs(reported - requested) <= tolerance * max(abs(requested), 1)
+    return reported == requested
+
+
+class ControlUpdateQueue:
+    """Coalesces camera control updates and applies them from the frame callback.
+
+    Values equal to the ones already applied are dropped, bursts are merged,
+    and ``set_controls`` is called at most once per frame. For controls that
+    show up in the frame metadata, the number of frames and the time until
+    the new value took effect are recorded.
+    """
+
+    def __init__(self, camera, settle_frames=30, history=50):
+        self.camera = camera
+        self.settle_frames = settle_frames
+
+        self.applied = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+        self._frame = 0
+        self._waiting = {}  # control -> (value, applied at, frame)
+        self.latencies = deque(maxlen=history)
+
+    def submit(self, controls):
+        """Queue ``controls``; returns the ones that actually change something."""
+        changes = {}
+        with self._lock:
+            for control, value in controls.items():
+                if self.applied.get(control, _MISSING) == value:
+                    # Back to the applied value, forget an update still waiting
+                    self._pending.pop(control, None)
+                    continue
+                self._pending[control] = value
+                changes[control] = value
+        return changes
+
+    def process_frame(self, request):
+        self._frame += 1
+        if self._waiting:
+            self._check_settled(request.get_metadata())
+
+        if not self._pending:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        self.camera.set_controls(pending)
+        now = time.monotonic()
+        self.applied.update(pending)
+        for control, value in pending.items():
+            self._waiting[control] = (value, now, self._frame)
+
+    def _check_settled(self, metadata):
+        now = time.monotonic()
+        for control, (value, applied_at, frame) in list(self._waiting.items()):
+            frames = self._frame - frame
+            if control in metadata and values_match(metadata[control], value):
+                self.latencies.append({'control': control, 'frames': frames,
+                                       'ms': round((now - applied_at) * 1000, 1)})
+                del self._waiting[control]
+            elif frames >= self.settle_frames:
+                # Not every control is reported back in the metadata
+                self.latencies.append({'control': control, 'frames': None, 'ms': None})
+                del self._waiting[control]
+                logging.debug(f"No metadata confirmed {control}={value} after {frames} frames")
+
+    def report(self):
+        with self._lock:
+            pending = dict(self._pending)
+        return {
+            'applied': dict(self.applied),
+            'pending': pending,
+            'latencies': list(self.latencies),
+        }
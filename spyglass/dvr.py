@@ -1,20 +1,53 @@
+import json
 import logging
 import os
 import sys
 import datetime
+import shutil
+import time
 # from time import sleep
-from threading import Thread
-from picamera2.encoders import H264Encoder 
-import serial
-import pynmea2
-from picamera2.outputs import FfmpegOutput
-from .upload_clips import UploadClips
-import telegram_send
+from threading import Event, Lock, Thread
+# picamera2, serial, pynmea2, telegram_send and the uploader are imported where
+# they are used so that startup does not wait for them.
+from . import startup
+from .clips import PROXY_SUFFIX, TIMING_SUFFIX, TMP_PREFIX, activity_path, clip_id_for, sidecar_path
+from .control_queue import ControlUpdateQueue
+from .bitrate import TRACE_FIELDS, BitrateController, base_bitrate
+from .staging import WriteBehind
+from .recovery import ClipRecovery
+from .incidents import Incidents
+from .timing import TimingWriter
+from .event_loop import CAMERA_EXECUTOR, run_blocking
 import asyncio
 from queue import Queue
 
+# Every fragment written so far stays playable if recording stops abruptly,
+# and complete fragments can be uploaded while the clip grows
+FRAGMENTED_MP4_OPTIONS = "-movflags +frag_keyframe+empty_moov+default_base_moof -flush_packets 1 -f mp4"
+
+
+# Changed with POST /recording/config, applied at the next clip boundary
+RECORDING_PARAMETERS = ('clip_fps', 'clip_resolution', 'clip_duration', 'quality_factor', 'fps', 'resolution')
+
+
+def parse_resolution(value):
+    """``(width, height)`` of a ``<width>x<height>`` string."""
+    try:
+        width, height = (int(v) for v in value.split('x'))
+    except ValueError:
+        raise ValueError(f"invalid resolution: {value}, <width>x<height> expected")
+    if not (0 < width <= 1920 and 0 < height <= 1920):
+        raise ValueError(f"invalid resolution: {value}, at most 1920x1920")
+    return width, height
+
+
+def final_clip_path(today_folder, tmp_file):
+    # Replace only the first occurrence
+    return os.path.join(today_folder, os.path.basename(tmp_file).replace(TMP_PREFIX, "", 1))
+
+
 class DVR:
-    def __init__(self, picam2, clips_folder, resolution, fps, qf, clip_duration, update_interval, gps_serial_port, disk_alert_threshold, cpu_temp_alert_threshold, sftp_info):
+    def __init__(self, picam2, clips_folder, resolution, fps, qf, clip_duration, update_interval, gps_serial_port, disk_alert_threshold, cpu_temp_alert_threshold, sftp_info, profiler=None, thumbnail_interval=0, proxy_bitrate=0, full_upload_policy='always', adaptive_bitrate=False, retention_hours=0, staging_folder=None, worker_processes=False, live_upload=False, fragment_duration=1.0, archive_after_hours=0, archive_mode='keyframes', archive_max_temperature=70.0, archive_parked_minutes=5, static_threshold=0, static_upload_policy='always', evict_static=False, event_pre_roll=0, event_post_roll=10, governor_levels=None, governor_temperatures=(), governor_hysteresis=5.0, governor_max_load=0, camera_factory=None):
         self.clips_folder = clips_folder
         self.resolution = resolution
         self.fps = fps
@@ -26,26 +59,134 @@ class DVR:
         self.cpu_temp_alert_threshold = cpu_temp_alert_threshold
 
         self.sftp_user, self.sftp_password, self.sftp_server, self.sftp_dir = sftp_info # Info from SFTP COnnection to upload clips. It is a tuple
+        self.full_upload_policy = full_upload_policy
+        # Clips whose activity stays below static_threshold are static (0 disables it)
+        self.static_threshold = static_threshold
+        self.static_upload_policy = static_upload_policy
+        self.evict_static = evict_static
+
+        # Bitrate of the low resolution proxy recorded from the lores stream (0 disables it)
+        self.proxy_bitrate = proxy_bitrate
+
+        # Clips are fragmented MP4 with a keyframe, and so a fragment, every fragment_duration seconds
+        self.fragment_duration = fragment_duration
+        # Upload clips fragment by fragment while they are recorded
+        self.live_upload = live_upload
+
+        # Re-compress clips older than archive_after_hours while parked (0 disables it)
+        self.archive_after_hours = archive_after_hours
+        self.archive_mode = archive_mode
+        self.archive_max_temperature = archive_max_temperature
+        self.archive_parked_minutes = archive_parked_minutes
+        self.archiver = None
 
         self.picam2 = picam2
+        # Opens and configures the camera again after pause() released it (None disables pausing)
+        self.camera_factory = camera_factory
+        self.profiler = profiler
+        self.control_queue = ControlUpdateQueue(picam2)
         self._init_clips_folder()
+
+        self.thumbnailer = None
+        if thumbnail_interval > 0:
+            from .thumbnails import ClipThumbnailer
+            lores_size = picam2.camera_configuration()["lores"]["size"]
+            self.thumbnailer = ClipThumbnailer(thumbnail_interval, lores_size)
+
+        self.scene_stats = None
+        self.bitrate_controller = None
+        if adaptive_bitrate or static_threshold > 0:
+            from .scene import SceneStats
+            self.scene_stats = SceneStats(picam2.camera_configuration()["lores"]["size"])
+        if adaptive_bitrate:
+            self.bitrate_controller = BitrateController(base_bitrate(resolution, fps, qf), retention_hours=retention_hours)
+            trace_path = os.path.join(clips_folder, "bitrate_trace.csv")
+            if not os.path.exists(trace_path):
+                with open(trace_path, "w") as f:
+                    f.write(",".join(TRACE_FIELDS) + "\n")
+
+        # Clips are recorded into RAM and written to the card in large sequential chunks
+        self.write_behind = WriteBehind(staging_folder) if staging_folder else None
+
+        # Pre-roll of incidents marked with POST /events, fed by the recording encoder (0 disables it)
+        self.event_pre_roll = event_pre_roll
+        self.event_post_roll = event_post_roll
+        self.ring_buffer = None
+        if event_pre_roll > 0:
+            from .ringbuffer import H264RingBuffer
+            max_bitrate = self.bitrate_controller.max_bitrate if self.bitrate_controller else base_bitrate(resolution, fps, qf)
+            self.ring_buffer = H264RingBuffer(event_pre_roll, fps, max_bitrate, fragment_duration)
+        self.incidents = None
+        # Sensor timestamp and wall clock time of every recorded frame
+        self.timing_writer = TimingWriter()
+
+        # Degrades capture while the CPU is hot or overloaded (no temperatures and no load disables it)
+        self.governor = None
+        if governor_temperatures or governor_max_load:
+            from .governor import DEFAULT_LEVELS, Governor
+            self.governor = Governor(governor_levels or DEFAULT_LEVELS, governor_temperatures, governor_hysteresis,
+                                     governor_max_load, on_change=self._governor_changed)
+
         self.thread = None
+        self.upload_clips_manager = None
+        self.recovery = None
+        # Run uploads, GPS and status reports in worker processes instead of threads
+        self.worker_processes = worker_processes
+        self.supervisor = None
 
         self.last_gps_data = None
+        # km/h, from the RMC sentences
+        self.last_gps_speed = None
         
         self.is_recording = True
+        # Set once the first clip is being recorded, the other subsystems start after that
+        self.recording_started = Event()
+        self._first_frame_seen = False
 
+        self.gps_serial_port = gps_serial_port
         self.gps_available = False
 
-        
-        if gps_serial_port: 
-            try:
-                self.gps_serial = serial.Serial(gps_serial_port, 9600, timeout=1)
-                self.gps_available = True
-                logging.info(f"Opened GPS serial port {gps_serial_port}")
-            except serial.SerialException as e:
-                logging.error(f"Failed to open GPS serial port {gps_serial_port}: {e}")
-                self.gps_available = False
+        # Recording parameters waiting for the next clip boundary
+        self._pending_config = {}
+        self._config_lock = Lock()
+        self._blackout_pending = False
+        self._previous_clip_end = None
+        self.config_stats = {
+            'applied': 0,
+            'last_change': None,
+            # Between the last frame of a clip and the first of the next, without and with a change
+            'clip_gap_ms': None,
+            'last_blackout_ms': None,
+        }
+
+        # POST /recording/pause releases the camera for another program, everything else keeps running
+        self.paused = False
+        self._pause_requested = False
+        self._pause_lock = Lock()
+        self._released = Event()
+        self._resumed = Event()
+        self._resume_error = None
+        # Set by the recording loop, pause() and resume() wake it from another thread
+        self._recording_loop = None
+        self._wake = None
+        self.pause_stats = {
+            'pauses': 0,
+            'paused_since': None,
+            # Until the camera was released, and until recording started again
+            'last_pause_ms': None,
+            'last_resume_ms': None,
+        }
+
+    def _open_gps(self):
+        import serial
+
+        try:
+            self.gps_serial = serial.Serial(self.gps_serial_port, 9600, timeout=1)
+            self.gps_available = True
+            logging.info(f"Opened GPS serial port {self.gps_serial_port}")
+        except serial.SerialException as e:
+            logging.error(f"Failed to open GPS serial port {self.gps_serial_port}: {e}")
+            self.gps_available = False
 
     def _init_clips_folder(self):
         if not self.clips_folder:
@@ -66,15 +207,235 @@ class DVR:
             sys.exit(1)
 
     def _get_recording_encoder(self):
-        res_qf = (self.resolution[0] * self.resolution[1]) / (1920 * 1080)
-        fps_qf = (30 / self.fps) * self.fps
-        bit_rate = int(fps_qf * self.qf * res_qf * 1024 * 1024)
+        from picamera2.encoders import H264Encoder
 
+        bit_rate = self._clip_bitrate()
         logging.info(f"Bit rate: {bit_rate}")
-        encoder = H264Encoder(bitrate=bit_rate)
+        encoder = H264Encoder(bitrate=bit_rate, iperiod=self._iperiod())
         return encoder
 
+    def _clip_bitrate(self):
+        if self.bitrate_controller:
+            bit_rate = self.bitrate_controller.bitrate
+        else:
+            bit_rate = base_bitrate(self.resolution, self.fps, self.qf)
+        return self.governor.clip_bitrate(bit_rate) if self.governor else bit_rate
+
+    def _governor_changed(self, old_level, new_level):
+        entered = self.governor.levels[old_level:new_level]
+        left = self.governor.levels[new_level:old_level]
+        if 'frame_rate' in entered + left:
+            frame_rate = self.picam2.camera_configuration()["controls"].get("FrameRate", self.fps)
+            if 'frame_rate' in entered:
+                frame_rate *= self.governor.frame_rate_factor
+            self.control_queue.submit({"FrameRate": frame_rate})
+        if self.upload_clips_manager:
+            if 'background' in entered:
+                self.upload_clips_manager.pause()
+            elif 'background' in left:
+                self.upload_clips_manager.resume()
+
+    def request_reconfigure(self, changes):
+        """Queue new recording parameters (see RECORDING_PARAMETERS) for the next clip, returns all pending ones."""
+        parsed = {}
+        for name, value in changes.items():
+            if value is None:
+                continue
+            if name not in RECORDING_PARAMETERS:
+                raise ValueError(f"unknown recording parameter: {name}")
+            if name in ('clip_resolution', 'resolution'):
+                parsed[name] = parse_resolution(value) if isinstance(value, str) else tuple(value)
+            else:
+                parsed[name] = int(value)
+                if parsed[name] <= 0:
+                    raise ValueError(f"{name} must be positive")
+        if 'resolution' in parsed and self.picam2.camera_configuration()["lores"] is None:
+            raise ValueError("there is no stream resolution with --headless")
+        with self._config_lock:
+            self._pending_config.update(parsed)
+            return dict(self._pending_config)
+
+    def recording_config(self):
+        config = self.picam2.camera_configuration()
+        lores = config["lores"]
+        current = {
+            'clip_fps': self.fps,
+            'clip_resolution': "x".join(map(str, self.resolution)),
+            'clip_duration': self.clip_duration,
+            'quality_factor': self.qf,
+            'fps': self.control_queue.applied.get("FrameRate", config["controls"].get("FrameRate")),
+            'resolution': "x".join(map(str, lores["size"])) if lores else None,
+        }
+        with self._config_lock:
+            pending = dict(self._pending_config)
+        return dict(self.config_stats, current=current, pending=pending)
+
+    def _apply_config(self):
+        """Apply the pending recording parameters between two clips, returns the new encoders."""
+        from picamera2.encoders import H264Encoder
+        from .camera import reconfigure_camera
+
+        with self._config_lock:
+            changes, self._pending_config = self._pending_config, {}
+        self.fps = changes.get('clip_fps', self.fps)
+        self.resolution = changes.get('clip_resolution', self.resolution)
+        self.qf = changes.get('quality_factor', self.qf)
+        if 'clip_duration' in changes:
+            self.clip_duration = changes['clip_duration']
+            if self.incidents:
+                self.incidents.clip_duration = self.clip_duration
+
+        config = self.picam2.camera_configuration()
+        lores = config["lores"]
+        lores_size = changes.get('resolution')
+        restart = (tuple(self.resolution) != tuple(config["main"]["size"])
+                   or (lores and lores_size and tuple(lores_size) != tuple(lores["size"])))
+        stopped = 0
+        if restart:
+            # The stream sizes are fixed while the camera runs
+            stopped = CAMERA_EXECUTOR.submit(reconfigure_camera, self.picam2, self.resolution, lores_size,
+                                             changes.get('fps')).result()
+            if lores_size:
+                if self.thumbnailer:
+                    from .thumbnails import ClipThumbnailer
+                    self.thumbnailer = ClipThumbnailer(self.thumbnailer.interval, lores_size)
+                if self.scene_stats:
+                    from .scene import SceneStats
+                    self.scene_stats = SceneStats(lores_size)
+        elif 'fps' in changes:
+            self.control_queue.submit({"FrameRate": changes['fps']})
+
+        if {'clip_fps', 'clip_resolution', 'quality_factor'} & changes.keys():
+            base = base_bitrate(self.resolution, self.fps, self.qf)
+            if self.bitrate_controller:
+                self.bitrate_controller.rebase(base)
+            if self.ring_buffer:
+                from .ringbuffer import H264RingBuffer
+                max_bitrate = self.bitrate_controller.max_bitrate if self.bitrate_controller else base
+                self.ring_buffer = H264RingBuffer(self.event_pre_roll, self.fps, max_bitrate, self.fragment_duration)
+                if self.incidents:
+                    self.incidents.ring_buffer = self.ring_buffer
+
+        self._blackout_pending = True
+        self.config_stats['applied'] += 1
+        self.config_stats['last_change'] = {'time': time.time(), 'changes': changes, 'camera_restarted': bool(restart),
+                                            'camera_stopped_ms': round(stopped * 1000, 1)}
+        logging.info(f"Recording parameters changed: {changes}, camera {'restarted' if restart else 'kept running'}")
+
+        encoder = self._get_recording_encoder()
+        proxy_encoder = H264Encoder(bitrate=self.proxy_bitrate, iperiod=self._iperiod()) if self.proxy_bitrate else None
+        return encoder, proxy_encoder
+
+    def _measure_gap(self):
+        # From the frame timing, the clip that just finished against the one before
+        first = self.timing_writer.first_frame_time
+        if first is not None and self._previous_clip_end is not None:
+            gap_ms = round((first - self._previous_clip_end) * 1000, 1)
+            if self._blackout_pending:
+                self.config_stats['last_blackout_ms'] = gap_ms
+                logging.info(f"Recording blackout of the parameter change: {gap_ms} ms")
+            else:
+                self.config_stats['clip_gap_ms'] = gap_ms
+        self._blackout_pending = False
+        self._previous_clip_end = self.timing_writer.last_frame_time
+
+    def pause(self, timeout=10):
+        """Finish the clip being recorded and release the camera, returns once it is released."""
+        if self.camera_factory is None:
+            raise RuntimeError("the camera cannot be opened again, pausing is disabled")
+        with self._pause_lock:
+            if not self.paused:
+                started = time.monotonic()
+                self._released.clear()
+                self._pause_requested = True
+                self._wake_recorder()
+                if not self._released.wait(timeout):
+                    raise TimeoutError("the recorder did not release the camera")
+                self.pause_stats['last_pause_ms'] = round((time.monotonic() - started) * 1000, 1)
+                logging.info(f"Recording paused, camera released in {self.pause_stats['last_pause_ms']} ms")
+            return self.pause_report()
+
+    def resume(self, timeout=10):
+        """Open the camera again and record, returns once recording has started."""
+        with self._pause_lock:
+            if self.paused:
+                started = time.monotonic()
+                self._resumed.clear()
+                self._resume_error = None
+                self._pause_requested = False
+                self._wake_recorder()
+                if not self._resumed.wait(timeout):
+                    raise TimeoutError("the recorder did not start again")
+                if self._resume_error:
+                    raise RuntimeError(f"failed to open the camera: {self._resume_error}")
+                self.pause_stats['last_resume_ms'] = round((time.monotonic() - started) * 1000, 1)
+                logging.info(f"Recording resumed in {self.pause_stats['last_resume_ms']} ms")
+            return self.pause_report()
+
+    def pause_report(self):
+        return dict(self.pause_stats, paused=self.paused)
+
+    def _wake_recorder(self):
+        if self._recording_loop is not None:
+            self._recording_loop.call_soon_threadsafe(self._wake.set)
+
+    async def _sleep(self, seconds):
+        # Like asyncio.sleep, but cut short by pause()
+        try:
+            await asyncio.wait_for(self._wake.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def _hold_paused(self):
+        """Release the camera and wait until resume() could open it again."""
+        await run_blocking(self._release_camera, executor=CAMERA_EXECUTOR)
+        self.paused = True
+        self.pause_stats['pauses'] += 1
+        self.pause_stats['paused_since'] = time.time()
+        self._released.set()
+        while True:
+            while self._pause_requested:
+                await self._wake.wait()
+                self._wake.clear()
+            try:
+                await run_blocking(self._open_camera, executor=CAMERA_EXECUTOR)
+                break
+            except Exception as e:
+                # Still held by the other program, stay paused
+                logging.error(f"Failed to open the camera: {e}")
+                self._resume_error = str(e)
+                self._pause_requested = True
+                self._resumed.set()
+        self.paused = False
+        self.pause_stats['paused_since'] = None
+
+    def _release_camera(self):
+        # Stream, snapshot and HLS encoders too
+        self.picam2.stop_encoder()
+        self.picam2.stop()
+        self.picam2.close()
+        # The pause is not a gap between clips
+        self._previous_clip_end = None
+
+    def _open_camera(self):
+        old = self.picam2
+        camera = self.camera_factory()
+        # With the stream sizes and frame rate of POST /recording/config and the controls of /controls
+        camera.configure(old.camera_configuration())
+        if self.control_queue.applied:
+            camera.set_controls(dict(self.control_queue.applied))
+        camera.pre_callback = old.pre_callback
+        camera.start()
+        self.picam2 = camera
+        self.control_queue.camera = camera
+
+    def _iperiod(self):
+        return max(1, round(self.fps * self.fragment_duration))
+
     async def gather_status(self, disk_alert_threshold, cpu_temp_alert_threshold):
+        import telegram_send
+
         update_interval = 600
         last_update_time = 0  # seconds
 
@@ -145,15 +506,23 @@ class DVR:
           
             except Exception as e:
                 logging.error(f"Failed to get system status: {e}")
+
+            # get_system_status runs free and vcgencmd, do not spin on them
+            await asyncio.sleep(60)
     
     def gather_gps(self): 
+        import pynmea2
 
         update_interval = 4
         last_update_time = 0  # seconds
 
         import time
+
+        if not self.gps_serial_port:
+            return
+        self._open_gps()
         
-        while self.is_recording:
+        while self.is_recording and self.gps_available:
 
             if self.gps_available:
                 gps_data = self.gps_serial.readline()
@@ -172,11 +541,16 @@ class DVR:
                             last_update_time = current_time
 
                             # append the GPS data to .csv file
-                            with open(os.path.join(self.clips_folder, "gps_data.csv"), "a") as f:
-                                f.write(f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{gps_data_str}\n")
+                            self._append(os.path.join(self.clips_folder, "gps_data.csv"), f"{datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{gps_data_str},{current_time:.3f}\n")
 
                         # self.gps_queue.put(gps_data_parsed)
 
+                    elif gps_data.startswith((b'$GPRMC', b'$GNRMC')):
+                        gps_data_parsed = pynmea2.parse(gps_data.decode("utf-8"))
+                        if gps_data_parsed.spd_over_grnd is not None:
+                            # Knots
+                            self.last_gps_speed = float(gps_data_parsed.spd_over_grnd) * 1.852
+
                 except pynmea2.ParseError as e:
                     logging.error(f"Failed to parse GPS data: {e}")
 
@@ -199,18 +573,28 @@ class DVR:
     async def start_recording(self):
         import asyncio
         import time 
+        from picamera2.encoders import H264Encoder
+        from picamera2.outputs import FfmpegOutput
 
         encoder = self._get_recording_encoder()
+        proxy_encoder = H264Encoder(bitrate=self.proxy_bitrate, iperiod=self._iperiod()) if self.proxy_bitrate else None
 
         last_update_time = 0
         update_interval = self.update_interval # every X seconds we record X time video.
 
         last_day  = ""
         today_folder = last_day
+
+        self._recording_loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
         
         while True:
+            if self._pause_requested:
+                await self._hold_paused()
+            if self._pending_config:
+                encoder, proxy_encoder = self._apply_config()
 
-            clip_name = "TMP_clip_" + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+            clip_name = TMP_PREFIX + clip_id_for(datetime.datetime.now())
             clip_path_mp4 = os.path.join(self.clips_folder, clip_name + ".h264")
 
             today = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -223,10 +607,6 @@ class DVR:
 
                 last_day = today
 
-                logging.info(f"Starting sync script for {today}")
-
-                self.upload_clips_manager = UploadClips(today_folder, self.sftp_user, self.sftp_password, self.sftp_server, self.sftp_dir, retry_delay=10)
-
                 # # Create a new thread to run the upload_clips_function
                 # upload_thread = Thread(target=self.upload_clips_function, args=(today_folder,))
 
@@ -235,9 +615,22 @@ class DVR:
                 
 
             clip_path_mp4 = os.path.join(today_folder, clip_name + ".mp4") #".h264")
-            output = FfmpegOutput(clip_path_mp4)
+            staged = self._use_staging(encoder)
+            if staged:
+                clip_path_mp4 = self.write_behind.staging_path(clip_name + ".mp4")
+            output = self.timing_writer.instrument(encoder, FfmpegOutput(f"{FRAGMENTED_MP4_OPTIONS} {clip_path_mp4}"))
+            if self.profiler:
+                output = self.profiler.instrument("h264", encoder, output)
+
+            proxy_file = None
+            if proxy_encoder:
+                proxy_file = sidecar_path(clip_path_mp4, PROXY_SUFFIX)
+                proxy_output = FfmpegOutput(f"{FRAGMENTED_MP4_OPTIONS} {proxy_file}")
+                if self.profiler:
+                    proxy_output = self.profiler.instrument("proxy", proxy_encoder, proxy_output)
 
             current_time = time.time()
+            live_upload = None
 
             # Record X seconds video after every update_interval or every time if its 0
             if update_interval == 0 or (current_time - last_update_time) >= update_interval:
@@ -245,13 +638,28 @@ class DVR:
 
                 try:
                     logging.info(f"Recording clip: {clip_name}")
+                    if self.thumbnailer:
+                        self.thumbnailer.start(self.clip_duration)
+                    if self.scene_stats:
+                        self.scene_stats.reset()
+                    self.timing_writer.start(sidecar_path(final_clip_path(today_folder, clip_path_mp4), TIMING_SUFFIX))
+                    if self.governor:
+                        # Only between clips, a clip keeps one bit rate
+                        encoder.bitrate = self._clip_bitrate()
                     # self.picam2.start_encoder(encoder, clip_path_mp4, name="main")
-                    self.picam2.start_recording(encoder, output, name="main")
+                    await run_blocking(self._start_encoders, encoder, [output, self.ring_buffer] if self.ring_buffer else output,
+                                       proxy_encoder, proxy_output if proxy_encoder else None, executor=CAMERA_EXECUTOR)
+                    self._resumed.set()
+                    if not self.recording_started.is_set():
+                        startup.mark("recording")
+                        self.recording_started.set()
+                    if self.live_upload:
+                        live_upload = self.upload_clips_manager.start_live_upload(clip_path_mp4, final_clip_path(today_folder, clip_path_mp4))
                     # sleep(self.clip_duration)
                     #output.start()
-                    await asyncio.sleep(self.clip_duration)
+                    await self._sleep(self.clip_duration)
                     # self.picam2.stop_encoder()
-                    encoder.stop()
+                    await run_blocking(self._stop_encoders, encoder, proxy_encoder, executor=CAMERA_EXECUTOR)
                     #output.stop()
                     #self.picam2.stop_recording()
                     logging.info(f"Finished recording clip: {clip_name}")
@@ -259,6 +667,10 @@ class DVR:
                     logging.info("Recording cancelled.")
                     self.is_recording = False
 
+                # The rest of the clip is uploaded now that ffmpeg has written it
+                if live_upload:
+                    live_upload.finish()
+
                 # # use ExifTool to add GPS data to the clip
                 # if self.gps_available and self.last_gps_data:
                 #     gps_data = self.last_gps_data
@@ -277,20 +689,129 @@ class DVR:
 
                 # After writing the clip
                 tmp_file = clip_path_mp4
-                final_file = tmp_file.replace("TMP_", "", 1)  # Replace only the first occurrence
+                final_file = final_clip_path(today_folder, tmp_file)
 
+                if self.thumbnailer:
+                    self.thumbnailer.finish(final_file)
 
-                try:
-                    os.rename(tmp_file, final_file)
-                    logging.info(f"Clip renamed: {final_file}")
-                    self.upload_clips_manager.add_file_to_queue(file_path=final_file)
-                except Exception as e:
-                    logging.info(f"Failed to rename file: {e}")
+                # ffmpeg has finished the clip, its fragments can be indexed
+                self.timing_writer.finish(tmp_file)
+                self._measure_gap()
+
+                if self.bitrate_controller:
+                    self._update_bitrate(tmp_file, encoder)
+
+                # Before the clip is queued, the uploader reads it
+                if self.static_threshold > 0:
+                    self._write_activity(final_file)
+
+                # The proxy is queued first so it reaches the server before the full clip
+                if proxy_file:
+                    final_proxy = final_clip_path(today_folder, proxy_file)
+                    self._finish_file(proxy_file, final_proxy, staged)
+
+                # Incidents lock and upload the clip once it is on the card, after write-behind if staged
+                self._finish_file(tmp_file, final_file, staged, finished=self.incidents.clip_finished)
+                # Time from process start to the first complete clip
+                startup.mark("first_clip")
 
             else:
                 logging.info(f"Sleeping. Not recording")
+                self._resumed.set()
+                await self._sleep(update_interval - (current_time - last_update_time))
             
 
+    def _start_encoders(self, encoder, output, proxy_encoder=None, proxy_output=None):
+        # On CAMERA_EXECUTOR like every other call that starts or stops an encoder
+        self.picam2.start_recording(encoder, output, name="main")
+        if proxy_encoder:
+            self.picam2.start_encoder(proxy_encoder, proxy_output, name="lores")
+
+    def _stop_encoders(self, encoder, proxy_encoder=None):
+        encoder.stop()
+        if proxy_encoder:
+            proxy_encoder.stop()
+
+    def _use_staging(self, encoder):
+        if not self.write_behind:
+            return False
+        # Room for this clip, its proxy and one more clip still being written to the card
+        clip_bytes = (encoder.bitrate + self.proxy_bitrate) * self.clip_duration / 8
+        if self.write_behind.has_room_for(2 * clip_bytes):
+            return True
+        logging.warning("Staging folder is full, recording straight to the clips folder")
+        return False
+
+    def _finish_file(self, tmp_file, final_file, staged, finished=None):
+        """Give a finished recording its final name and queue it for upload.
+
+        ``finished(final_file)`` is called once the file has its final name,
+        from the write-behind thread if it was staged.
+        """
+        def in_place(file_path):
+            self.upload_clips_manager.add_file_to_queue(file_path)
+            if finished:
+                finished(file_path)
+
+        if staged:
+            self.write_behind.move(tmp_file, final_file, in_place)
+            return
+        try:
+            os.rename(tmp_file, final_file)
+            logging.info(f"Clip renamed: {final_file}")
+            in_place(final_file)
+        except Exception as e:
+            logging.info(f"Failed to rename file: {e}")
+
+    def _append(self, path, text):
+        if self.write_behind:
+            self.write_behind.append(path, text)
+            return
+        with open(path, "a") as f:
+            f.write(text)
+
+    def _write_activity(self, clip_file):
+        activity = self.scene_stats.activity
+        if activity is None:
+            return
+        static = activity < self.static_threshold
+        try:
+            with open(activity_path(clip_file), "w") as f:
+                json.dump({"activity": round(activity, 4), "motion": round(self.scene_stats.motion, 4),
+                           "detail": round(self.scene_stats.detail, 4), "static": static}, f)
+        except OSError as e:
+            logging.error(f"Failed to write the activity of {clip_file}: {e}")
+            return
+        if static:
+            logging.info(f"Static clip: {clip_file} (activity {activity:.3f})")
+
+    def _update_bitrate(self, clip_file, encoder):
+        try:
+            clip_bytes = os.path.getsize(clip_file)
+        except OSError:
+            return
+
+        free_bytes = shutil.disk_usage(self.clips_folder).free
+        complexity = self.scene_stats.complexity
+        used_bitrate = encoder.bitrate
+        encoder.bitrate = self.bitrate_controller.next_bitrate(clip_bytes, self.clip_duration, free_bytes, complexity)
+        logging.info(f"Clip took {clip_bytes} bytes at {used_bitrate} bit/s (complexity {complexity}), next bit rate: {encoder.bitrate}")
+
+        # Trace for replaying with `python -m spyglass.bitrate`
+        trace_path = os.path.join(self.clips_folder, "bitrate_trace.csv")
+        self._append(trace_path, f"{int(time.time())},{self.clip_duration},{clip_bytes},{used_bitrate},{'' if complexity is None else round(complexity, 3)}\n")
+
+    def process_frame(self, request):
+        # Called from the camera pre_callback for every frame, keep it cheap.
+        if not self._first_frame_seen and self.recording_started.is_set():
+            self._first_frame_seen = True
+            startup.mark("first_recorded_frame")
+        self.control_queue.process_frame(request)
+        if self.scene_stats:
+            self.scene_stats.sample(request)
+        if self.thumbnailer:
+            self.thumbnailer.sample(request)
+
     def list_clips(self, start_time, end_time):
         clips = []
         if os.path.exists(self.clips_folder):
@@ -300,11 +821,66 @@ class DVR:
                     clips.append({"name": clip, "path": clip_path, "size": os.path.getsize(clip_path), "created": os.path.getctime(clip_path)})
         return clips
 
-    async def start_gather_gps_thread(self):
+    def start(self):
+        """Start recording on its own thread and everything else in the background.
+
+        Nothing here waits for the network: the uploader connects from its own
+        thread, and GPS and status reports are started by a background thread
+        once the first clip is recording.
+        """
+        if self.worker_processes:
+            from .workers import Supervisor
+
+            # Clips are queued right away, the workers are started with the other subsystems
+            self.supervisor = Supervisor(self)
+            self.upload_clips_manager = self.supervisor.uploads
+        else:
+            from .upload_clips import UploadClips
+
+            # One uploader for all day folders, it only starts a thread here
+            self.upload_clips_manager = UploadClips(self.clips_folder, self.sftp_user, self.sftp_password, self.sftp_server, self.sftp_dir, retry_delay=10, full_upload_policy=self.full_upload_policy, static_upload_policy=self.static_upload_policy)
+
+        self.incidents = Incidents(self.clips_folder, self.clip_duration, self.upload_clips_manager.request_upload,
+                                   self.ring_buffer, self.event_pre_roll, self.event_post_roll, self.fps)
+
+        if self.governor:
+            self.governor.start()
+
+        # Clips left behind by a crash, anything written from now on belongs to this run
+        self.recovery = ClipRecovery(self.clips_folder, self.upload_clips_manager.add_file_to_queue)
+
+        self.recording_thread = Thread(target=asyncio.run, args=(self.start_recording(),), name="recorder", daemon=True)
+        self.recording_thread.start()
+
+        Thread(target=self.start_subsystems, name="subsystems", daemon=True).start()
+
+    def start_subsystems(self, timeout=10):
+        """Start GPS and status reports, clip recovery and archiving once recording is under way."""
+        # Do not hold them back forever if the camera never delivers
+        self.recording_started.wait(timeout)
+        self.recovery.start()
+        if self.archive_after_hours > 0:
+            from .archive import ClipArchiver
+
+            dropped_frames = (lambda: self.profiler.report()["dropped"]) if self.profiler else None
+            self.archiver = ClipArchiver(self.clips_folder, self.archive_after_hours, self.archive_mode,
+                                         self.archive_max_temperature, self.archive_parked_minutes,
+                                         speed=lambda: self.last_gps_speed, dropped_frames=dropped_frames,
+                                         evict_static=self.evict_static,
+                                         throttled=self.governor.busy_reason if self.governor else None)
+            self.archiver.start()
+        if self.supervisor:
+            self.supervisor.start()
+        else:
+            self.start_gather_gps_thread()
+            self.start_gather_status_thread()
+        startup.mark("subsystems")
+
+    def start_gather_gps_thread(self):
         self.thread = Thread(target=self.gather_gps)
         self.thread.start()
 
-    async def start_gather_status_thread(self):
+    def start_gather_status_thread(self):
         logging.info(f"Starting status thread with {self.disk_alert_threshold} {self.cpu_temp_alert_threshold}")
         self.thread_1 = Thread(target=asyncio.run, args=(self.gather_status(self.disk_alert_threshold, self.cpu_temp_alert_threshold),))
         self.thread_1.start()
@@ -367,12 +943,19 @@ class DVR:
 
     def get_system_status(self):
         os_info = self.get_os_info()
+        times = os.times()
 
         status = {
             "recording": self.is_recording,
+            "paused": self.paused,
             "gps_thread_alive": self.thread.is_alive() if self.thread else False, 
             "gps_available": self.gps_available,
-            "os_info": os_info
+            "os_info": os_info,
+            # CPU time of this process, sampled twice it gives the camera process' CPU use
+            "process": {
+                "cpu_seconds": round(times.user + times.system, 3),
+                "load": os.getloadavg(),
+            },
         }
 
         return status
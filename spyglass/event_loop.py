@@ -0,0 +1,103 @@
+"""Threading model of the web server.
+
+The uvicorn event loop only runs coroutines that do not block. Anything that
+can take longer (camera calls, subprocesses, scanning folders) goes to one of
+the executors below. Recording runs on its own thread and loop (see
+``DVR.start``).
+"""
+import asyncio
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Starting, stopping and reconfiguring encoders and the camera is serialized here, for the web server and
+# the recorder alike, picamera2 is not meant to be driven from several threads at once
+CAMERA_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="camera")
+# File system and subprocess calls
+IO_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="io")
+
+
+async def run_blocking(func, *args, executor=IO_EXECUTOR, **kwargs):
+    """Run ``func(*args, **kwargs)`` on ``executor`` and wait for it without blocking the loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(func, *args, **kwargs))
+
+
+def _describe_frame(frame):
+    return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+
+
+class LoopWatchdog:
+    """Logs every time the event loop is held for more than ``threshold`` seconds.
+
+    A callback on the loop records a heartbeat every ``interval``. A separate
+    thread notices when the heartbeat is late and captures what the loop
+    thread is executing at that moment. When the loop gets going again the
+    stall is logged with its length and that location.
+    """
+
+    def __init__(self, threshold=0.1, interval=None, history=50):
+        self.threshold = threshold
+        self.interval = interval or threshold / 2
+        self.recent = deque(maxlen=history)
+        self.stalls = 0
+        self.max_lag = 0.0
+
+        self.loop = None
+        self._loop_thread = None
+        self._expected = None
+        self._where = None
+        self._handle = None
+        self._stopped = threading.Event()
+
+    def start(self, loop=None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.loop.call_soon_threadsafe(self._first_tick)
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._handle:
+            self.loop.call_soon_threadsafe(self._handle.cancel)
+
+    def _first_tick(self):
+        self._loop_thread = threading.get_ident()
+        self._expected = time.monotonic() + self.interval
+        self._handle = self.loop.call_later(self.interval, self._tick)
+
+    def _tick(self):
+        now = time.monotonic()
+        lag = now - self._expected
+        if lag > self.threshold:
+            self.stalls += 1
+            self.max_lag = max(self.max_lag, lag)
+            where = self._where or "unknown"
+            self.recent.append({'time': time.time(), 'lag_ms': round(lag * 1000, 1), 'where': where})
+            logging.warning(f"Event loop blocked for {lag * 1000:.0f} ms in {where}")
+        self._where = None
+        self._expected = now + self.interval
+        if not self._stopped.is_set():
+            self._handle = self.loop.call_later(self.interval, self._tick)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval / 2):
+            expected = self._expected
+            if expected is None or self._where is not None:
+                continue
+            if time.monotonic() - expected > self.threshold:
+                frame = sys._current_frames().get(self._loop_thread)
+                if frame is not None:
+                    self._where = _describe_frame(frame)
+
+    def report(self):
+        return {
+            'threshold_ms': round(self.threshold * 1000, 1),
+            'stalls': self.stalls,
+            'max_lag_ms': round(self.max_lag * 1000, 1),
+            'recent': list(self.recent),
+        }
@@ -0,0 +1,89 @@
+import asyncio
+import datetime
+import logging
+import os
+
+from spyglass.clips import CLIP_EXTENSION, CLIP_ID_PATTERN, DAY_FORMAT, clip_start_time
+
+# Remux the concatenated clips into a fragmented MP4 so ffmpeg never has to
+# hold the whole file (or seek back into it) to write the index.
+FFMPEG_EXPORT_COMMAND = [
+    'ffmpeg', '-loglevel', 'warning',
+    '-f', 'concat', '-safe', '0', '-protocol_whitelist', 'file,pipe', '-i', 'pipe:0',
+    '-c', 'copy', '-f', 'mp4',
+    '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+    'pipe:1',
+]
+
+CHUNK_SIZE = 64 * 1024
+
+
+def find_covering_clips(clips_folder, start, end, clip_duration):
+    """Clips overlapping ``[start, end)`` (epoch seconds), oldest first.
+
+    Returns a list of ``(path, clip_start)``. Only the day folders the range
+    can touch are scanned.
+    """
+    first_day = datetime.date.fromtimestamp(start - clip_duration)
+    last_day = datetime.date.fromtimestamp(end)
+
+    clips = []
+    day = first_day
+    while day <= last_day:
+        day_folder = os.path.join(clips_folder, day.strftime(DAY_FORMAT))
+        day += datetime.timedelta(days=1)
+        if not os.path.isdir(day_folder):
+            continue
+        with os.scandir(day_folder) as entries:
+            for entry in entries:
+                clip_id, extension = os.path.splitext(entry.name)
+                if extension != CLIP_EXTENSION or not CLIP_ID_PATTERN.match(clip_id):
+                    continue
+                clip_start = clip_start_time(clip_id).timestamp()
+                if clip_start < end and clip_start + clip_duration > start:
+                    clips.append((os.path.abspath(entry.path), clip_start))
+    return sorted(clips, key=lambda clip: clip[1])
+
+
+def concat_list(clips, start, end, clip_duration):
+    """ffconcat script trimming the first and last clip to the requested range.
+
+    With stream copy ffmpeg can only cut at keyframes, so the export starts
+    at the keyframe before ``start``.
+    """
+    lines = ['ffconcat version 1.0']
+    for i, (path, clip_start) in enumerate(clips):
+        escaped = path.replace("'", "'\\''")
+        lines.append(f"file '{escaped}'")
+        if i == 0 and start > clip_start:
+            lines.append(f"inpoint {start - clip_start:.3f}")
+        if i == len(clips) - 1 and end < clip_start + clip_duration:
+            lines.append(f"outpoint {end - clip_start:.3f}")
+    return '\n'.join(lines) + '\n'
+
+
+async def stream_export(clips, start, end, clip_duration):
+    """Yield the remuxed MP4 in chunks while ffmpeg produces it."""
+    process = await asyncio.create_subprocess_exec(
+        *FFMPEG_EXPORT_COMMAND,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE)
+    try:
+        process.stdin.write(concat_list(clips, start, end, clip_duration).encode())
+        await process.stdin.drain()
+        process.stdin.close()
+
+        while True:
+            chunk = await process.stdout.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+        returncode = await process.wait()
+        if returncode != 0:
+            logging.error(f"Export of {len(clips)} clips failed with ffmpeg exit code {returncode}")
+    finally:
+        # The client went away before the export finished
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
@@ -0,0 +1,221 @@
+"""Degrade capture step by step while the Pi is hot or overloaded.
+
+Left alone, a Pi in a hot car throttles its own clocks and drops frames
+wherever that happens to hit. The :class:`Governor` gives things up in a
+chosen order instead, one level at a time:
+
+* ``stream_fps`` - MJPEG viewers get at most ``stream_fps`` frames a second,
+* ``viewers`` - MJPEG viewers are disconnected and new ones turned away,
+* ``bitrate`` - clips are recorded at ``bitrate_factor`` of their bit rate,
+* ``frame_rate`` - the camera runs at ``frame_rate_factor`` of its frame rate,
+* ``background`` - uploads and archiving are paused.
+
+Level ``n`` is entered once the CPU reaches the ``n``-th temperature and
+applies the first ``n`` actions. A load average at or above ``max_load``
+adds a level. A level is entered on the first reading that calls for it.
+The temperature gives up a level once it is ``hysteresis`` degrees below the
+threshold it crossed, the load once it is below ``LOAD_HYSTERESIS`` of
+``max_load``, and a level is only left after it has been held for
+``min_dwell`` seconds, so a reading around a threshold does not flap.
+
+Run as ``python -m spyglass.governor <trace.csv>`` to replay a temperature
+trace (``time,temperature,load``) through the governor.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from .archive import cpu_temperature
+
+GOVERNOR_ACTIONS = ('stream_fps', 'viewers', 'bitrate', 'frame_rate', 'background')
+DEFAULT_LEVELS = ('stream_fps', 'viewers', 'bitrate', 'background')
+LOAD_HYSTERESIS = 0.8
+
+
+def parse_levels(value):
+    levels = tuple(level.strip() for level in value.split(',') if level.strip())
+    unknown = [level for level in levels if level not in GOVERNOR_ACTIONS]
+    if unknown:
+        raise ValueError(f"unknown governor levels: {', '.join(unknown)}")
+    return levels
+
+
+class Governor:
+    """Picks the degradation level from the CPU temperature and load.
+
+    ``update`` takes one reading and returns the level, ``run`` takes one
+    every ``interval`` seconds. ``on_change(old, new)`` is called after
+    every transition, from the thread that took the reading. The parts of
+    the recorder that are degraded ask :meth:`active` whether they are.
+    """
+
+    def __init__(self, levels=DEFAULT_LEVELS, temperatures=(), hysteresis=5.0, max_load=0, min_dwell=30.0,
+                 interval=5.0, stream_fps=5, bitrate_factor=0.5, frame_rate_factor=0.5, on_change=None,
+                 history=20):
+        levels = tuple(levels)
+        temperatures = tuple(float(t) for t in temperatures)
+        if len(temperatures) not in (0, len(levels)):
+            raise ValueError(f"{len(levels)} governor levels need as many temperatures, got {len(temperatures)}")
+        if list(temperatures) != sorted(temperatures):
+            raise ValueError("governor temperatures must be in ascending order")
+        self.levels = levels
+        self.temperatures = temperatures
+        self.hysteresis = hysteresis
+        self.max_load = max_load
+        self.min_dwell = min_dwell
+        self.interval = interval
+        self.stream_fps = stream_fps
+        self.bitrate_factor = bitrate_factor
+        self.frame_rate_factor = frame_rate_factor
+        self.on_change = on_change
+
+        self.level = 0
+        self.changed_at = None
+        # The levels the temperature and the load account for, each with its own hysteresis
+        self._temperature_level = 0
+        self._load_level = 0
+        # Last reading, /governor and the recorder read it instead of the sensor
+        self.temperature = None
+        self.load = None
+        self.transitions = deque(maxlen=history)
+        self._stopped = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="governor", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.update(cpu_temperature(), os.getloadavg()[0])
+            except Exception as e:
+                logging.error(f"Governor update failed: {e}")
+            self._stopped.wait(self.interval)
+
+    def pressure(self, temperature, load):
+        """The level the readings call for."""
+        level = 0
+        if temperature is not None:
+            level = sum(1 for threshold in self.temperatures if temperature >= threshold)
+        if self.max_load and load is not None and load >= self.max_load:
+            level += 1
+        return min(level, len(self.levels))
+
+    def _owed(self, temperature, load):
+        """The level the readings call for, keeping what is within the hysteresis of a threshold it crossed."""
+        if temperature is not None:
+            entered = sum(1 for threshold in self.temperatures if temperature >= threshold)
+            held = sum(1 for threshold in self.temperatures if temperature > threshold - self.hysteresis)
+            self._temperature_level = max(entered, min(self._temperature_level, held))
+        if self.max_load and load is not None:
+            if load >= self.max_load:
+                self._load_level = 1
+            elif load < self.max_load * LOAD_HYSTERESIS:
+                self._load_level = 0
+        return min(self._temperature_level + self._load_level, len(self.levels))
+
+    def update(self, temperature, load=None, now=None):
+        """Take a reading and move at most one level towards it."""
+        now = time.monotonic() if now is None else now
+        self.temperature, self.load = temperature, load
+        target = self._owed(temperature, load)
+
+        if target > self.level:
+            self._set_level(self.level + 1, now)
+        elif target < self.level and now - self.changed_at >= self.min_dwell:
+            self._set_level(self.level - 1, now)
+        return self.level
+
+    def _set_level(self, level, now):
+        old, self.level, self.changed_at = self.level, level, now
+        action = self.levels[max(old, level) - 1]
+        readings = []
+        if self.temperature is not None:
+            readings.append(f"CPU at {self.temperature:.1f}°C")
+        if self.load is not None:
+            readings.append(f"load {self.load:.2f}")
+        logging.warning(f"Governor {'entering' if level > old else 'leaving'} level {max(old, level)} ({action}): "
+                        f"{', '.join(readings)}")
+        self.transitions.append({'time': time.time(), 'from': old, 'to': level, 'action': action,
+                                 'temperature': self.temperature, 'load': self.load})
+        if self.on_change:
+            self.on_change(old, level)
+
+    def active(self, action):
+        return action in self.levels[:self.level]
+
+    def stream_interval(self):
+        """Seconds between the MJPEG frames sent to a viewer."""
+        return 1 / self.stream_fps if self.active('stream_fps') and self.stream_fps > 0 else 0
+
+    def clip_bitrate(self, bitrate):
+        return int(bitrate * self.bitrate_factor) if self.active('bitrate') else bitrate
+
+    def busy_reason(self):
+        """Why background work must wait, or None."""
+        if self.active('background'):
+            return f"governor at level {self.level}"
+        return None
+
+    def report(self):
+        return {
+            'level': self.level,
+            'active': list(self.levels[:self.level]),
+            'levels': [{'action': action, 'temperature': self.temperatures[i] if self.temperatures else None}
+                       for i, action in enumerate(self.levels)],
+            'temperature': self.temperature,
+            'load': self.load,
+            'transitions': list(self.transitions),
+        }
+
+
+def read_trace(path):
+    with open(path, newline='') as f:
+        return [{k: float(v) for k, v in row.items() if k in ('time', 'temperature', 'load') and v != ''}
+                for row in csv.DictReader(f)]
+
+
+def simulate(trace, governor):
+    """Replay readings of ``{'time', 'temperature', 'load'}``, returns the level after each."""
+    return [governor.update(sample.get('temperature'), sample.get('load'), sample['time']) for sample in trace]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m spyglass.governor',
+                                     description='Replay a temperature trace through the governor.')
+    parser.add_argument('trace', help='CSV with time (seconds), temperature (°C) and optionally load columns')
+    parser.add_argument('--levels', type=parse_levels, default=DEFAULT_LEVELS)
+    parser.add_argument('--temperatures', type=lambda value: [float(t) for t in value.split(',')],
+                        default=[70, 75, 78, 80])
+    parser.add_argument('--hysteresis', type=float, default=5.0)
+    parser.add_argument('--max_load', type=float, default=0)
+    parser.add_argument('--min_dwell', type=float, default=30.0)
+    parsed_args = parser.parse_args(args)
+
+    governor = Governor(parsed_args.levels, parsed_args.temperatures, parsed_args.hysteresis,
+                        parsed_args.max_load, parsed_args.min_dwell)
+    trace = read_trace(parsed_args.trace)
+    levels = simulate(trace, governor)
+    seconds = [0.0] * (len(governor.levels) + 1)
+    for sample, next_sample, level in zip(trace, trace[1:], levels):
+        seconds[level] += next_sample['time'] - sample['time']
+    result = {
+        'samples': len(trace),
+        'max_level': max(levels, default=0),
+        'seconds_per_level': seconds,
+        'transitions': list(governor.transitions),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import io
+import logging
+import math
+import subprocess
+import time
+from collections import deque
+from threading import Lock, Thread
+
+from spyglass.event_loop import CAMERA_EXECUTOR
+from spyglass.mp4 import BoxSplitter
+
+# Remux the raw H.264 stream into fragmented MP4 with one fragment per GOP.
+FFMPEG_FMP4_COMMAND = [
+    'ffmpeg', '-loglevel', 'warning',
+    '-use_wallclock_as_timestamps', '1', '-f', 'h264', '-i', '-',
+    '-c:v', 'copy', '-f', 'mp4', '-flush_packets', '1',
+    '-movflags', '+frag_keyframe+empty_moov+default_base_moof',
+    'pipe:1',
+]
+
+START_CODE = b'\x00\x00\x00\x01'
+NAL_IDR = 5
+NAL_SPS = 7
+
+
+def is_keyframe(frame, max_units=4):
+    """True if an Annex B H.264 frame starts a GOP (contains SPS or IDR)."""
+    offset = 0
+    for _ in range(max_units):
+        offset = frame.find(START_CODE, offset)
+        if offset < 0 or offset + 4 >= len(frame):
+            return False
+        if frame[offset + 4] & 0x1F in (NAL_IDR, NAL_SPS):
+            return True
+        offset += 4
+    return False
+
+
+class Segment:
+    def __init__(self, sequence, duration, data):
+        self.sequence = sequence
+        self.duration = duration
+        self.data = data
+
+
+class SegmentRing:
+    """The last few fMP4 segments of a live stream, kept in memory only."""
+
+    def __init__(self, size=6):
+        self.segments = deque(maxlen=size)
+        self.init_segment = None
+        self.next_sequence = 0
+        self._lock = Lock()
+
+    def add(self, data, duration):
+        with self._lock:
+            segment = Segment(self.next_sequence, duration, data)
+            self.segments.append(segment)
+            self.next_sequence += 1
+        return segment
+
+    def get(self, sequence):
+        with self._lock:
+            for segment in self.segments:
+                if segment.sequence == sequence:
+                    return segment
+        return None
+
+    def playlist(self, init_uri='init.mp4', segment_uri='segment_{}.m4s'):
+        with self._lock:
+            segments = list(self.segments)
+
+        target_duration = max([math.ceil(s.duration) for s in segments] + [1])
+        lines = [
+            '#EXTM3U',
+            '#EXT-X-VERSION:7',
+            f'#EXT-X-TARGETDURATION:{target_duration}',
+            '#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES',
+            f'#EXT-X-MEDIA-SEQUENCE:{segments[0].sequence if segments else self.next_sequence}',
+            f'#EXT-X-MAP:URI="{init_uri}"',
+        ]
+        for segment in segments:
+            lines.append(f'#EXTINF:{segment.duration:.3f},')
+            lines.append(segment_uri.format(segment.sequence))
+        return '\n'.join(lines) + '\n'
+
+
+class HlsMuxer(io.BufferedIOBase):
+    """File-like sink for an H.264 encoder that produces HLS segments.
+
+    Frames are piped through ffmpeg which only repackages them (no encoding)
+    into fragmented MP4 on its stdout. Fragments are collected into a
+    :class:`SegmentRing`, nothing is written to disk.
+    """
+
+    def __init__(self, segments=6, segment_duration=1.0):
+        self.ring = SegmentRing(segments)
+        self.segment_duration = segment_duration
+        self._keyframe_times = deque()
+        self._process = subprocess.Popen(FFMPEG_FMP4_COMMAND, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self._reader = Thread(target=self._read_fragments, daemon=True)
+        self._reader.start()
+
+    def write(self, frame):
+        if is_keyframe(frame):
+            self._keyframe_times.append(time.monotonic())
+        try:
+            self._process.stdin.write(frame)
+        except (BrokenPipeError, ValueError) as e:
+            logging.error(f"HLS muxer stopped: {e}")
+        return len(frame)
+
+    def close(self):
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        try:
+            self._process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+        super().close()
+
+    def _read_fragments(self):
+        splitter = BoxSplitter()
+        header = b''
+        fragment = b''
+        stdout = self._process.stdout
+        while True:
+            data = stdout.read1(65536)
+            if not data:
+                break
+            for box_type, box in splitter.feed(data):
+                if self.ring.init_segment is None:
+                    header += box
+                    if box_type == 'moov':
+                        self.ring.init_segment = header
+                    continue
+                fragment += box
+                if box_type == 'mdat':
+                    self.ring.add(fragment, self._fragment_duration())
+                    fragment = b''
+
+    def _fragment_duration(self):
+        # ffmpeg closes a fragment once the following keyframe arrives
+        if len(self._keyframe_times) >= 2:
+            start = self._keyframe_times.popleft()
+            return self._keyframe_times[0] - start
+        return self.segment_duration
+
+
+class HlsStream:
+    """Starts a lores H.264 encoder for HLS on demand and stops it when idle."""
+
+    def __init__(self, camera, fps, bitrate=1000000, segments=6, idle_timeout=30):
+        self.camera = camera
+        self.fps = fps
+        self.bitrate = bitrate
+        self.segments = segments
+        self.idle_timeout = idle_timeout
+
+        self.muxer = None
+        self._encoder = None
+        self._last_access = 0
+        self._lock = Lock()
+
+    @property
+    def running(self):
+        return self._encoder is not None and self._encoder.running
+
+    def touch(self):
+        """Mark the stream as watched, starting it if needed."""
+        self._last_access = time.monotonic()
+        with self._lock:
+            if self._encoder is not None and not self._encoder.running:
+                # Stopped with the camera when it was reconfigured
+                self.muxer.close()
+                self._encoder = None
+            if self._encoder is None:
+                self._start()
+
+    def _start(self):
+        from picamera2.encoders import H264Encoder
+        from picamera2.outputs import FileOutput
+
+        logging.info("Starting HLS stream")
+        # One keyframe per second gives one second segments
+        self.muxer = HlsMuxer(self.segments, 1.0)
+        self._encoder = H264Encoder(bitrate=self.bitrate, repeat=True, iperiod=self.fps)
+        self.camera.start_encoder(self._encoder, FileOutput(self.muxer), name="lores")
+
+        watchdog = Thread(target=self._stop_when_idle, daemon=True)
+        watchdog.start()
+
+    def _stop_when_idle(self):
+        while time.monotonic() - self._last_access < self.idle_timeout:
+            time.sleep(1)
+        with self._lock:
+            if self._encoder is None:
+                # Restarted after a reconfiguration, the other watchdog stopped it
+                return
+            logging.info("No HLS viewers left, stopping HLS stream")
+            encoder, muxer, self._encoder = self._encoder, self.muxer, None
+        # Camera calls are serialized there, touch() may be waiting for the lock on it
+        CAMERA_EXECUTOR.submit(self._stop, encoder, muxer)
+
+    @staticmethod
+    def _stop(encoder, muxer):
+        encoder.stop()
+        muxer.close()
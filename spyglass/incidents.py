@@ -0,0 +1,123 @@
+"""Incidents marked with ``POST /events``.
+
+Marking an incident only takes a copy of the frame references in the
+:class:`~spyglass.ringbuffer.H264RingBuffer` and queues the rest for a
+background thread, so it returns in well under a millisecond. That thread:
+
+* writes the pre-roll from the ring buffer as ``event_<time>.mp4`` into the
+  day folder, and uploads it first,
+* locks the clips around the incident, so they stay on the card after their
+  upload and are never archived, and uploads them next.
+
+Clips that are still being recorded when the incident is marked are locked
+and uploaded as soon as they are finished (:meth:`Incidents.clip_finished`).
+"""
+import datetime
+import logging
+import os
+import subprocess
+import threading
+import time
+from queue import Queue
+
+from .clips import CLIP_EXTENSION, CLIP_TIME_FORMAT, DAY_FORMAT, clip_start_time, lock_clip
+from .export import find_covering_clips
+
+EVENT_PREFIX = "event_"
+EVENTS_LOG = "events.csv"
+
+
+class Incidents:
+    def __init__(self, clips_folder, clip_duration, request_upload, ring_buffer=None, pre_roll=10, post_roll=10, fps=30):
+        self.clips_folder = clips_folder
+        self.clip_duration = clip_duration
+        self.request_upload = request_upload
+        self.ring_buffer = ring_buffer
+        self.pre_roll = pre_roll
+        self.post_roll = post_roll
+        self.fps = fps
+
+        # (start, end) of incidents whose clips may still be recorded
+        self._windows = []
+        # Incidents marked per second
+        self._marked = {}
+        self._lock = threading.Lock()
+        self._queue = Queue()
+        threading.Thread(target=self._run, name="incidents", daemon=True).start()
+
+    def mark(self, timestamp=None, label=""):
+        """Mark an incident at ``timestamp`` (epoch seconds, now by default)."""
+        marked = time.time() if timestamp is None else timestamp
+        frames = self.ring_buffer.snapshot(marked - self.pre_roll, marked) if self.ring_buffer else []
+        event_id = EVENT_PREFIX + datetime.datetime.fromtimestamp(marked).strftime(CLIP_TIME_FORMAT)
+        window = (marked - self.pre_roll, marked + self.post_roll)
+        with self._lock:
+            self._windows.append(window)
+            # A button pressed twice within a second
+            count = self._marked.get(event_id, 0)
+            self._marked[event_id] = count + 1
+        if count:
+            event_id += f"_{count + 1}"
+        self._queue.put((event_id, marked, label, window, frames))
+        return {"event": event_id, "time": marked, "pre_roll_frames": len(frames)}
+
+    def clip_finished(self, clip_file):
+        """Lock and upload a clip that has just been recorded if it covers an incident."""
+        clip_start = clip_start_time(os.path.splitext(os.path.basename(clip_file))[0]).timestamp()
+        clip_end = clip_start + self.clip_duration
+        with self._lock:
+            covered = any(start < clip_end and end > clip_start for start, end in self._windows)
+            # Later clips start after these incidents ended
+            self._windows = [(start, end) for start, end in self._windows if end > clip_end]
+        if covered:
+            self._protect(clip_file)
+
+    def _protect(self, clip_file):
+        try:
+            lock_clip(clip_file)
+        except OSError as e:
+            logging.error(f"Failed to lock {clip_file}: {e}")
+        self.request_upload(clip_file)
+
+    def _run(self):
+        while True:
+            event_id, marked, label, window, frames = self._queue.get()
+            try:
+                self._record(event_id, marked, label, window, frames)
+            except Exception as e:
+                logging.error(f"Failed to record incident {event_id}: {e}")
+
+    def _record(self, event_id, marked, label, window, frames):
+        day_folder = os.path.join(self.clips_folder, datetime.date.fromtimestamp(marked).strftime(DAY_FORMAT))
+        os.makedirs(day_folder, exist_ok=True)
+
+        pre_roll_file = ""
+        if frames:
+            pre_roll_file = self._write_pre_roll(os.path.join(day_folder, event_id), frames)
+            self._protect(pre_roll_file)
+
+        clips = find_covering_clips(self.clips_folder, window[0], window[1], self.clip_duration)
+        for clip_file, _ in clips:
+            self._protect(clip_file)
+
+        with open(os.path.join(self.clips_folder, EVENTS_LOG), "a") as f:
+            f.write(f"{int(marked)},{label.replace(',', ' ')},{os.path.basename(pre_roll_file)}\n")
+        logging.info(f"Incident {event_id} ({label}): {len(frames)} frames of pre-roll, {len(clips)} clips locked")
+
+    def _write_pre_roll(self, base, frames):
+        h264_file = base + ".h264"
+        with open(h264_file, "wb") as f:
+            for frame in frames:
+                f.write(frame)
+
+        mp4_file = base + CLIP_EXTENSION
+        try:
+            subprocess.run(['ffmpeg', '-loglevel', 'warning', '-y', '-f', 'h264', '-framerate', str(self.fps),
+                            '-i', h264_file, '-c', 'copy', '-f', 'mp4', mp4_file],
+                           check=True, stdin=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError) as e:
+            # The raw stream plays in most players too
+            logging.warning(f"Failed to remux the pre-roll of {base}, keeping the H.264 stream: {e}")
+            return h264_file
+        os.remove(h264_file)
+        return mp4_file
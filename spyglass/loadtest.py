@@ -0,0 +1,296 @@
+"""Load a running spyglass with concurrent viewers and report what they got.
+
+Opens ``--stream`` MJPEG clients, ``--snapshot`` clients polling
+``/snapshot`` and ``--clip`` clients downloading ``/videos/<clip_id>`` in a
+loop, all at the same time, for ``--seconds``. Per client it reports frames
+per second, bytes per second and the age of the frames on arrival (from the
+``X-Timestamp`` header of every part). The server's CPU use comes from
+``/status`` and its dropped frames from ``/profile`` when spyglass runs with
+``--profile``.
+
+    python -m spyglass.loadtest --url http://dashcam.local:8080 --stream 4 --snapshot 2 --output report.json
+
+Frame ages compare the server's clock with this machine's, run it on the Pi
+or keep both clocks synchronised.
+"""
+import argparse
+import asyncio
+import json
+import time
+import urllib.parse
+import urllib.request
+
+from .__version__ import __version__
+
+READ_SIZE = 64 * 1024
+
+
+class HttpError(Exception):
+    pass
+
+
+async def http_get(url, timeout=10):
+    """Send a GET request and return ``(reader, writer, headers)`` once the headers arrived.
+
+    HTTP/1.0 keeps the body unchunked, it ends when the server closes the connection.
+    """
+    parts = urllib.parse.urlsplit(url)
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, parts.port or 80), timeout)
+    path = parts.path + (f'?{parts.query}' if parts.query else '')
+    writer.write(f'GET {path} HTTP/1.0\r\nHost: {parts.netloc}\r\n\r\n'.encode())
+    await writer.drain()
+    status_line = await asyncio.wait_for(reader.readline(), timeout)
+    try:
+        status = int(status_line.split()[1])
+    except (IndexError, ValueError):
+        writer.close()
+        raise HttpError(f'bad status line {status_line!r}')
+    headers = await read_headers(reader)
+    if status != 200:
+        writer.close()
+        raise HttpError(f'HTTP {status}')
+    return reader, writer, headers
+
+
+async def read_headers(reader):
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if not line:
+            raise asyncio.IncompleteReadError(line, None)
+        line = line.strip()
+        if not line:
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+def multipart_boundary(content_type):
+    for param in content_type.split(';')[1:]:
+        name, _, value = param.strip().partition('=')
+        if name.lower() == 'boundary':
+            return value.strip('"')
+    raise HttpError(f'no boundary in {content_type!r}')
+
+
+async def read_parts(reader, boundary):
+    """Yield ``(headers, body)`` for every part of a multipart stream."""
+    delimiter = b'--' + boundary.encode()
+    while True:
+        line = await reader.readline()
+        if not line:
+            return
+        line = line.strip()
+        if not line:
+            continue
+        if line == delimiter + b'--':
+            return
+        if line != delimiter:
+            raise HttpError(f'expected a boundary, got {line[:40]!r}')
+        headers = await read_headers(reader)
+        if 'content-length' not in headers:
+            raise HttpError('part without Content-Length')
+        yield headers, await reader.readexactly(int(headers['content-length']))
+
+
+def percentiles(values, points=(50, 90, 99)):
+    ordered = sorted(values)
+    if not ordered:
+        return {}
+    result = {}
+    for p in points:
+        index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+        result[f'p{p}'] = round(ordered[index], 3)
+    result['max'] = round(ordered[-1], 3)
+    return result
+
+
+class ClientStats:
+    def __init__(self, kind, index):
+        self.kind = kind
+        self.index = index
+        self.frames = 0
+        self.bytes = 0
+        self.ages_ms = []
+        self.latencies_ms = []
+        self.errors = []
+        self.started = None
+        self.finished = None
+
+    def start(self):
+        # Reconnecting does not restart the clock
+        if self.started is None:
+            self.started = time.monotonic()
+
+    def frame(self, size, timestamp=None):
+        self.frames += 1
+        self.bytes += size
+        if timestamp:
+            self.ages_ms.append((time.time() - float(timestamp)) * 1000)
+
+    def report(self):
+        seconds = (self.finished or time.monotonic()) - self.started if self.started else 0
+        report = {
+            'kind': self.kind,
+            'client': self.index,
+            'seconds': round(seconds, 3),
+            'frames': self.frames,
+            'fps': round(self.frames / seconds, 2) if seconds else 0,
+            'bytes_per_s': round(self.bytes / seconds) if seconds else 0,
+            'age_ms': percentiles(self.ages_ms),
+            'errors': len(self.errors),
+        }
+        if self.latencies_ms:
+            report['latency_ms'] = percentiles(self.latencies_ms)
+        if self.errors:
+            report['last_error'] = self.errors[-1]
+        return report
+
+
+async def stream_client(url, stats, deadline):
+    reader, writer, headers = await http_get(url)
+    stats.start()
+    try:
+        boundary = multipart_boundary(headers.get('content-type', ''))
+        async for part_headers, body in read_parts(reader, boundary):
+            stats.frame(len(body), part_headers.get('x-timestamp'))
+            if time.monotonic() >= deadline:
+                break
+    finally:
+        stats.finished = time.monotonic()
+        writer.close()
+
+
+async def fetch(url, stats):
+    """Fetch ``url`` to the end, counting it as one frame of ``stats``."""
+    start = time.monotonic()
+    reader, writer, headers = await http_get(url)
+    try:
+        while True:
+            data = await reader.read(READ_SIZE)
+            if not data:
+                break
+            stats.bytes += len(data)
+    finally:
+        writer.close()
+    stats.frames += 1
+    stats.latencies_ms.append((time.monotonic() - start) * 1000)
+    if headers.get('x-timestamp'):
+        stats.ages_ms.append((time.time() - float(headers['x-timestamp'])) * 1000)
+
+
+async def polling_client(url, stats, deadline):
+    stats.start()
+    try:
+        while time.monotonic() < deadline:
+            await fetch(url, stats)
+    finally:
+        stats.finished = time.monotonic()
+
+
+async def run_client(client, url, stats, deadline):
+    # A client that fails is reconnected until the end of the run
+    while time.monotonic() < deadline:
+        try:
+            await asyncio.wait_for(client(url, stats, deadline), timeout=max(0.1, deadline - time.monotonic() + 2))
+        except (OSError, HttpError, asyncio.IncompleteReadError, asyncio.TimeoutError) as e:
+            stats.errors.append(f'{type(e).__name__}: {e}')
+            await asyncio.sleep(0.5)
+
+
+def get_json(url, timeout=10):
+    """A JSON endpoint of the server, or None when it is not available."""
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return None
+
+
+def server_sample(url):
+    return {'time': time.monotonic(), 'status': get_json(f'{url}/status'), 'profile': get_json(f'{url}/profile')}
+
+
+def server_report(first, last):
+    seconds = last['time'] - first['time']
+    report = {}
+    if first['status'] and last['status'] and 'process' in last['status']:
+        cpu = last['status']['process']['cpu_seconds'] - first['status']['process']['cpu_seconds']
+        report['cpu_percent'] = round(100 * cpu / seconds, 1)
+        report['load'] = last['status']['process']['load']
+        report['recording'] = last['status']['recording']
+    if first['profile'] and last['profile']:
+        report['frames'] = last['profile']['frames'] - first['profile']['frames']
+        report['dropped_frames'] = last['profile']['dropped'] - first['profile']['dropped']
+    return report
+
+
+def summarize(clients):
+    summary = {}
+    for kind in sorted({client['kind'] for client in clients}):
+        of_kind = [client for client in clients if client['kind'] == kind]
+        fps = [client['fps'] for client in of_kind]
+        summary[kind] = {
+            'clients': len(of_kind),
+            'fps_mean': round(sum(fps) / len(fps), 2),
+            'fps_min': min(fps),
+            'bytes_per_s': sum(client['bytes_per_s'] for client in of_kind),
+            'age_ms_p99_max': max((client['age_ms'].get('p99', 0) for client in of_kind), default=0),
+            'errors': sum(client['errors'] for client in of_kind),
+        }
+    return summary
+
+
+async def run(url, streams=0, snapshots=0, clips=0, clip_id=None, seconds=30):
+    url = url.rstrip('/')
+    clients = []
+    for index in range(streams):
+        clients.append((stream_client, f'{url}/stream', ClientStats('stream', index)))
+    for index in range(snapshots):
+        clients.append((polling_client, f'{url}/snapshot', ClientStats('snapshot', index)))
+    for index in range(clips):
+        clients.append((polling_client, f'{url}/videos/{clip_id}', ClientStats('clip', index)))
+
+    loop = asyncio.get_running_loop()
+    first = await loop.run_in_executor(None, server_sample, url)
+    deadline = time.monotonic() + seconds
+    await asyncio.gather(*(run_client(client, client_url, stats, deadline) for client, client_url, stats in clients))
+    last = await loop.run_in_executor(None, server_sample, url)
+
+    client_reports = [stats.report() for _, _, stats in clients]
+    return {
+        'spyglass_loadtest': __version__,
+        'url': url,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'seconds': seconds,
+        'summary': summarize(client_reports),
+        'server': server_report(first, last),
+        'clients': client_reports,
+    }
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m spyglass.loadtest', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8080', help='Address of the running spyglass.')
+    parser.add_argument('--stream', type=int, default=1, help='Number of /stream clients.')
+    parser.add_argument('--snapshot', type=int, default=0, help='Number of clients polling /snapshot.')
+    parser.add_argument('--clip', type=int, default=0, help='Number of clients downloading --clip_id in a loop.')
+    parser.add_argument('--clip_id', type=str, default=None, help='Clip to download, e.g. clip_2024-05-01_12-00-00.')
+    parser.add_argument('--seconds', type=float, default=30, help='Length of the run.')
+    parser.add_argument('--output', type=str, default=None, help='Write the JSON report to this file.')
+    parsed_args = parser.parse_args(args)
+    if parsed_args.clip and not parsed_args.clip_id:
+        parser.error('--clip needs --clip_id')
+
+    report = asyncio.run(run(parsed_args.url, parsed_args.stream, parsed_args.snapshot, parsed_args.clip,
+                             parsed_args.clip_id, parsed_args.seconds))
+    text = json.dumps(report, indent=2)
+    if parsed_args.output:
+        with open(parsed_args.output, 'w') as f:
+            f.write(text + '\n')
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
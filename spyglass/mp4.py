@@ -0,0 +1,68 @@
+import struct
+
+HEADER_SIZE = 8
+
+
+def box_header(data, offset=0):
+    """Return ``(size, type, header_size)`` of the box at ``offset``.
+
+    Returns ``None`` if ``data`` does not hold the complete header yet.
+    A size of 0 (box runs to the end of the file) is returned as is.
+    """
+    if len(data) - offset < HEADER_SIZE:
+        return None
+    size, box_type = struct.unpack_from(">I4s", data, offset)
+    header_size = HEADER_SIZE
+    if size == 1:
+        if len(data) - offset < 16:
+            return None
+        size, = struct.unpack_from(">Q", data, offset + 8)
+        header_size = 16
+    return size, box_type.decode("latin-1"), header_size
+
+
+class BoxSplitter:
+    """Split a byte stream into complete top-level MP4 boxes."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        boxes = []
+        offset = 0
+        while True:
+            header = box_header(self._buffer, offset)
+            if header is None:
+                break
+            size, box_type, header_size = header
+            if size < header_size or len(self._buffer) - offset < size:
+                break
+            boxes.append((box_type, bytes(self._buffer[offset:offset + size])))
+            offset += size
+        del self._buffer[:offset]
+        return boxes
+
+
+def scan_boxes(f, start=0, end=None):
+    """Yield ``(offset, size, type)`` of the complete top-level boxes in a file.
+
+    Stops at the first box that is cut short, e.g. by a power loss while
+    the file was written.
+    """
+    if end is None:
+        f.seek(0, 2)
+        end = f.tell()
+    offset = start
+    while offset < end:
+        f.seek(offset)
+        header = box_header(f.read(16))
+        if header is None:
+            return
+        size, box_type, header_size = header
+        if size == 0:
+            size = end - offset
+        if size < header_size or offset + size > end:
+            return
+        yield offset, size, box_type
+        offset += size
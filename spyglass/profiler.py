@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+import weakref
+from collections import deque
+
+
+class FrameProfiler:
+    """Opt-in per-stage timing of frames flowing through the camera pipeline.
+
+    Frames are timestamped in ``pre_callback`` (capture and overlay), when an
+    encoder receives them and when its output writes the encoded frame.
+    Sequence numbers from libcamera and gaps between encoded timestamps are
+    used to count dropped frames per stage.
+    """
+
+    def __init__(self, window=300, dump_path=None, dump_interval=30):
+        self.window = window
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+
+        self._lock = threading.Lock()
+        self._samples = {}  # stage -> deque of durations in seconds
+        self._totals = {}  # collapsed stack -> accumulated microseconds
+        self._drops = {}  # stage -> dropped frames
+        self._pending = weakref.WeakKeyDictionary()  # encoder -> encode start times
+        self._last_dump = time.monotonic()
+
+        self.frames = 0
+        self.frame_duration_us = None
+        self._last_sequence = None
+        self._last_sensor_ts = None
+
+    def record(self, stage, duration):
+        with self._lock:
+            samples = self._samples.get(stage)
+            if samples is None:
+                samples = self._samples[stage] = deque(maxlen=self.window)
+            samples.append(duration)
+
+            stack = "frame;" + stage.replace(".", ";")
+            self._totals[stack] = self._totals.get(stack, 0) + int(duration * 1e6)
+
+    def add_drops(self, stage, count):
+        if count <= 0:
+            return
+        with self._lock:
+            self._drops[stage] = self._drops.get(stage, 0) + count
+
+    def frame_started(self, request):
+        """Account a new frame delivered to ``pre_callback``."""
+        self.frames += 1
+
+        sequence = getattr(getattr(request, "request", None), "sequence", None)
+        if sequence is not None:
+            if self._last_sequence is not None and sequence > self._last_sequence + 1:
+                self.add_drops("capture", sequence - self._last_sequence - 1)
+            self._last_sequence = sequence
+
+        try:
+            metadata = request.get_metadata()
+        except Exception:
+            metadata = {}
+
+        if metadata.get("FrameDuration"):
+            self.frame_duration_us = metadata["FrameDuration"]
+
+        sensor_ts = metadata.get("SensorTimestamp")
+        if sensor_ts is not None:
+            if self._last_sensor_ts is not None:
+                self.record("interval", (sensor_ts - self._last_sensor_ts) / 1e9)
+            self._last_sensor_ts = sensor_ts
+
+        self._maybe_dump()
+
+    def stage(self, name):
+        return _StageTimer(self, name)
+
+    def instrument(self, name, encoder, output):
+        """Time ``encoder`` and ``output`` as stages ``<name>.encode`` / ``<name>.output``.
+
+        Both are patched in place because picamera2 only accepts its own
+        ``Output`` instances. Returns ``output`` for convenience.
+        """
+        pending = self._pending.get(encoder)
+        if pending is None:
+            # Encoders are reused across clips, only wrap them once.
+            pending = self._pending[encoder] = deque(maxlen=self.window)
+            encode = encoder.encode
+
+            def timed_encode(*args, **kwargs):
+                pending.append(time.perf_counter())
+                return encode(*args, **kwargs)
+
+            encoder.encode = timed_encode
+        pending.clear()
+
+        outputframe = output.outputframe
+        last_timestamp = None
+
+        def timed_outputframe(frame, keyframe=True, timestamp=None, *args, **kwargs):
+            nonlocal last_timestamp
+            now = time.perf_counter()
+            if pending:
+                self.record(f"{name}.encode", now - pending.popleft())
+
+            if timestamp is not None:
+                if last_timestamp is not None and self.frame_duration_us:
+                    gap = timestamp - last_timestamp
+                    self.add_drops(name, int(round(gap / self.frame_duration_us)) - 1)
+                last_timestamp = timestamp
+
+            outputframe(frame, keyframe, timestamp, *args, **kwargs)
+            self.record(f"{name}.output", time.perf_counter() - now)
+
+        output.outputframe = timed_outputframe
+        return output
+
+    def percentiles(self, samples, points=(50, 90, 99)):
+        ordered = sorted(samples)
+        if not ordered:
+            return {}
+        result = {}
+        for p in points:
+            index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))
+            result[f"p{p}"] = ordered[index] * 1000
+        result["max"] = ordered[-1] * 1000
+        return result
+
+    def report(self):
+        """Rolling percentiles (milliseconds) and dropped frames per stage."""
+        with self._lock:
+            samples = {stage: list(values) for stage, values in self._samples.items()}
+            drops = dict(self._drops)
+
+        stages = {}
+        for stage, values in samples.items():
+            stats = self.percentiles(values)
+            stats["count"] = len(values)
+            stats["dropped"] = drops.get(stage, 0)
+            stages[stage] = stats
+
+        for stage, count in drops.items():
+            stages.setdefault(stage, {"count": 0, "dropped": count})
+
+        return {
+            "frames": self.frames,
+            "dropped": sum(drops.values()),
+            "frame_duration_us": self.frame_duration_us,
+            "stages": stages,
+        }
+
+    def dump(self):
+        """Write accumulated stage times in collapsed-stack format for flame graphs."""
+        if not self.dump_path:
+            return
+        with self._lock:
+            totals = dict(self._totals)
+        try:
+            with open(self.dump_path, "w") as f:
+                for stack, micros in sorted(totals.items()):
+                    f.write(f"{stack} {micros}\n")
+        except OSError as e:
+            logging.error(f"Failed to write profile dump {self.dump_path}: {e}")
+
+    def _maybe_dump(self):
+        now = time.monotonic()
+        if self.dump_path and now - self._last_dump >= self.dump_interval:
+            self._last_dump = now
+            self.dump()
+
+
+class _StageTimer:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.profiler.record(self.name, time.perf_counter() - self.start)
+        return False
+
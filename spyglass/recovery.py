@@ -0,0 +1,171 @@
+"""Recover the clips a crash or power loss left behind.
+
+A clip is recorded as ``TMP_clip_*.mp4`` and only renamed once it is
+finished, and ``--staging_folder`` copies clips to the card as
+``clip_*.mp4.part``. After a power loss these orphans stay in the day
+folders. :class:`ClipRecovery` finds them with one ``os.scandir`` per day
+folder, truncates them to their last complete fragment (clips are fragmented
+MP4, see ``docs/live-upload.md``), renames them and queues them for upload.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+from .clips import CLIP_EXTENSION, TMP_PREFIX
+from .mp4 import scan_boxes
+
+DAY_FOLDER_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+PART_SUFFIX = ".part"
+BROKEN_SUFFIX = ".broken"
+
+
+def final_name(name):
+    """Name of a finished clip for an orphan, or None if ``name`` is not an orphan."""
+    if name.startswith(TMP_PREFIX) and name.endswith(CLIP_EXTENSION):
+        return name[len(TMP_PREFIX):]
+    if name.endswith(CLIP_EXTENSION + PART_SUFFIX):
+        return name[:-len(PART_SUFFIX)]
+    return None
+
+
+def playable_end(f):
+    """``(length, fragments)`` of the playable part of a fragmented MP4.
+
+    The file ends after the last complete box that is not a ``moof``, a
+    fragment without its ``mdat`` is dropped. Returns None without a
+    ``moov``: a clip recorded as regular MP4 keeps its index at the end.
+    """
+    end = 0
+    fragments = 0
+    has_moov = False
+    for offset, size, box_type in scan_boxes(f):
+        if box_type == 'moov':
+            has_moov = True
+        elif box_type == 'mdat':
+            fragments += 1
+        if box_type != 'moof':
+            end = offset + size
+    return (end, fragments) if has_moov else None
+
+
+def repair(path):
+    """Truncate an orphaned clip to its last complete fragment.
+
+    Returns ``(bytes removed, fragments left)``, or None if it cannot be
+    played at all.
+    """
+    with open(path, 'r+b') as f:
+        playable = playable_end(f)
+        if playable is None:
+            return None
+        end, fragments = playable
+        size = os.fstat(f.fileno()).st_size
+        if end < size:
+            f.truncate(end)
+            os.fsync(f.fileno())
+        return size - end, fragments
+
+
+class ClipRecovery:
+    """Finds, repairs and queues orphaned clips in the background.
+
+    Files modified after ``started`` belong to the recording that is under
+    way and are left alone. The scan stops after ``time_budget`` seconds,
+    whatever is left is recovered on the next start.
+    """
+
+    def __init__(self, clips_folder, enqueue, started=None, time_budget=60):
+        self.clips_folder = clips_folder
+        self.enqueue = enqueue
+        self.started = time.time() if started is None else started
+        self.time_budget = time_budget
+        self.stats = {
+            'running': False,
+            'finished': False,
+            'seconds': 0,
+            'day_folders': 0,
+            'entries': 0,
+            'recovered': 0,
+            'truncated_bytes': 0,
+            'removed_empty': 0,
+            'unrecoverable': 0,
+            'errors': 0,
+        }
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="recovery", daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        self.stats['running'] = True
+        start = time.monotonic()
+        deadline = start + self.time_budget
+        try:
+            self.stats['finished'] = self._scan(deadline)
+        except OSError as e:
+            logging.error(f"Clip recovery failed: {e}")
+            self.stats['errors'] += 1
+        self.stats['seconds'] = round(time.monotonic() - start, 3)
+        self.stats['running'] = False
+
+        if self.stats['recovered'] or self.stats['unrecoverable'] or not self.stats['finished']:
+            logging.info(f"Clip recovery: {self.stats}")
+
+    def _scan(self, deadline):
+        with os.scandir(self.clips_folder) as days:
+            # Newest first, that is where the last crash left its clips
+            day_folders = sorted((entry.path for entry in days if entry.is_dir() and DAY_FOLDER_PATTERN.match(entry.name)),
+                                 reverse=True)
+
+        for day_folder in day_folders:
+            if time.monotonic() > deadline:
+                return False
+            self.stats['day_folders'] += 1
+            orphans = []
+            with os.scandir(day_folder) as entries:
+                for entry in entries:
+                    self.stats['entries'] += 1
+                    name = final_name(entry.name)
+                    if name is not None:
+                        orphans.append((entry, name))
+            for entry, name in orphans:
+                if time.monotonic() > deadline:
+                    return False
+                if entry.stat().st_mtime >= self.started:
+                    continue
+                self._recover(entry.path, os.path.join(day_folder, name))
+        return True
+
+    def _recover(self, path, final_path):
+        try:
+            repaired = repair(path)
+            if repaired is None and os.path.getsize(path) > 0:
+                # Kept for manual recovery, and not looked at again
+                os.rename(path, final_path + BROKEN_SUFFIX)
+                self.stats['unrecoverable'] += 1
+                logging.warning(f"Cannot recover {path}, renamed to {final_path + BROKEN_SUFFIX}")
+                return
+            if repaired is None or repaired[1] == 0:
+                os.remove(path)
+                self.stats['removed_empty'] += 1
+                return
+            if os.path.exists(final_path):
+                logging.warning(f"Not recovering {path}, {final_path} exists")
+                return
+            os.rename(path, final_path)
+        except OSError as e:
+            logging.error(f"Failed to recover {path}: {e}")
+            self.stats['errors'] += 1
+            return
+
+        removed = repaired[0]
+        self.stats['recovered'] += 1
+        self.stats['truncated_bytes'] += removed
+        logging.info(f"Recovered {final_path}, {removed} bytes of an incomplete fragment removed")
+        self.enqueue(final_path)
+
+    def report(self):
+        return dict(self.stats)
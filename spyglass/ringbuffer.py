@@ -0,0 +1,68 @@
+import threading
+import time
+from collections import deque
+
+from picamera2.outputs import Output
+
+
+class H264RingBuffer(Output):
+    """The last seconds of an H.264 stream in memory, for the pre-roll of incidents.
+
+    It is a second output of the recording encoder, so it costs no extra
+    encoding. Frames are kept with the wall clock time they arrived at. The
+    buffer always starts with a keyframe and is bounded both in frames
+    (``fps`` per second) and in bytes (twice what ``bitrate`` produces, for
+    keyframes), whichever limit is reached first.
+    """
+
+    def __init__(self, seconds, fps, bitrate, keyframe_interval=1.0):
+        super().__init__()
+        # One more GOP so that there is a keyframe at or before the start of the pre-roll
+        span = seconds + keyframe_interval
+        self.keyframe_interval = keyframe_interval
+        self.max_frames = int(span * fps) + 1
+        self.max_bytes = int(span * bitrate / 8 * 2)
+        self._frames = deque()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if audio:
+            return
+        with self._lock:
+            if not self._frames and not keyframe:
+                return
+            self._frames.append((time.time(), keyframe, frame))
+            self._bytes += len(frame)
+            while len(self._frames) > self.max_frames or self._bytes > self.max_bytes:
+                self._drop_oldest_gop()
+
+    def _drop_oldest_gop(self):
+        _, _, frame = self._frames.popleft()
+        self._bytes -= len(frame)
+        while self._frames and not self._frames[0][1]:
+            _, _, frame = self._frames.popleft()
+            self._bytes -= len(frame)
+
+    def snapshot(self, start, end):
+        """Frames from the last keyframe at or before ``start`` up to ``end`` (epoch seconds).
+
+        Frames from more than one GOP before ``start`` are not part of it, so
+        after a pause in recording (between clips, while paused) the snapshot
+        is empty instead of footage from minutes earlier.
+        """
+        with self._lock:
+            frames = [f for f in self._frames if start - self.keyframe_interval <= f[0] <= end]
+        first = None
+        for i, (arrived, keyframe, _) in enumerate(frames):
+            if arrived > start and first is not None:
+                break
+            if keyframe:
+                first = i
+        if first is None:
+            return []
+        return [frame for _, _, frame in frames[first:]]
+
+    @property
+    def size(self):
+        return self._bytes
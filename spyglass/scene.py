@@ -0,0 +1,60 @@
+import numpy as np
+from picamera2 import MappedArray
+
+
+class SceneStats:
+    """Cheap per-clip statistics of the lores luma plane.
+
+    Every ``every`` frames a subsampled copy of the Y plane is taken. Its mean
+    absolute horizontal gradient measures spatial detail. The mean absolute
+    difference to the previous sample measures motion. Both are scaled to
+    roughly 0..1.
+
+    The activity of a clip is its largest motion sample, so a car driving by
+    a parked dashcam for a second is not averaged away.
+    """
+
+    def __init__(self, lores_size, every=15, step=8):
+        self.width, self.height = lores_size
+        self.every = every
+        self.step = step
+        self._frame = 0
+        self._previous = None
+        self.reset()
+
+    def reset(self):
+        self._detail = []
+        self._motion = []
+
+    def sample(self, request):
+        self._frame += 1
+        if self._frame % self.every:
+            return
+        with MappedArray(request, "lores") as m:
+            luma = m.array[:self.height:self.step, :self.width:self.step].astype(np.int16)
+        self.add_luma(luma)
+
+    def add_luma(self, luma):
+        self._detail.append(np.abs(np.diff(luma, axis=1)).mean() / 32)
+        if self._previous is not None and self._previous.shape == luma.shape:
+            self._motion.append(np.abs(luma - self._previous).mean() / 32)
+        self._previous = luma
+
+    @property
+    def detail(self):
+        return min(1.0, float(np.mean(self._detail))) if self._detail else None
+
+    @property
+    def motion(self):
+        return min(1.0, float(np.mean(self._motion))) if self._motion else None
+
+    @property
+    def activity(self):
+        return min(1.0, float(np.max(self._motion))) if self._motion else None
+
+    @property
+    def complexity(self):
+        """How hard the clip is to encode, 0 (flat, static) to 1 (busy)."""
+        if self.detail is None:
+            return None
+        return min(1.0, 0.5 * self.detail + 0.5 * (self.motion or 0.0) * 4)
@@ -1,12 +1,18 @@
 import io
 import logging
-from fastapi import FastAPI, Request, Response
-from fastapi.responses import StreamingResponse
+import os
+from fastapi import FastAPI, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from threading import Condition
 from spyglass.url_parsing import check_urls_match, get_url_params
 from spyglass.exif import create_exif_header
-from spyglass.camera_options import parse_dictionary_to_html_page, process_controls
-from . import logger
+from spyglass.camera_options import controls_cache, get_page_head, parse_dictionary_to_html_page, process_controls
+from spyglass.clips import SPRITE_SUFFIX, THUMBNAIL_SUFFIX, TIMING_SUFFIX, clip_path
+from spyglass.export import find_covering_clips, stream_export
+from spyglass.timing import ClipTiming, clip_stream
+from spyglass.camera import pipeline_report
+from spyglass.event_loop import CAMERA_EXECUTOR, LoopWatchdog, run_blocking
+from . import logger, startup
 import uvicorn
 from picamera2.encoders import MJPEGEncoder 
 from picamera2.outputs import FileOutput
@@ -18,15 +24,22 @@ import time
 import asyncio
 
 class StreamingOutput(io.BufferedIOBase):
-    def __init__(self):
+    def __init__(self, loop=None):
         self.frame = None
         self.event = asyncio.Event()
+        self.loop = loop
 
     def write(self, buf):
-        self.frame = buf
-        self.event.set()
+        # Called from the encoder thread, asyncio.Event is not thread-safe.
+        # The frame and the time it left the encoder are replaced together.
+        self.frame = (buf, time.time())
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self.event.set)
 
     async def read(self):
+        """The next frame and the time (epoch seconds) the encoder delivered it."""
         await self.event.wait()
         self.event.clear()
         return self.frame
@@ -45,10 +58,8 @@ import asyncio
         
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Run at startup
-    asyncio.create_task(dvr.start_recording())
-    await dvr.start_gather_gps_thread()
-    await dvr.start_gather_status_thread()
+    # Recording, uploads, GPS and status reports are started by dvr.start()
+    # before the server, they do not wait for it.
     yield
     # Run on shutdown (if required)
     print('Shutting down...')
@@ -64,33 +75,69 @@ camera = None
 bind_address = None
 port = None
 dvr = None
+hls = None
+loop_watchdog = None
+headless = False
+
+STREAM_FRAME_TIMEOUT = 5
+
+NO_LORES = "The stream resolution is not configured with --headless, see docs/headless.md."
+PAUSED = "Recording is paused and the camera released, POST /recording/resume to record again."
+
+def has_lores():
+    return camera.camera_configuration()["lores"] is not None
 
 @app.get("/stream")
 async def stream(request: Request):
     print("Starting streaming again.")
-
-    output = StreamingOutput()
+    if dvr.paused:
+        return Response(PAUSED, status_code=503)
+    if not has_lores():
+        return Response(NO_LORES, status_code=503)
+    governor = dvr.governor
+    if governor and governor.active('viewers'):
+        return Response("The camera is too hot for viewers, try again later.", status_code=503)
+
+    output = StreamingOutput(asyncio.get_running_loop())
     encoder = MJPEGEncoder()
     # camera.pre_callback = apply_timestamp
-    camera.start_encoder(encoder, FileOutput(output), name="lores")
+    file_output = FileOutput(output)
+    if dvr.profiler:
+        file_output = dvr.profiler.instrument("mjpeg", encoder, file_output)
+    await run_blocking(camera.start_encoder, encoder, file_output, name="lores", executor=CAMERA_EXECUTOR)
     # camera.start()
 
-    time.sleep(1)
-
     async def generate():
+        sent_at = 0
         try:
             while True:
-                frame = await output.read()
+                try:
+                    frame, timestamp = await asyncio.wait_for(output.read(), STREAM_FRAME_TIMEOUT)
+                except asyncio.TimeoutError:
+                    # The camera was reconfigured and the encoder stopped, the client reconnects
+                    print("No frame from the camera, disconnecting the viewer.")
+                    break
+                if governor:
+                    if governor.active('viewers'):
+                        print("Camera too hot, disconnecting the viewer.")
+                        break
+                    # Frames are dropped here, the encoder keeps the rate of the lores stream
+                    if timestamp - sent_at < governor.stream_interval():
+                        continue
+                    sent_at = timestamp
                 # print(f"Frame length: {len(frame)}")  # Debugging frame length
                 yield b'--FRAME\r\n'
                 yield b'Content-Type: image/jpeg\r\n'
                 yield b'Content-Length: ' + str(len(frame)).encode() + b'\r\n'
+                # Lets clients measure how old a frame is when it arrives
+                yield b'X-Timestamp: ' + f'{timestamp:.6f}'.encode() + b'\r\n'
                 yield b'\r\n' + frame + b'\r\n'
         except asyncio.CancelledError:
             print("Client disconnected, stopping recording.")
             # camera.stop_encoder()
-            encoder.stop()
+            CAMERA_EXECUTOR.submit(encoder.stop)
             raise
+        CAMERA_EXECUTOR.submit(encoder.stop)
 
     async def monitor_disconnect():
         await request.is_disconnected()
@@ -101,44 +148,332 @@ async def stream(request: Request):
 
     return StreamingResponse(generate(), media_type="multipart/x-mixed-replace; boundary=FRAME")
 
+@app.get("/snapshot")
+async def snapshot():
+    if dvr.paused:
+        return Response(PAUSED, status_code=503)
+    if not has_lores():
+        return Response(NO_LORES, status_code=503)
+    output = StreamingOutput(asyncio.get_running_loop())
+    encoder = MJPEGEncoder()
+    await run_blocking(camera.start_encoder, encoder, FileOutput(output), name="lores", executor=CAMERA_EXECUTOR)
+    try:
+        frame, timestamp = await asyncio.wait_for(output.read(), timeout=5)
+    except asyncio.TimeoutError:
+        return Response("No frame from the camera.", status_code=503)
+    finally:
+        CAMERA_EXECUTOR.submit(encoder.stop)
+    if exif_header:
+        frame = exif_header + frame[2:]
+    headers = {'Cache-Control': 'no-store', 'X-Timestamp': f'{timestamp:.6f}'}
+    return Response(frame, media_type='image/jpeg', headers=headers)
+
+HLS_HEADERS = {'Cache-Control': 'no-cache'}
+
+async def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return condition()
+
+async def touch_hls():
+    if hls.running:
+        hls.touch()
+    else:
+        # Starting the stream starts an encoder and ffmpeg
+        await run_blocking(hls.touch, executor=CAMERA_EXECUTOR)
+
+@app.get("/hls/live.m3u8")
+async def hls_playlist(msn: int = Query(None, alias="_HLS_msn")):
+    if hls is None:
+        return Response(status_code=404)
+    if dvr.paused:
+        return Response(PAUSED, status_code=503)
+    await touch_hls()
+    ring = hls.muxer.ring
+    # Blocking playlist reload: answer once the requested segment exists
+    wanted = msn if msn is not None else 0
+    await wait_for(lambda: ring.next_sequence > wanted, 5)
+    return Response(ring.playlist(), media_type="application/vnd.apple.mpegurl", headers=HLS_HEADERS)
+
+@app.get("/hls/init.mp4")
+async def hls_init_segment():
+    if hls is None:
+        return Response(status_code=404)
+    if dvr.paused:
+        return Response(PAUSED, status_code=503)
+    await touch_hls()
+    ring = hls.muxer.ring
+    if not await wait_for(lambda: ring.init_segment is not None, 5):
+        return Response(status_code=404)
+    return Response(ring.init_segment, media_type="video/mp4")
+
+@app.get("/hls/segment_{sequence}.m4s")
+async def hls_segment(sequence: int):
+    if hls is None:
+        return Response(status_code=404)
+    if dvr.paused:
+        return Response(PAUSED, status_code=503)
+    await touch_hls()
+    segment = hls.muxer.ring.get(sequence)
+    if segment is None:
+        return Response(status_code=404)
+    return Response(segment.data, media_type="video/iso.segment")
+
 @app.get("/videos")
 async def list_videos(start_time: int = 0, end_time: int = 0):
-    return dvr.list_clips(start_time, end_time)
+    return await run_blocking(dvr.list_clips, start_time, end_time)
 
 @app.get("/status")
 async def status():
-    return dvr.get_system_status()
+    # Runs free and vcgencmd
+    return await run_blocking(dvr.get_system_status)
+
+@app.get("/camera")
+async def camera_report():
+    # Preview, streams and camera buffer memory
+    return await run_blocking(pipeline_report, camera.camera_configuration(), headless)
+
+@app.get("/profile")
+async def profile():
+    if dvr.profiler is None:
+        return Response("Profiling is disabled. Start spyglass with --profile.", status_code=404)
+    return dvr.profiler.report()
+
+@app.get("/loop")
+async def loop_report():
+    # Times the event loop was held by a blocking call, and where
+    if loop_watchdog is None:
+        return Response("The event loop watchdog is disabled.", status_code=404)
+    return loop_watchdog.report()
+
+@app.get("/workers")
+async def workers():
+    if dvr.supervisor is None:
+        return Response("Worker processes are disabled. Start spyglass with --worker_processes.", status_code=404)
+    return dvr.supervisor.report()
+
+@app.get("/startup")
+async def startup_report():
+    return startup.report()
+
+@app.get("/recovery")
+async def recovery_report():
+    # Clips recovered after a crash, and how long the scan took
+    if dvr.recovery is None:
+        return Response("Recording has not started.", status_code=404)
+    return dvr.recovery.report()
+
+@app.get("/archive")
+async def archive_report():
+    if dvr.archiver is None:
+        return Response("Archiving is disabled. Start spyglass with --archive_after_hours.", status_code=404)
+    return dvr.archiver.report()
+
+@app.get("/governor")
+async def governor_report():
+    if dvr.governor is None:
+        return Response("The governor is disabled. Start spyglass with --governor_temperatures.", status_code=404)
+    return dvr.governor.report()
+
+def read_timing(clip_id: str):
+    try:
+        return ClipTiming(clip_path(dvr.clips_folder, clip_id, TIMING_SUFFIX))
+    except (ValueError, OSError):
+        return None
 
 @app.get("/videos/{clip_id}")
-async def stream_video_clip(clip_id: str):
-    file_path = f"{dvr.clips_folder}/{clip_id}.h264" 
+async def stream_video_clip(clip_id: str, t: float = None):
+    try:
+        file_path = clip_path(dvr.clips_folder, clip_id)
+    except ValueError:
+        return Response(status_code=404)
+    if not os.path.isfile(file_path):
+        return Response(status_code=404)
+
+    # Start at the keyframe before t seconds into the clip, from the timing sidecar
+    if t is not None:
+        timing = await run_blocking(read_timing, clip_id)
+        position = timing.seek(timing.start + t) if timing and timing.start is not None else None
+        if position is not None:
+            offset, frame = position
+            headers = {'X-Frame': str(frame), 'X-Start-Time': f"{timing.wall_time(frame):.6f}"}
+            return StreamingResponse(clip_stream(file_path, offset, timing.init_end), media_type="video/mp4",
+                                     headers=headers)
 
     def iterfile():
         with open(file_path, "rb") as file_like:
             yield from file_like
     return StreamingResponse(iterfile(), media_type="video/mp4")
 
+@app.get("/videos/{clip_id}/timing")
+async def clip_timing(clip_id: str, at: float = None):
+    # The frame captured at an epoch time, to line up GPS fixes and other sensors with the video
+    timing = await run_blocking(read_timing, clip_id)
+    if timing is None:
+        return Response(status_code=404)
+    if at is None:
+        return timing.report()
+    frame = timing.frame_at(at)
+    if frame is None:
+        return Response("Before the first frame of the clip", status_code=404)
+    sensor_timestamp, wall_time, size, fragment, flags = timing.record(frame)
+    return {"frame": frame, "wall_time": wall_time, "sensor_timestamp": sensor_timestamp, "fragment": fragment}
+
+# Thumbnails never change once a clip is finished.
+CLIP_IMAGE_HEADERS = {'Cache-Control': 'public, max-age=31536000, immutable'}
+
+def clip_image_response(clip_id: str, suffix: str, headers=None):
+    try:
+        file_path = clip_path(dvr.clips_folder, clip_id, suffix)
+    except ValueError:
+        return Response(status_code=404)
+    if not os.path.isfile(file_path):
+        return Response(status_code=404)
+    return FileResponse(file_path, media_type='image/jpeg', headers={**CLIP_IMAGE_HEADERS, **(headers or {})})
+
+@app.get("/videos/{clip_id}/thumbnail")
+async def clip_thumbnail(clip_id: str):
+    return clip_image_response(clip_id, THUMBNAIL_SUFFIX)
+
+@app.get("/videos/{clip_id}/sprite")
+async def clip_sprite(clip_id: str):
+    headers = {}
+    if dvr.thumbnailer:
+        # Lets a review UI map a position in the sheet back to a time in the clip
+        headers = {
+            'X-Sprite-Interval': str(dvr.thumbnailer.interval),
+            'X-Sprite-Columns': str(dvr.thumbnailer.columns),
+            'X-Sprite-Tile': '%dx%d' % dvr.thumbnailer.tile_size,
+        }
+    return clip_image_response(clip_id, SPRITE_SUFFIX, headers)
+
+@app.post("/videos/{clip_id}/upload")
+async def upload_video_clip(clip_id: str):
+    # Full resolution clips held back by --full_upload_policy are sent on request
+    try:
+        file_path = clip_path(dvr.clips_folder, clip_id)
+    except ValueError:
+        return Response(status_code=404)
+    if not os.path.isfile(file_path):
+        return Response(status_code=404)
+    dvr.upload_clips_manager.request_upload(file_path)
+    return {"queued": clip_id}
+
+@app.post("/events")
+async def mark_event(label: str = "", timestamp: float = None):
+    # Returns right away, the pre-roll is written and the clips locked in the background
+    if dvr.incidents is None:
+        return Response("Recording has not started.", status_code=404)
+    return dvr.incidents.mark(timestamp, label)
+
+@app.get("/export")
+async def export_videos(start: int, end: int):
+    # One MP4 for [start, end) (epoch seconds), remuxed from the covering clips
+    if end <= start:
+        return Response("end must be after start", status_code=400)
+    clips = await run_blocking(find_covering_clips, dvr.clips_folder, start, end, dvr.clip_duration)
+    if not clips:
+        return Response(status_code=404)
+    headers = {'Content-Disposition': f'attachment; filename="export_{start}_{end}.mp4"'}
+    return StreamingResponse(stream_export(clips, start, end, dvr.clip_duration), media_type="video/mp4", headers=headers)
+
+@app.get("/recording/config")
+async def recording_config():
+    return dvr.recording_config()
+
+@app.post("/recording/config")
+async def change_recording_config(clip_fps: int = None, clip_resolution: str = None, clip_duration: int = None,
+                                  quality_factor: int = None, fps: int = None, resolution: str = None):
+    # Applied when the clip being recorded ends
+    changes = {'clip_fps': clip_fps, 'clip_resolution': clip_resolution, 'clip_duration': clip_duration,
+               'quality_factor': quality_factor, 'fps': fps, 'resolution': resolution}
+    try:
+        pending = dvr.request_reconfigure(changes)
+    except ValueError as e:
+        return Response(str(e), status_code=400)
+    return {"pending": pending}
+
+@app.post("/recording/pause")
+async def pause_recording():
+    if dvr.camera_factory is None:
+        return Response("Pausing is disabled, the camera could not be opened again.", status_code=404)
+    # Waits for the clip being recorded to be finished
+    try:
+        return await run_blocking(dvr.pause)
+    except TimeoutError as e:
+        return Response(str(e), status_code=503)
+
+@app.post("/recording/resume")
+async def resume_recording():
+    global camera
+    try:
+        report = await run_blocking(dvr.resume)
+    except (RuntimeError, TimeoutError) as e:
+        return Response(str(e), status_code=503)
+    # The camera was opened again as a new Picamera2
+    camera = dvr.picam2
+    if hls:
+        hls.camera = camera
+    return report
+
 @app.get("/read_mode")
 async def read_mode():
-    # Stops this program recording 
-    exit(1)
+    # Same as POST /recording/pause, kept as a GET for the clients that call it to take the camera
+    return await pause_recording()
 
 @app.get("/controls")
 async def controls(request: Request):
     parsed_controls = get_url_params(str(request.url))
     parsed_controls = parsed_controls if parsed_controls else None
     processed_controls = process_controls(camera, parsed_controls)
-    camera.set_controls(processed_controls)
+    dvr.control_queue.submit(processed_controls)
     content = parse_dictionary_to_html_page(camera, parsed_controls, processed_controls).encode('utf-8')
     return Response(content, media_type='text/html')
 
 
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag in (etag, '*'):
+            return True
+    return False
+
+@app.get("/api/controls")
+async def controls_api(request: Request):
+    cache = controls_cache.get(camera)
+    headers = {'ETag': cache.etag, 'Cache-Control': 'no-cache'}
+    if etag_matches(request.headers.get('if-none-match'), cache.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(cache.json, media_type='application/json', headers=headers)
+
+
+@app.get("/api/controls/updates")
+async def control_updates():
+    # Applied and pending values, and how long recent changes took to show up in frames
+    return dvr.control_queue.report()
+
+
 @app.on_event("startup")
 async def startup_event():
+    # Render the static parts of /controls before the first request
+    get_page_head()
+    controls_cache.get(camera)
+
+    if loop_watchdog:
+        loop_watchdog.start()
+
     logger.info('Server listening on %s:%d', bind_address, port)
     logger.info('Streaming endpoint: /stream')
     logger.info('Snapshot endpoint: /snapshot')
     logger.info('Controls endpoint: /controls')
+    logger.info('Controls API endpoint: /api/controls')
+    if hls:
+        logger.info('HLS endpoint: /hls/live.m3u8')
 
     # dvr.start_recording_thread()
 
@@ -149,7 +484,10 @@ def run_server(server_bind_address,
                pidvr: DVR,
                stream_url='/stream',
                snapshot_url='/snapshot',
-               orientation_exif=0):
+               orientation_exif=0,
+               hls_stream=None,
+               loop_lag_threshold=0.1,
+               headless_camera=False):
     
     global exif_header
     exif_header = create_exif_header(orientation_exif)
@@ -166,4 +504,13 @@ def run_server(server_bind_address,
     global dvr
     dvr = pidvr
 
+    global hls
+    hls = hls_stream
+
+    global loop_watchdog
+    loop_watchdog = LoopWatchdog(loop_lag_threshold) if loop_lag_threshold > 0 else None
+
+    global headless
+    headless = headless_camera
+
     uvicorn.run(app, host=bind_address, port=port)
@@ -0,0 +1,586 @@
+"""A camera without hardware.
+
+:class:`Picamera2` mimics the parts of picamera2 spyglass uses. It produces
+synthetic ``main`` and ``lores`` frames at the configured resolution and
+frame rate, calls ``pre_callback`` with each request, and feeds the running
+encoders. The encoders produce H.264/MJPEG sized payloads after a
+configurable latency and pass them to their outputs, so clip rotation,
+streaming and uploads can be exercised and benchmarked on any machine.
+
+``install()`` registers the simulator as the ``picamera2`` and ``libcamera``
+modules, ``spyglass --simulate`` uses it to run without a camera.
+"""
+import enum
+import os
+import shutil
+import struct
+import sys
+import threading
+import time
+import types
+from collections import deque
+from queue import Queue
+
+try:
+    import numpy as np
+except ImportError:  # Frames have no pixels, encoders and outputs still work
+    np = None
+
+START_CODE = b'\x00\x00\x00\x01'
+# SPS, PPS and an IDR slice start every GOP like on the hardware encoder
+KEYFRAME_HEADER = (START_CODE + b'\x67\x64\x00\x28' + START_CODE + b'\x68\xee\x3c\x80' + START_CODE + b'\x65')
+SLICE_HEADER = START_CODE + b'\x41'
+
+
+# region requests
+
+class _Request:
+    def __init__(self, sequence):
+        self.sequence = sequence
+
+
+class CompletedRequest:
+    def __init__(self, sequence, timestamp_ns, frame_duration_us, arrays, controls):
+        self.request = _Request(sequence)
+        self._arrays = arrays
+        self._metadata = dict(controls)
+        self._metadata['SensorTimestamp'] = timestamp_ns
+        self._metadata['FrameDuration'] = frame_duration_us
+
+    def get_metadata(self):
+        return dict(self._metadata)
+
+    def make_array(self, name):
+        return self._arrays.get(name)
+
+    def make_buffer(self, name):
+        array = self._arrays.get(name)
+        return array.tobytes() if array is not None else b''
+
+
+class MappedArray:
+    def __init__(self, request, stream, reshape=True, write=True):
+        self.request = request
+        self.stream = stream
+
+    def __enter__(self):
+        self.array = self.request.make_array(self.stream)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+def _frame_patterns(size, fmt, count=4):
+    """A few frames of a moving gradient with noise, cycled by the camera."""
+    width, height = size
+    rng = np.random.default_rng(0)
+    x = np.arange(width, dtype=np.uint16)
+    patterns = []
+    for i in range(count):
+        row = ((x + i * 16) % 256).astype(np.uint8)
+        if fmt == 'YUV420':
+            frame = np.empty((height * 3 // 2, width), dtype=np.uint8)
+            frame[:height] = row
+            frame[height:] = 128
+            frame[:height] ^= rng.integers(0, 8, (height, width), dtype=np.uint8)
+        else:
+            frame = np.empty((height, width, 4), dtype=np.uint8)
+            frame[:] = row[None, :, None]
+        patterns.append(frame)
+    return patterns
+
+# endregion
+
+
+# region encoders
+
+class Encoder:
+    """Turns requests into fixed size payloads after ``latency`` seconds."""
+
+    def __init__(self, latency=None):
+        self._output = []
+        self.latency = latency
+        self.running = False
+        self.name = None
+        self.fps = 30
+        self.size = (640, 480)
+        self.frames = 0
+        self._queue = None
+        self._thread = None
+
+    @property
+    def output(self):
+        return self._output
+
+    @output.setter
+    def output(self, value):
+        self._output = list(value) if isinstance(value, (list, tuple)) else [value]
+
+    def frame_size(self, keyframe):
+        return 1024
+
+    def start(self, fps, size, latency=0):
+        self.fps = fps
+        self.size = size
+        if self.latency is None:
+            self.latency = latency
+        self.frames = 0
+        self.running = True
+        if self.latency:
+            self._queue = Queue()
+            self._thread = threading.Thread(target=self._run, name=f"encoder-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        if self._thread:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        for output in self._output:
+            output.stop()
+
+    def encode(self, stream, request):
+        timestamp_us = request.get_metadata()['SensorTimestamp'] // 1000
+        if self._queue is not None:
+            self._queue.put((time.monotonic() + self.latency, timestamp_us))
+        else:
+            self._encode(timestamp_us)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            due, timestamp_us = item
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._encode(timestamp_us)
+
+    def _encode(self, timestamp_us):
+        keyframe = self.is_keyframe(self.frames)
+        self.frames += 1
+        self.outputframe(self.payload(keyframe), keyframe, timestamp_us)
+
+    def is_keyframe(self, index):
+        return True
+
+    def payload(self, keyframe):
+        return bytes(self.frame_size(keyframe))
+
+    def outputframe(self, frame, keyframe=True, timestamp=None):
+        for output in self._output:
+            output.outputframe(frame, keyframe, timestamp)
+
+
+class H264Encoder(Encoder):
+    def __init__(self, bitrate=None, repeat=False, iperiod=None, latency=None):
+        super().__init__(latency)
+        self.bitrate = bitrate or 10000000
+        self.repeat = repeat
+        self.iperiod = iperiod
+
+    def is_keyframe(self, index):
+        return index % (self.iperiod or self.fps) == 0
+
+    def frame_size(self, keyframe):
+        # An I frame costs about five P frames
+        gop = self.iperiod or self.fps
+        average = self.bitrate / 8 / self.fps
+        p_frame = average * gop / (gop + 4)
+        return int(p_frame * 5 if keyframe else p_frame)
+
+    def payload(self, keyframe):
+        header = KEYFRAME_HEADER if keyframe else SLICE_HEADER
+        return header + bytes(max(0, self.frame_size(keyframe) - len(header)))
+
+
+class MJPEGEncoder(Encoder):
+    def __init__(self, bitrate=None, latency=None):
+        super().__init__(latency)
+        self.bitrate = bitrate
+
+    def frame_size(self, keyframe):
+        if self.bitrate:
+            return int(self.bitrate / 8 / self.fps)
+        # Roughly 1.5 bits per pixel for a typical scene
+        return self.size[0] * self.size[1] * 3 // 16
+
+    def payload(self, keyframe):
+        return b'\xff\xd8' + bytes(max(0, self.frame_size(keyframe) - 4)) + b'\xff\xd9'
+
+# endregion
+
+
+# region outputs
+
+class Output:
+    def __init__(self, pts=None):
+        self.recording = False
+
+    def start(self):
+        self.recording = True
+
+    def stop(self):
+        self.recording = False
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        pass
+
+
+class FileOutput(Output):
+    def __init__(self, file=None, pts=None, split=None):
+        super().__init__(pts)
+        self._own_file = isinstance(file, str)
+        self.fileoutput = open(file, 'wb') if self._own_file else file
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if self.recording and self.fileoutput is not None:
+            self.fileoutput.write(frame)
+
+    def stop(self):
+        super().stop()
+        if self._own_file:
+            self.fileoutput.close()
+
+
+def box(box_type, payload=b''):
+    """An MP4 box of ``box_type`` (four bytes) around ``payload``."""
+    return struct.pack('>I4s', 8 + len(payload), box_type) + payload
+
+
+class FfmpegOutput(FileOutput):
+    """Writes the stream as MP4 boxes to the last file name of the ffmpeg arguments.
+
+    The box layout follows ffmpeg: ``ftyp``, ``mdat`` and a ``moov`` at the
+    end, or with ``-movflags +frag_keyframe`` ``ftyp``, an empty ``moov`` and
+    a ``moof`` + ``mdat`` fragment per GOP, written when the next keyframe
+    arrives. The contents of the boxes are not real video.
+    """
+
+    def __init__(self, output_filename, audio=False, **kwargs):
+        self.output_filename = output_filename
+        self._path = output_filename.split()[-1]
+        self.fragmented = 'frag_keyframe' in output_filename
+        Output.__init__(self)
+        self._own_file = True
+        self.fileoutput = None
+        self._gop = []
+        self._fragments = 0
+
+    def start(self):
+        self.fileoutput = open(self._path, 'wb')
+        self.fileoutput.write(box(b'ftyp', b'isom\x00\x00\x02\x00isomiso6mp41'))
+        if self.fragmented:
+            self.fileoutput.write(box(b'moov', box(b'mvhd', bytes(100))))
+        else:
+            self._mdat_offset = self.fileoutput.tell()
+            self.fileoutput.write(box(b'mdat'))
+        self.fileoutput.flush()
+        super().start()
+
+    def outputframe(self, frame, keyframe=True, timestamp=None, packet=None, audio=False):
+        if not self.recording:
+            return
+        if not self.fragmented:
+            self.fileoutput.write(frame)
+            return
+        if keyframe and self._gop:
+            self._write_fragment()
+        self._gop.append(frame)
+
+    def _write_fragment(self):
+        self._fragments += 1
+        self.fileoutput.write(box(b'moof', box(b'mfhd', struct.pack('>II', 0, self._fragments))))
+        self.fileoutput.write(box(b'mdat', b''.join(self._gop)))
+        self.fileoutput.flush()
+        self._gop = []
+
+    def stop(self):
+        if self.recording:
+            if self.fragmented:
+                if self._gop:
+                    self._write_fragment()
+            else:
+                end = self.fileoutput.tell()
+                self.fileoutput.seek(self._mdat_offset)
+                self.fileoutput.write(struct.pack('>I', end - self._mdat_offset))
+                self.fileoutput.seek(end)
+                self.fileoutput.write(box(b'moov', box(b'mvhd', bytes(100))))
+        super().stop()
+
+# endregion
+
+
+class Preview(enum.Enum):
+    NULL = 0
+    DRM = 1
+    QT = 2
+    QTGL = 3
+
+
+CAMERA_CONTROLS = {
+    'AeEnable': (False, True, True),
+    'AnalogueGain': (1.0, 16.0, 1.0),
+    'AwbEnable': (False, True, True),
+    'Brightness': (-1.0, 1.0, 0.0),
+    'Contrast': (0.0, 32.0, 1.0),
+    'ExposureTime': (100, 1000000, 20000),
+    'FrameDurationLimits': (33333, 1000000, 33333),
+    'Saturation': (0.0, 32.0, 1.0),
+    'Sharpness': (0.0, 16.0, 1.0),
+}
+
+
+class Picamera2:
+    """Synthetic camera, see the module docstring.
+
+    ``encoder_latency`` is the default time between a frame and its encoded
+    output, 0 encodes on the frame thread.
+    """
+
+    def __init__(self, camera_num=0, tuning=None, main_size=(1920, 1080), lores_size=(640, 480), fps=30,
+                 buffer_count=6, encoder_latency=0.0):
+        self.camera_controls = dict(CAMERA_CONTROLS)
+        self.pre_callback = None
+        self.post_callback = None
+        self.encoder_latency = encoder_latency
+        self.controls = {}
+        self.encoders = []
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop = threading.Event()
+        self.sequence = 0
+        # Like the device, a closed camera is gone, a new Picamera2 opens it again
+        self.closed = False
+        self.configure(self.create_video_configuration(main={'size': main_size}, lores={'size': lores_size},
+                                                       controls={'FrameRate': fps}, buffer_count=buffer_count))
+
+    @staticmethod
+    def load_tuning_file(tuning_file, dir=None):
+        return {}
+
+    def start_preview(self, *args, **kwargs):
+        pass
+
+    def stop_preview(self):
+        pass
+
+    def create_video_configuration(self, main=None, lores=None, controls=None, transform=None, buffer_count=6,
+                                   **kwargs):
+        main = dict(main or {})
+        main.setdefault('size', (1280, 720))
+        main.setdefault('format', 'XBGR8888')
+        config = {'main': main, 'lores': None, 'controls': dict(controls or {}), 'transform': transform,
+                  'buffer_count': buffer_count}
+        if lores:
+            lores = dict(lores)
+            lores.setdefault('format', 'YUV420')
+            config['lores'] = lores
+        return config
+
+    def configure(self, config):
+        self.config = config
+        self.controls.update(config['controls'])
+        self.fps = self.controls.get('FrameRate', 30)
+        self._buffers = {}
+        if np is not None:
+            for name in ('main', 'lores'):
+                stream = config[name]
+                if stream:
+                    # Requests cycle through a pool of buffers like libcamera's, the
+                    # pixels are written once, not for every frame
+                    patterns = _frame_patterns(stream['size'], stream['format'])
+                    self._buffers[name] = deque(patterns[i % len(patterns)].copy()
+                                                for i in range(config['buffer_count']))
+
+    def camera_configuration(self):
+        return self.config
+
+    def set_controls(self, controls):
+        with self._lock:
+            self.controls.update(controls)
+            self.fps = self.controls.get('FrameRate', self.fps)
+
+    def capture_metadata(self):
+        return self._request(time.monotonic_ns()).get_metadata()
+
+    # region running
+
+    def start(self, config=None, show_preview=False):
+        if self.closed:
+            raise RuntimeError("Camera is closed")
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="simulated-camera", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        self.stop_recording()
+        self.closed = True
+
+    def _run(self):
+        next_frame = time.monotonic()
+        while not self._stop.is_set():
+            self.capture_frame()
+            next_frame += 1 / self.fps
+            delay = next_frame - time.monotonic()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                # Too slow to keep up, frames are dropped like on the sensor
+                missed = int(-delay * self.fps) + 1
+                self.sequence += missed - 1
+                next_frame += (missed - 1) / self.fps
+
+    def run_frames(self, count):
+        """Deliver ``count`` frames right away on the calling thread (for benchmarks)."""
+        for _ in range(count):
+            self.capture_frame()
+
+    def _request(self, timestamp_ns):
+        arrays = {}
+        for name, buffers in self._buffers.items():
+            arrays[name] = buffers[0]
+            buffers.rotate(-1)
+        return CompletedRequest(self.sequence, timestamp_ns, int(1000000 / self.fps), arrays, self.controls)
+
+    def capture_frame(self):
+        self.sequence += 1
+        request = self._request(time.monotonic_ns())
+        if self.pre_callback:
+            self.pre_callback(request)
+        with self._lock:
+            self.encoders = [encoder for encoder in self.encoders if encoder.running]
+            encoders = list(self.encoders)
+        for encoder in encoders:
+            encoder.encode(encoder.name, request)
+        if self.post_callback:
+            self.post_callback(request)
+        return request
+
+    # endregion
+
+    # region encoders
+
+    def start_encoder(self, encoder, output=None, pts=None, quality=None, name=None):
+        name = name or 'main'
+        if output is not None:
+            encoder.output = output
+        encoder.name = name
+        for out in encoder.output:
+            out.start()
+        encoder.start(self.fps, self.config[name]['size'], self.encoder_latency)
+        with self._lock:
+            self.encoders.append(encoder)
+
+    def start_recording(self, encoder, output, pts=None, config=None, quality=None, name=None):
+        self.start_encoder(encoder, output, pts=pts, quality=quality, name=name)
+        self.start()
+
+    def stop_encoder(self, encoders=None):
+        with self._lock:
+            if encoders is None:
+                encoders = list(self.encoders)
+            elif not isinstance(encoders, (list, tuple)):
+                encoders = [encoders]
+        for encoder in encoders:
+            encoder.stop()
+
+    def stop_recording(self):
+        self.stop_encoder()
+        self.stop()
+
+    # endregion
+
+
+class FakeSFTPClient:
+    """Local stand-in for paramiko's SFTPClient, "uploads" copy into ``root``."""
+
+    def __init__(self, root, bytes_per_second=None):
+        self.root = root
+        self.cwd = '/'
+        self.bytes_per_second = bytes_per_second
+        self.uploaded = []
+
+    def _local(self, path):
+        return os.path.join(self.root, os.path.join(self.cwd, path).lstrip('/'))
+
+    def listdir(self, path='.'):
+        return os.listdir(self._local(path))
+
+    def getcwd(self):
+        return self.cwd
+
+    def chdir(self, path):
+        if not os.path.isdir(self._local(path)):
+            raise IOError(f"No such directory: {path}")
+        self.cwd = os.path.join(self.cwd, path)
+
+    def mkdir(self, path):
+        os.makedirs(self._local(path))
+
+    def open(self, filename, mode='r', bufsize=-1):
+        target = self._local(filename)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        return open(target, mode)
+
+    def put(self, localpath, remotepath):
+        target = self._local(remotepath)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(localpath, target)
+        if self.bytes_per_second:
+            time.sleep(os.path.getsize(localpath) / self.bytes_per_second)
+        self.uploaded.append(remotepath)
+
+    def close(self):
+        pass
+
+
+def modules():
+    """The simulator as the ``picamera2`` and ``libcamera`` modules, by module name."""
+    picamera2 = types.ModuleType('picamera2')
+    picamera2.Picamera2 = Picamera2
+    picamera2.MappedArray = MappedArray
+    picamera2.Preview = Preview
+    encoders = types.ModuleType('picamera2.encoders')
+    encoders.Encoder = Encoder
+    encoders.H264Encoder = H264Encoder
+    encoders.MJPEGEncoder = MJPEGEncoder
+    outputs = types.ModuleType('picamera2.outputs')
+    outputs.Output = Output
+    outputs.FileOutput = FileOutput
+    outputs.FfmpegOutput = FfmpegOutput
+    picamera2.encoders = encoders
+    picamera2.outputs = outputs
+
+    libcamera = types.ModuleType('libcamera')
+    libcamera.controls = types.SimpleNamespace(
+        AfModeEnum=enum.IntEnum('AfModeEnum', 'Manual Auto Continuous', start=0),
+        AfSpeedEnum=enum.IntEnum('AfSpeedEnum', 'Normal Fast', start=0),
+    )
+    libcamera.Transform = lambda hflip=0, vflip=0: {'hflip': hflip, 'vflip': vflip}
+
+    return {
+        'picamera2': picamera2,
+        'picamera2.encoders': encoders,
+        'picamera2.outputs': outputs,
+        'libcamera': libcamera,
+    }
+
+
+def install():
+    """Make ``import picamera2`` and ``import libcamera`` return the simulator."""
+    sys.modules.update(modules())
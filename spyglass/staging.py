@@ -0,0 +1,184 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from queue import Empty, Queue
+
+CHUNK_SIZE = 4 * 1024 * 1024
+FSYNC_BATCH_BYTES = 64 * 1024 * 1024
+APPEND_FLUSH_BYTES = 64 * 1024
+APPEND_FLUSH_INTERVAL = 60
+
+
+class WriteBehind:
+    """Serializes the bulk writes to the SD card on a single I/O thread.
+
+    Clips are recorded into a RAM backed staging folder (tmpfs) and copied to
+    the card afterwards in large sequential chunks, one file at a time. The
+    copies are fsynced in batches: files stay open until about
+    ``fsync_batch_bytes`` have been written or the queue runs empty, then all
+    of them are synced and only then renamed to their final names, so a clip
+    name on the card always refers to complete data.
+
+    Small appends (``gps_data.csv``) are buffered in memory and written by the
+    same thread so they never interleave with a clip copy.
+    """
+
+    def __init__(self, staging_folder, chunk_size=CHUNK_SIZE, fsync_batch_bytes=FSYNC_BATCH_BYTES,
+                 append_flush_bytes=APPEND_FLUSH_BYTES, append_flush_interval=APPEND_FLUSH_INTERVAL):
+        self.staging_folder = staging_folder
+        self.chunk_size = chunk_size
+        self.fsync_batch_bytes = fsync_batch_bytes
+        self.append_flush_bytes = append_flush_bytes
+        self.append_flush_interval = append_flush_interval
+
+        os.makedirs(staging_folder, exist_ok=True)
+
+        self.queue = Queue()
+        self._batch = []  # (fd, tmp path, final path, callback)
+        self._batch_bytes = 0
+        self._appends = {}
+        self._appends_lock = threading.Lock()
+        self._last_append_flush = time.monotonic()
+
+        self.bytes_written = 0
+        self.files_written = 0
+        self.fsyncs = 0
+        self.write_seconds = 0.0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def staging_path(self, name):
+        return os.path.join(self.staging_folder, name)
+
+    def has_room_for(self, size):
+        """True if ``size`` more bytes fit into the staging folder."""
+        return shutil.disk_usage(self.staging_folder).free > size
+
+    def move(self, src, dst, callback=None):
+        """Move ``src`` from the staging folder to ``dst`` on the card.
+
+        ``callback(dst)`` is called from the I/O thread once ``dst`` is on
+        disk.
+        """
+        self.queue.put((src, dst, callback))
+
+    def append(self, path, text):
+        with self._appends_lock:
+            self._appends[path] = self._appends.get(path, '') + text
+            pending = sum(len(t) for t in self._appends.values())
+        if pending >= self.append_flush_bytes:
+            self.queue.put(None)
+
+    def stop(self):
+        self.queue.put(False)
+        self.thread.join()
+
+    def stats(self):
+        return {
+            'bytes_written': self.bytes_written,
+            'files_written': self.files_written,
+            'fsyncs': self.fsyncs,
+            'queued': self.queue.qsize(),
+            'mb_per_second': round(self.bytes_written / self.write_seconds / 1e6, 2) if self.write_seconds else None,
+        }
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.append_flush_interval if not self._batch else 0)
+            except Empty:
+                # Nothing else queued, sync what has been written so far
+                self._sync_batch()
+                self._flush_appends()
+                continue
+
+            if item is False:
+                self._sync_batch()
+                self._flush_appends(force=True)
+                return
+            if item is None:
+                self._flush_appends(force=True)
+                continue
+
+            src, dst, callback = item
+            try:
+                self._copy(src, dst, callback)
+            except OSError as e:
+                logging.error(f"Failed to write {src} to {dst}: {e}")
+            if self._batch_bytes >= self.fsync_batch_bytes:
+                self._sync_batch()
+            self._flush_appends()
+
+    def _copy(self, src, dst, callback):
+        tmp = dst + '.part'
+        start = time.monotonic()
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            with open(src, 'rb', buffering=0) as f:
+                while True:
+                    chunk = f.read(self.chunk_size)
+                    if not chunk:
+                        break
+                    view = memoryview(chunk)
+                    while view:
+                        written = os.write(fd, view)
+                        view = view[written:]
+                    self.bytes_written += len(chunk)
+                    self._batch_bytes += len(chunk)
+        except OSError:
+            os.close(fd)
+            os.remove(tmp)
+            raise
+        self.write_seconds += time.monotonic() - start
+        self._batch.append((fd, tmp, dst, callback))
+        os.remove(src)
+
+    def _sync_batch(self):
+        if not self._batch:
+            return
+        start = time.monotonic()
+        folders = set()
+        for fd, tmp, dst, callback in self._batch:
+            try:
+                os.fsync(fd)
+                self.fsyncs += 1
+            finally:
+                os.close(fd)
+            os.rename(tmp, dst)
+            folders.add(os.path.dirname(dst))
+        for folder in folders:
+            self._fsync_folder(folder)
+        self.write_seconds += time.monotonic() - start
+
+        batch, self._batch, self._batch_bytes = self._batch, [], 0
+        for fd, tmp, dst, callback in batch:
+            self.files_written += 1
+            if callback:
+                try:
+                    callback(dst)
+                except Exception as e:
+                    logging.error(f"Callback for {dst} failed: {e}")
+
+    def _fsync_folder(self, folder):
+        fd = os.open(folder or '.', os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            self.fsyncs += 1
+        finally:
+            os.close(fd)
+
+    def _flush_appends(self, force=False):
+        if not force and time.monotonic() - self._last_append_flush < self.append_flush_interval:
+            return
+        with self._appends_lock:
+            appends, self._appends = self._appends, {}
+        self._last_append_flush = time.monotonic()
+        for path, text in appends.items():
+            try:
+                with open(path, 'a') as f:
+                    f.write(text)
+            except OSError as e:
+                logging.error(f"Failed to append to {path}: {e}")
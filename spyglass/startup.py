@@ -0,0 +1,41 @@
+"""Startup milestones, in seconds since the process was started.
+
+The clock starts when the kernel created the process, so interpreter startup
+and imports are included.
+"""
+import logging
+import os
+import time
+
+_marks = {}
+
+
+def process_start_time(stat_file='/proc/self/stat', uptime_file='/proc/uptime'):
+    """``time.monotonic()`` at the moment this process was created."""
+    try:
+        with open(stat_file) as f:
+            # The command name can contain spaces, fields are counted after it
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(uptime_file) as f:
+            uptime = float(f.read().split()[0])
+        started_after_boot = int(fields[19]) / os.sysconf('SC_CLK_TCK')
+        # CLOCK_MONOTONIC and /proc/uptime both count from boot
+        return time.monotonic() - (uptime - started_after_boot)
+    except (OSError, IndexError, ValueError):
+        return _IMPORT_TIME
+
+
+_IMPORT_TIME = time.monotonic()
+_START_TIME = process_start_time()
+
+
+def mark(name):
+    """Record the first time ``name`` happened."""
+    if name in _marks:
+        return
+    _marks[name] = round(time.monotonic() - _START_TIME, 3)
+    logging.info(f"Startup: {name} after {_marks[name]:.3f} s")
+
+
+def report():
+    return dict(_marks)
@@ -0,0 +1,102 @@
+import logging
+import math
+import time
+from queue import Queue
+from threading import Thread
+
+import cv2
+import numpy as np
+from picamera2 import MappedArray
+
+from spyglass.clips import SPRITE_SUFFIX, THUMBNAIL_SUFFIX, sidecar_path
+
+
+class ClipThumbnailer:
+    """Builds a poster JPEG and a scrubbing sprite sheet for every clip.
+
+    Every ``interval`` seconds the already captured lores frame is copied out
+    of the camera request. Colour conversion, scaling and JPEG encoding happen
+    on a worker thread so the camera callback only pays for the copy.
+    """
+
+    def __init__(self, interval, lores_size, tile_width=160, columns=10, quality=70):
+        self.interval = interval
+        self.lores_size = lores_size
+        self.tile_size = (tile_width, round(tile_width * lores_size[1] / lores_size[0]))
+        self.columns = columns
+        self.quality = quality
+
+        self._clip = None
+        self._next_sample = 0
+        self._queue = Queue()
+
+        worker = Thread(target=self._run, daemon=True)
+        worker.start()
+
+    def start(self, clip_duration):
+        self._clip = _ClipSheet(int(clip_duration / self.interval) // 2)
+        self._next_sample = 0
+
+    def sample(self, request):
+        clip = self._clip
+        if clip is None:
+            return
+
+        now = time.monotonic()
+        if now < self._next_sample:
+            return
+        self._next_sample = now + self.interval
+
+        with MappedArray(request, "lores") as m:
+            self._queue.put((clip, m.array.copy()))
+
+    def finish(self, clip_file):
+        """Write the images of the current clip next to ``clip_file``."""
+        clip, self._clip = self._clip, None
+        if clip is not None:
+            self._queue.put((clip, clip_file))
+
+    def _run(self):
+        while True:
+            clip, item = self._queue.get()
+            try:
+                if isinstance(item, str):
+                    self._write(clip, item)
+                else:
+                    self._add_frame(clip, item)
+            except Exception as e:
+                logging.error(f"Failed to generate clip thumbnails: {e}")
+
+    def _add_frame(self, clip, frame):
+        width, _ = self.lores_size
+        bgr = cv2.cvtColor(frame, cv2.COLOR_YUV2BGR_I420)[:, :width]
+        if len(clip.tiles) <= clip.poster_index:
+            clip.poster = bgr
+        clip.tiles.append(cv2.resize(bgr, self.tile_size, interpolation=cv2.INTER_AREA))
+
+    def _write(self, clip, clip_file):
+        if not clip.tiles:
+            return
+        params = [cv2.IMWRITE_JPEG_QUALITY, self.quality]
+        cv2.imwrite(sidecar_path(clip_file, THUMBNAIL_SUFFIX), clip.poster, params)
+        cv2.imwrite(sidecar_path(clip_file, SPRITE_SUFFIX), pack_sprite(clip.tiles, self.columns), params)
+        logging.info(f"Wrote {len(clip.tiles)} thumbnails for {clip_file}")
+
+
+class _ClipSheet:
+    def __init__(self, poster_index):
+        self.poster_index = poster_index
+        self.poster = None
+        self.tiles = []
+
+
+def pack_sprite(tiles, columns):
+    """Lay equally sized tiles out left to right, top to bottom."""
+    tile_height, tile_width = tiles[0].shape[:2]
+    columns = min(columns, len(tiles))
+    rows = math.ceil(len(tiles) / columns)
+    sheet = np.zeros((rows * tile_height, columns * tile_width) + tiles[0].shape[2:], dtype=tiles[0].dtype)
+    for i, tile in enumerate(tiles):
+        row, column = divmod(i, columns)
+        sheet[row * tile_height:(row + 1) * tile_height, column * tile_width:(column + 1) * tile_width] = tile
+    return sheet
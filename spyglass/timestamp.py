@@ -31,6 +31,19 @@ class Timestamp:
         return temp, msg
 
     def apply_timestamp(self, request): 
+        profiler = self.dvr.profiler
+        if profiler is None:
+            self._apply_timestamp(request)
+            self.dvr.process_frame(request)
+            return
+
+        profiler.frame_started(request)
+        with profiler.stage("overlay"):
+            self._apply_timestamp(request)
+        with profiler.stage("dvr"):
+            self.dvr.process_frame(request)
+
+    def _apply_timestamp(self, request):
         # Define constants
         colour = (255, 255, 255)
         origin = (0, 30)
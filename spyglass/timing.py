@@ -0,0 +1,236 @@
+"""Per-clip timing sidecar: frame index to sensor timestamp and wall clock time.
+
+``clip_<time>.timing`` is written while the clip is recorded, one fixed size
+record per encoded frame, and gets a footer with the byte offset of every
+fragment once the clip is finished. All integers are little-endian:
+
+* header (16 bytes): magic ``SPTI``, version (u16), record size (u16), and
+  the wall clock minus the monotonic clock at the start of the clip (f64),
+* one record per frame (24 bytes): sensor timestamp in ns (i64), wall clock
+  time of the capture in epoch seconds (f64), encoded size in bytes (u32),
+  index of the fragment holding the frame (u16), flags (u16, bit 0 is set for
+  keyframes),
+* footer: the end of the init segment and the offset of every fragment's
+  ``moof`` box (u64 each), their count (u32) and the magic ``SPTF``.
+
+Clips are fragmented MP4 with a fragment per keyframe, so the init segment
+followed by the fragments from any offset on is a playable clip.
+"""
+import struct
+import threading
+import time
+from collections import deque
+
+from .mp4 import scan_boxes
+
+MAGIC = b"SPTI"
+FOOTER_MAGIC = b"SPTF"
+VERSION = 1
+HEADER = struct.Struct("<4sHHd")
+RECORD = struct.Struct("<qdIHH")
+TRAILER = struct.Struct("<I4s")
+OFFSET = struct.Struct("<Q")
+
+FLAG_KEYFRAME = 1
+
+
+class TimingWriter:
+    """Writes the timing sidecar of the clip being recorded.
+
+    The recording encoder and its output are patched in place, like the
+    profiler does. ``encode`` sees the request and its sensor timestamp, the
+    output sees the encoded frame. The encoder emits frames in order, so the
+    two are paired first in, first out.
+    """
+
+    def __init__(self):
+        self._sensor_timestamps = deque(maxlen=64)
+        self._file = None
+        self._clock_offset = 0
+        self._fragment = -1
+        self._lock = threading.Lock()
+        # Wall clock time of the first frame of the current clip and of the last frame
+        self.first_frame_time = None
+        self.last_frame_time = None
+
+    def instrument(self, encoder, output):
+        if not getattr(encoder, "_timing_writer", None):
+            # Encoders are reused across clips, only wrap them once.
+            encoder._timing_writer = self
+            encode = encoder.encode
+
+            def timed_encode(stream, request, *args, **kwargs):
+                self._sensor_timestamps.append(request.get_metadata().get("SensorTimestamp"))
+                return encode(stream, request, *args, **kwargs)
+
+            encoder.encode = timed_encode
+
+        outputframe = output.outputframe
+
+        def recorded_outputframe(frame, keyframe=True, timestamp=None, *args, **kwargs):
+            outputframe(frame, keyframe, timestamp, *args, **kwargs)
+            self.add_frame(len(frame), keyframe, timestamp)
+
+        output.outputframe = recorded_outputframe
+        return output
+
+    def start(self, path):
+        with self._lock:
+            self._sensor_timestamps.clear()
+            self._fragment = -1
+            self.first_frame_time = None
+            # libcamera's sensor timestamps are on the monotonic clock
+            self._clock_offset = time.time() - time.monotonic()
+            self._file = open(path, "wb")
+            self._file.write(HEADER.pack(MAGIC, VERSION, RECORD.size, self._clock_offset))
+
+    def add_frame(self, size, keyframe, timestamp=None):
+        sensor_ns = self._sensor_timestamps.popleft() if self._sensor_timestamps else None
+        if sensor_ns is None:
+            sensor_ns = timestamp * 1000 if timestamp is not None else time.monotonic_ns()
+        with self._lock:
+            if self._file is None:
+                return
+            if keyframe or self._fragment < 0:
+                self._fragment += 1
+            wall_time = sensor_ns / 1e9 + self._clock_offset
+            self._file.write(RECORD.pack(sensor_ns, wall_time, size, self._fragment, FLAG_KEYFRAME if keyframe else 0))
+            if self.first_frame_time is None:
+                self.first_frame_time = wall_time
+            self.last_frame_time = wall_time
+
+    def finish(self, clip_file):
+        """Close the records and append the fragment offsets of the finished ``clip_file``."""
+        with self._lock:
+            f, self._file = self._file, None
+        if f is None:
+            return
+        with f:
+            offsets = fragment_offsets(clip_file)
+            if offsets is None:
+                return
+            for offset in offsets:
+                f.write(OFFSET.pack(offset))
+            f.write(TRAILER.pack(len(offsets), FOOTER_MAGIC))
+
+
+def fragment_offsets(clip_file):
+    """End of the init segment followed by the offset of every ``moof``, or None if there are no fragments."""
+    offsets = []
+    try:
+        with open(clip_file, "rb") as f:
+            for offset, _, box_type in scan_boxes(f):
+                if box_type == "moof":
+                    offsets.append(offset)
+    except OSError:
+        return None
+    if not offsets:
+        return None
+    return [offsets[0]] + offsets
+
+
+class ClipTiming:
+    """Reads a timing sidecar."""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, version, record_size, self.clock_offset = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"not a timing sidecar: {path}")
+
+        end = len(data)
+        self.init_end = None
+        self.fragments = []
+        if end >= HEADER.size + TRAILER.size:
+            count, footer_magic = TRAILER.unpack_from(data, end - TRAILER.size)
+            if footer_magic == FOOTER_MAGIC:
+                end -= TRAILER.size + count * OFFSET.size
+                offsets = [OFFSET.unpack_from(data, end + i * OFFSET.size)[0] for i in range(count)]
+                self.init_end, self.fragments = offsets[0], offsets[1:]
+        # A clip cut short by a power loss has no footer, and maybe half a record
+        self._data = data
+        self._count = (end - HEADER.size) // RECORD.size
+
+    def __len__(self):
+        return self._count
+
+    def record(self, index):
+        """``(sensor timestamp ns, wall clock time, size, fragment, flags)`` of a frame."""
+        if not 0 <= index < self._count:
+            raise IndexError(index)
+        return RECORD.unpack_from(self._data, HEADER.size + index * RECORD.size)
+
+    def wall_time(self, index):
+        return self.record(index)[1]
+
+    def sensor_timestamp(self, index):
+        return self.record(index)[0]
+
+    @property
+    def start(self):
+        return self.wall_time(0) if self._count else None
+
+    @property
+    def end(self):
+        return self.wall_time(self._count - 1) if self._count else None
+
+    @property
+    def frame_duration(self):
+        if self._count < 2:
+            return None
+        return (self.end - self.start) / (self._count - 1)
+
+    def frame_at(self, wall_time):
+        """Index of the frame captured at or last before ``wall_time`` (epoch seconds)."""
+        if not self._count or wall_time < self.start:
+            return None
+        # Frames are evenly spaced unless some were dropped: start where the
+        # frame should be and step over the few that were
+        index = min(self._count - 1, int((wall_time - self.start) / (self.frame_duration or 1)))
+        while index > 0 and self.wall_time(index) > wall_time:
+            index -= 1
+        while index + 1 < self._count and self.wall_time(index + 1) <= wall_time:
+            index += 1
+        return index
+
+    def seek(self, wall_time):
+        """``(byte offset, frame index)`` of the fragment holding ``wall_time``, or None."""
+        index = self.frame_at(wall_time)
+        if index is None or not self.fragments:
+            return None
+        fragment = self.record(index)[3]
+        if fragment >= len(self.fragments):
+            return None
+        # Back to the keyframe that starts the fragment
+        while index > 0 and self.record(index - 1)[3] == fragment:
+            index -= 1
+        return self.fragments[fragment], index
+
+    def report(self):
+        times = [self.wall_time(i) for i in range(self._count)]
+        durations = [b - a for a, b in zip(times, times[1:])]
+        expected = self.frame_duration
+        return {
+            "frames": self._count,
+            "start": self.start,
+            "end": self.end,
+            "first_sensor_timestamp": self.sensor_timestamp(0) if self._count else None,
+            "frame_duration": expected,
+            # Gaps of more than one and a half frames
+            "dropped": sum(round(d / expected) - 1 for d in durations if d > 1.5 * expected) if expected else 0,
+            "fragments": len(self.fragments),
+        }
+
+
+def clip_stream(clip_file, start_offset, init_end, chunk_size=64 * 1024):
+    """Yield the init segment of a clip followed by its fragments from ``start_offset`` on."""
+    with open(clip_file, "rb") as f:
+        yield f.read(init_end)
+        f.seek(start_offset)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
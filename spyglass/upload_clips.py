@@ -2,57 +2,188 @@
 import os
 import sys
 import time
-import paramiko
-from queue import Queue
-from threading import Thread
+import itertools
+from queue import PriorityQueue
+from threading import Event, Lock, Thread, Timer
 import socket
 
+from spyglass.clips import (ACTIVITY_SUFFIX, CLIP_EXTENSION, PROXY_SUFFIX, SPRITE_SUFFIX, THUMBNAIL_SUFFIX,
+                            TIMING_SUFFIX, is_locked, read_activity, sidecar_path)
+from spyglass.mp4 import scan_boxes
+
+# Upload priorities, lower values are uploaded first
+PRIORITY_REQUESTED = 0
+PRIORITY_PROXY = 1
+PRIORITY_FULL = 2
+# Clips in which nothing moved, proxies included
+PRIORITY_STATIC = 3
+
+FULL_UPLOAD_POLICIES = ('always', 'wifi', 'on_request')
+
+# How often a clip that is being recorded is checked for new fragments
+LIVE_POLL_INTERVAL = 0.5
+LIVE_CHUNK_SIZE = 256 * 1024
+
+# Failed uploads of a clip before it is left on the card until it is requested
+MAX_UPLOAD_ATTEMPTS = 5
+
+
+def default_route_interface(route_file="/proc/net/route"):
+    """Name of the network interface holding the default route, if any."""
+    try:
+        with open(route_file) as f:
+            next(f)  # header
+            for line in f:
+                fields = line.split()
+                if len(fields) > 1 and fields[1] == "00000000":
+                    return fields[0]
+    except (OSError, StopIteration):
+        pass
+    return None
+
+
+def is_on_wifi(route_file="/proc/net/route", sys_net="/sys/class/net"):
+    """True if the default route goes through a wireless interface."""
+    interface = default_route_interface(route_file)
+    return interface is not None and os.path.isdir(os.path.join(sys_net, interface, "wireless"))
+
+
+class LiveUpload(Thread):
+    """Uploads a fragmented MP4 clip while it is recorded.
+
+    Only complete boxes are sent, and a fragment only once its ``mdat`` is
+    complete, so the remote file is playable up to the last fragment at any
+    time. The local file is kept open, it can be renamed or moved meanwhile.
+    """
+
+    def __init__(self, uploader, file_path, final_path, poll_interval=LIVE_POLL_INTERVAL):
+        super().__init__(daemon=True)
+        self.uploader = uploader
+        self.file_path = file_path
+        self.final_path = final_path
+        self.poll_interval = poll_interval
+        self.uploaded_bytes = 0
+        self.complete = False
+        self._finished = Event()
+
+    def finish(self):
+        """The recording stopped, upload the rest of the file."""
+        self._finished.set()
+
+    def _open(self):
+        # ffmpeg creates the file once it started
+        while True:
+            finished = self._finished.is_set()
+            try:
+                return open(self.file_path, 'rb')
+            except FileNotFoundError:
+                if finished:
+                    return None
+            self._finished.wait(self.poll_interval)
+
+    def _complete_end(self, f):
+        end = self.uploaded_bytes
+        for offset, size, box_type in scan_boxes(f, self.uploaded_bytes):
+            if box_type != 'moof':
+                end = offset + size
+        return end
+
+    def run(self):
+        f = self._open()
+        if f is None:
+            return
+        sftp = self.uploader.create_sftp_connection()
+        if sftp is None:
+            f.close()
+            return
+
+        remote_dir = self.uploader.remote_dir_for(self.final_path)
+        remote_path = os.path.join(remote_dir, os.path.basename(self.final_path))
+        try:
+            if remote_dir not in self.uploader.remote_dirs:
+                self.uploader.create_remote_directory(sftp, remote_dir)
+                self.uploader.remote_dirs.add(remote_dir)
+
+            with sftp.open(remote_path, 'wb') as remote:
+                while True:
+                    # Checked before reading, the fragments written before the end are included
+                    finished = self._finished.is_set()
+                    end = self._complete_end(f)
+                    f.seek(self.uploaded_bytes)
+                    while self.uploaded_bytes < end:
+                        data = f.read(min(LIVE_CHUNK_SIZE, end - self.uploaded_bytes))
+                        remote.write(data)
+                        self.uploaded_bytes += len(data)
+                    remote.flush()
+                    if finished:
+                        break
+                    self._finished.wait(self.poll_interval)
+
+            # A clip cut short leaves an incomplete box, upload it in full later
+            self.complete = self.uploaded_bytes == os.fstat(f.fileno()).st_size
+            print(f"Uploaded while recording: {self.final_path} ({self.uploaded_bytes} bytes)")
+        except Exception as e:
+            print(f"Failed to upload {self.final_path} while recording: {e}")
+        finally:
+            sftp.close()
+            f.close()
+
 
 class UploadClips:
-    def __init__(self, clip_folder, sftp_user, sftp_password, sftp_server, sftp_dir, retry_delay=10):
-        # Queue to hold the file paths of the clips
-        self.clip_queue = Queue()
+    def __init__(self, clip_folder, sftp_user, sftp_password, sftp_server, sftp_dir, retry_delay=10, full_upload_policy='always', connect_timeout=10, static_upload_policy='always'):
+        # Queue to hold (priority, order, file path) of the clips
+        self.clip_queue = PriorityQueue()
+        self._order = itertools.count()
         self.gps_queue = []
 
+        # Full resolution clips waiting for Wi-Fi or an explicit request
+        self.full_upload_policy = full_upload_policy
+        # The same for static clips and their proxies
+        self.static_upload_policy = static_upload_policy
+        self.deferred = []
+        self.requested = set()
+        self._deferred_lock = Lock()
+        # Priority of the entry each clip waits in the queue with, an entry with another one is stale
+        self._queued = {}
+        # Clips of incidents are kept on the card after their upload, they are not uploaded again
+        self.uploaded = set()
+        # Failed uploads per clip, each retry waits twice as long as the one before
+        self.failures = {}
+        self._on_wifi = False
+        # Set while the governor holds back background work
+        self._paused = Event()
 
         self.sftp_user = sftp_user
         self.sftp_password = sftp_password
         self.sftp_server = sftp_server
+        self.sftp_dir = sftp_dir
         self.retry_delay = retry_delay
+        self.connect_timeout = connect_timeout
 
-        # Get the clip directory from command-line arguments
+        # Clips folder, every day folder in it is uploaded to a folder of the same name
         self.clip_folder = clip_folder
+        self.remote_dirs = set()
+
+        # Clips uploaded while they are recorded, by their final path
+        self.live_uploads = {}
 
         if not os.path.isdir(clip_folder):
             print(f"Error: {clip_folder} is not a valid directory")
             sys.exit(1)
 
-        # Create the corresponding directory on the SFTP server
-        remote_today_dir = os.path.join(sftp_dir, os.path.basename(clip_folder))
-        print(remote_today_dir)
-
-        sftp = self.create_sftp_connection()
-        if sftp is not None:
-            # Manually set a directory and then print it
-            directory_contents = sftp.listdir('.')
-            print(f"Contents of the current directory: {directory_contents}")
-
-            current_dir = sftp.getcwd()
-            print(f"Current directory on SFTP server: {current_dir}")
-
-            self.create_remote_directory(sftp, remote_today_dir)
-            sftp.close()
-
-        # Start the queue processing thread
-        queue_thread = Thread(target=self.process_queue, args=(remote_today_dir,))
+        # Start the queue processing thread. Nothing here touches the network,
+        # connecting to the server happens on that thread.
+        queue_thread = Thread(target=self.process_queue)
         queue_thread.daemon = True
         queue_thread.start()
 
+    def remote_dir_for(self, file_path):
+        return os.path.join(self.sftp_dir, os.path.basename(os.path.dirname(file_path)))
+
     def check_internet(self, host="8.8.8.8", port=53, timeout=3):
         """Check if internet connection is available."""
         try:
-            socket.setdefaulttimeout(timeout)
-            socket.socket(socket.AF_INET, socket.SOCK_STREAM).connect((host, port))
+            socket.create_connection((host, port), timeout=timeout).close()
             return True
         except socket.error as ex:
             print(f"No internet connection: {ex}")
@@ -60,8 +191,16 @@ class UploadClips:
 
     def create_sftp_connection(self):
         """Create and return an SFTP connection."""
+        import paramiko
+
         try:
-            transport = paramiko.Transport((self.sftp_server, 22))
+            # Without timeouts a server that accepts the connection but never
+            # answers blocks the upload thread forever
+            sock = socket.create_connection((self.sftp_server, 22), timeout=self.connect_timeout)
+            transport = paramiko.Transport(sock)
+            transport.banner_timeout = self.connect_timeout
+            transport.handshake_timeout = self.connect_timeout
+            transport.auth_timeout = self.connect_timeout
             transport.connect(username=self.sftp_user, password=self.sftp_password)
             sftp = paramiko.SFTPClient.from_transport(transport)
             return sftp
@@ -85,10 +224,33 @@ class UploadClips:
 
         print(f"Directory {remote_path} is ready on SFTP server.")
 
+    def start_live_upload(self, file_path, final_path):
+        """Upload a fragmented MP4 clip while it is recorded to ``file_path``.
+
+        Call ``finish()`` on the returned upload once the recording stopped.
+        Returns None when the upload policy holds back full resolution clips.
+        """
+        if self._should_defer(PRIORITY_FULL, final_path) or self._paused.is_set():
+            return None
+        live_upload = LiveUpload(self, file_path, final_path)
+        self.live_uploads[final_path] = live_upload
+        live_upload.start()
+        return live_upload
+
     def upload_clip(self, file_path, remote_dir):
         """Upload a single clip to the SFTP server."""
+        live_upload = self.live_uploads.pop(file_path, None)
+        if live_upload is not None:
+            live_upload.join()
+            if live_upload.complete:
+                self._remove_uploaded(file_path)
+                return
+
         sftp = self.create_sftp_connection()
         if sftp is None:
+            print(f"Retrying {file_path} in {self.retry_delay} seconds...")
+            time.sleep(self.retry_delay)
+            self.add_file_to_queue(file_path)
             return
 
         try:
@@ -97,9 +259,10 @@ class UploadClips:
                 print(f"File does not exist: {file_path}")
                 return
 
-            # Ensure the remote directory for today exists
-            #create_remote_directory(sftp, remote_dir)
-            #sftp.chdir(remote_dir)
+            # Ensure the remote directory for the clip's day exists
+            if remote_dir not in self.remote_dirs:
+                self.create_remote_directory(sftp, remote_dir)
+                self.remote_dirs.add(remote_dir)
 
             # Upload the file to the correct remote directory
             remote_path = os.path.join(remote_dir, os.path.basename(file_path))
@@ -111,15 +274,129 @@ class UploadClips:
             sftp.put(file_path, remote_path)
             print(f"Uploaded: {file_path} to {remote_path}")
             
-            os.remove(file_path)  # Remove the file after successful upload
+            self._remove_uploaded(file_path)
         except Exception as e:
             print(f"Failed to upload {file_path}: {e}")
-            self.clip_queue.put(file_path)
+            self._retry_later(file_path)
         finally:
             sftp.close()
 
-    def add_file_to_queue(self, file_path):
-        self.clip_queue.put(file_path)
+    def _retry_later(self, file_path):
+        # Without a delay a clip that can never be uploaded (permissions, a full remote disk) keeps the uploader busy
+        failures = self.failures.get(file_path, 0) + 1
+        self.failures[file_path] = failures
+        if failures >= MAX_UPLOAD_ATTEMPTS:
+            print(f"Giving up on {file_path} after {failures} failed uploads, POST /videos/<clip_id>/upload retries it")
+            return
+        delay = self.retry_delay * 2 ** (failures - 1)
+        print(f"Retrying {file_path} in {delay} seconds...")
+        timer = Timer(delay, self.add_file_to_queue, args=(file_path,))
+        timer.daemon = True
+        timer.start()
+
+    def priority_for(self, file_path):
+        if file_path in self.requested:
+            return PRIORITY_REQUESTED
+        activity = read_activity(file_path)
+        if activity and activity.get("static"):
+            return PRIORITY_STATIC
+        if file_path.endswith(PROXY_SUFFIX):
+            return PRIORITY_PROXY
+        return PRIORITY_FULL
+
+    def _remove_uploaded(self, file_path):
+        # Footage of incidents stays on the card
+        if is_locked(file_path):
+            self.uploaded.add(file_path)
+        else:
+            os.remove(file_path)
+            self._remove_sidecars(file_path)
+        self.requested.discard(file_path)
+        self.failures.pop(file_path, None)
+
+    @staticmethod
+    def _remove_sidecars(file_path):
+        # Its frame timing is of no use without it
+        sidecars = [sidecar_path(file_path, TIMING_SUFFIX)]
+        # Activity and thumbnails are shared with the proxy, they go with the last of the two
+        clip_file = file_path[:-len(PROXY_SUFFIX)] + CLIP_EXTENSION if file_path.endswith(PROXY_SUFFIX) else file_path
+        if not os.path.exists(clip_file) and not os.path.exists(sidecar_path(clip_file, PROXY_SUFFIX)):
+            sidecars += [sidecar_path(clip_file, suffix) for suffix in (ACTIVITY_SUFFIX, THUMBNAIL_SUFFIX, SPRITE_SUFFIX)]
+        for sidecar in sidecars:
+            if os.path.exists(sidecar):
+                os.remove(sidecar)
+
+    def add_file_to_queue(self, file_path, priority=None):
+        if priority is None:
+            priority = self.priority_for(file_path)
+        with self._deferred_lock:
+            if file_path in self.uploaded:
+                return
+            queued = self._queued.get(file_path)
+            if queued is not None and queued <= priority:
+                return
+            # Moves a waiting clip up, the entry it had is skipped
+            self._queued[file_path] = priority
+        self.clip_queue.put((priority, next(self._order), file_path))
+
+    def _next_file(self):
+        """The next clip to upload and its priority, or None if its entry is stale."""
+        priority, _, file_path = self.clip_queue.get()
+        with self._deferred_lock:
+            if self._queued.get(file_path) != priority or file_path in self.uploaded:
+                return None
+            del self._queued[file_path]
+        return priority, file_path
+
+    def request_upload(self, file_path):
+        """Upload a full resolution clip next, whatever the upload policy says."""
+        with self._deferred_lock:
+            self.requested.add(file_path)
+            if file_path in self.deferred:
+                self.deferred.remove(file_path)
+        self.add_file_to_queue(file_path, PRIORITY_REQUESTED)
+
+    def pause(self):
+        """Stop starting uploads, the one in progress is finished."""
+        self._paused.set()
+
+    def resume(self):
+        self._paused.clear()
+
+    def _should_defer(self, priority, file_path):
+        policies = []
+        if priority == PRIORITY_FULL or (priority == PRIORITY_STATIC and not file_path.endswith(PROXY_SUFFIX)):
+            policies.append(self.full_upload_policy)
+        if priority == PRIORITY_STATIC:
+            policies.append(self.static_upload_policy)
+        return any(self._policy_defers(policy) for policy in policies)
+
+    def _policy_defers(self, policy):
+        if policy == 'always':
+            return False
+        if policy == 'wifi':
+            return not is_on_wifi()
+        return True
+
+    def _release_deferred(self):
+        if 'wifi' not in (self.full_upload_policy, self.static_upload_policy) or not self.deferred:
+            return
+        # Only when Wi-Fi comes back, clips held back by on_request would be looked at over and over
+        was_on_wifi, self._on_wifi = self._on_wifi, is_on_wifi()
+        if was_on_wifi or not self._on_wifi:
+            return
+        with self._deferred_lock:
+            deferred, self.deferred = self.deferred, []
+            released = []
+            for file_path in deferred:
+                priority = self.priority_for(file_path)
+                if self._should_defer(priority, file_path):
+                    self.deferred.append(file_path)
+                else:
+                    released.append((priority, file_path))
+        print(f"On Wi-Fi, queueing {len(released)} deferred clips")
+        for priority, file_path in released:
+            self.add_file_to_queue(file_path, priority)
 
     def add_gps_to_queue(self, timestamp, gps_data):
         self.gps_queue.append((timestamp, gps_data))
@@ -131,7 +408,7 @@ class UploadClips:
 
         pass
 
-    def join_gps_to_video(file_path, gps_data):
+    def join_gps_to_video(self, file_path, gps_data):
         pass
 
         # TODO: use ExifTool to add GPS data to the clip
@@ -150,23 +427,33 @@ class UploadClips:
         #         logging.error(f"Failed to add GPS data to clip: {e}")
 
 
-    def process_queue(self, remote_dir):
+    def process_queue(self):
         """Process the upload queue."""
         while True:
+            if self._paused.is_set():
+                time.sleep(1)
+                continue
+            self._release_deferred()
             if not self.clip_queue.empty():
-                file_path = self.clip_queue.get()
+                entry = self._next_file()
+                if entry is None:
+                    continue
+                priority, file_path = entry
+                if self._should_defer(priority, file_path):
+                    with self._deferred_lock:
+                        self.deferred.append(file_path)
+                    continue
+
                 if self.check_internet():
+                    # GPS data is not looked up yet, clips are uploaded without it
                     gps_data = self.look_for_closest_gps_data(file_path)
-                    if gps_data is None: # TODO: we need to check if file is in queue for long time and forgotten. EX: if after 5 readd to queues we dont upload it because we are missing gps data, do it anyway.
-                        self.clip_queue.put(file_path)
-                        continue
-
-                    self.join_gps_to_video(file_path, gps_data)
-                    self.upload_clip(file_path, remote_dir)
+                    if gps_data is not None:
+                        self.join_gps_to_video(file_path, gps_data)
+                    self.upload_clip(file_path, self.remote_dir_for(file_path))
                 else:
                     print(f"Retrying in {self.retry_delay} seconds...")
                     time.sleep(self.retry_delay)
-                    self.clip_queue.put(file_path)
+                    self.add_file_to_queue(file_path, priority)
             else:
                 time.sleep(5)  # Wait for 5 seconds before checking the queue again
 
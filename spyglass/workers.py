@@ -0,0 +1,270 @@
+"""Uploads, GPS and status reports in worker processes.
+
+With ``--worker_processes`` these services leave the camera process, so
+paramiko's crypto and NMEA parsing no longer compete with frame delivery for
+the GIL. A :class:`Supervisor` in the camera process starts the workers,
+restarts them when they die, and shares state with them:
+
+* the latest GPS fix and a few status flags live in shared memory
+  (``multiprocessing.Array`` / ``Value``),
+* finished clips and upload requests go to the upload worker through a
+  ``multiprocessing.Queue``.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from .dvr import DVR
+
+UPLOAD_WORKER_NICENESS = 10
+
+
+class SharedState:
+    """State the camera process and the workers share through shared memory."""
+
+    def __init__(self, context):
+        self.running = context.Value('b', True)
+        self.gps_available = context.Value('b', False)
+        self.gps_alive = context.Value('b', False)
+        # latitude, longitude, time of the fix (0 until there is one)
+        self.gps_fix = context.Array('d', 3)
+        # km/h, negative until there is one
+        self.gps_speed = context.Value('d', -1.0)
+        # Recording paused with POST /recording/pause
+        self.paused = context.Value('b', False)
+
+    def set_fix(self, latitude, longitude):
+        with self.gps_fix.get_lock():
+            self.gps_fix[0] = latitude
+            self.gps_fix[1] = longitude
+            self.gps_fix[2] = time.time()
+
+    def get_fix(self):
+        with self.gps_fix.get_lock():
+            latitude, longitude, fix_time = self.gps_fix[:]
+        if not fix_time:
+            return None
+        return latitude, longitude
+
+
+class _SharedFlag:
+    def __init__(self, value):
+        self.value = value
+
+    def is_alive(self):
+        return bool(self.value.value)
+
+
+class WorkerDVR(DVR):
+    """The GPS and status parts of :class:`DVR`, without a camera.
+
+    ``gather_gps`` and ``gather_status`` run unchanged in a worker process,
+    the attributes they use are backed by :class:`SharedState`.
+    ``DVR.__init__`` is not run, an attribute they start to use must be
+    added here as well.
+    """
+
+    def __init__(self, shared, clips_folder, gps_serial_port=None, disk_alert_threshold=0.10, cpu_temp_alert_threshold=65.0):
+        self.shared = shared
+        self.clips_folder = clips_folder
+        self.gps_serial_port = gps_serial_port
+        self.disk_alert_threshold = disk_alert_threshold
+        self.cpu_temp_alert_threshold = cpu_temp_alert_threshold
+        self.write_behind = None
+        self.thread = _SharedFlag(shared.gps_alive)
+
+    @property
+    def is_recording(self):
+        return bool(self.shared.running.value)
+
+    @property
+    def paused(self):
+        return bool(self.shared.paused.value)
+
+    @property
+    def gps_available(self):
+        return bool(self.shared.gps_available.value)
+
+    @gps_available.setter
+    def gps_available(self, available):
+        self.shared.gps_available.value = available
+
+    @property
+    def last_gps_data(self):
+        fix = self.shared.get_fix()
+        return f"{fix[0]} {fix[1]}" if fix else None
+
+    @last_gps_data.setter
+    def last_gps_data(self, gps_data_str):
+        latitude, longitude = (float(v) for v in gps_data_str.split())
+        self.shared.set_fix(latitude, longitude)
+
+    @property
+    def last_gps_speed(self):
+        speed = self.shared.gps_speed.value
+        return speed if speed >= 0 else None
+
+    @last_gps_speed.setter
+    def last_gps_speed(self, speed):
+        self.shared.gps_speed.value = speed
+
+
+def gps_worker(shared, clips_folder, gps_serial_port):
+    WorkerDVR(shared, clips_folder, gps_serial_port).gather_gps()
+
+
+def status_worker(shared, clips_folder, disk_alert_threshold, cpu_temp_alert_threshold):
+    import asyncio
+    dvr = WorkerDVR(shared, clips_folder, disk_alert_threshold=disk_alert_threshold, cpu_temp_alert_threshold=cpu_temp_alert_threshold)
+    asyncio.run(dvr.gather_status(disk_alert_threshold, cpu_temp_alert_threshold))
+
+
+def upload_worker(events, clips_folder, sftp_info, full_upload_policy, static_upload_policy='always'):
+    from .upload_clips import UploadClips
+
+    # Uploads can wait, frames cannot
+    os.nice(UPLOAD_WORKER_NICENESS)
+    sftp_user, sftp_password, sftp_server, sftp_dir = sftp_info
+    uploader = UploadClips(clips_folder, sftp_user, sftp_password, sftp_server, sftp_dir, retry_delay=10, full_upload_policy=full_upload_policy, static_upload_policy=static_upload_policy)
+    while True:
+        event, file_path = events.get()
+        if event == 'add':
+            uploader.add_file_to_queue(file_path)
+        elif event == 'request':
+            uploader.request_upload(file_path)
+        elif event == 'live':
+            uploader.start_live_upload(*file_path)
+        elif event == 'live_finished':
+            live_upload = uploader.live_uploads.get(file_path)
+            if live_upload:
+                live_upload.finish()
+        elif event == 'pause':
+            uploader.pause()
+        elif event == 'resume':
+            uploader.resume()
+        elif event == 'stop':
+            return
+
+
+class UploadQueueClient:
+    """Stands in for :class:`UploadClips` in the camera process."""
+
+    def __init__(self, events):
+        self.events = events
+
+    def add_file_to_queue(self, file_path, priority=None):
+        self.events.put(('add', file_path))
+
+    def request_upload(self, file_path):
+        self.events.put(('request', file_path))
+
+    def pause(self):
+        self.events.put(('pause', None))
+
+    def resume(self):
+        self.events.put(('resume', None))
+
+    def start_live_upload(self, file_path, final_path):
+        self.events.put(('live', (file_path, final_path)))
+        return _LiveUploadHandle(self.events, final_path)
+
+
+class _LiveUploadHandle:
+    def __init__(self, events, final_path):
+        self.events = events
+        self.final_path = final_path
+
+    def finish(self):
+        self.events.put(('live_finished', self.final_path))
+
+
+class Supervisor:
+    """Starts the worker processes, restarts them when they die and mirrors their state into the DVR."""
+
+    def __init__(self, dvr, poll_interval=1.0):
+        self.dvr = dvr
+        self.poll_interval = poll_interval
+        # Do not fork a process that has the camera and its threads open
+        self.context = multiprocessing.get_context('spawn')
+        self.shared = SharedState(self.context)
+        self.upload_events = self.context.Queue()
+        self.uploads = UploadQueueClient(self.upload_events)
+        # /status reports whether the GPS worker is alive
+        dvr.thread = _SharedFlag(self.shared.gps_alive)
+
+        self.workers = {
+            'uploads': (upload_worker, (self.upload_events, dvr.clips_folder,
+                                        (dvr.sftp_user, dvr.sftp_password, dvr.sftp_server, dvr.sftp_dir),
+                                        dvr.full_upload_policy, dvr.static_upload_policy)),
+            'status': (status_worker, (self.shared, dvr.clips_folder, dvr.disk_alert_threshold,
+                                       dvr.cpu_temp_alert_threshold)),
+        }
+        if dvr.gps_serial_port:
+            self.workers['gps'] = (gps_worker, (self.shared, dvr.clips_folder, dvr.gps_serial_port))
+
+        self.processes = {}
+        self.restarts = {name: 0 for name in self.workers}
+        self._restart_at = {}
+        self._stopped = threading.Event()
+
+    def start(self):
+        for name in self.workers:
+            self._start_worker(name)
+        threading.Thread(target=self._supervise, name="supervisor", daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+        self.shared.running.value = False
+        self.upload_events.put(('stop', None))
+        for process in self.processes.values():
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+
+    def _start_worker(self, name):
+        target, args = self.workers[name]
+        process = self.context.Process(target=target, args=args, name=f"spyglass-{name}", daemon=True)
+        process.start()
+        self.processes[name] = process
+        logging.info(f"Started {name} worker, pid {process.pid}")
+        # A restarted upload worker does not know the governor paused uploads
+        governor = self.dvr.governor
+        if name == 'uploads' and governor and governor.active('background'):
+            self.uploads.pause()
+
+    def _supervise(self):
+        while not self._stopped.wait(self.poll_interval):
+            now = time.monotonic()
+            for name, process in self.processes.items():
+                if process.is_alive() or self._stopped.is_set():
+                    continue
+                if name not in self._restart_at:
+                    self.restarts[name] += 1
+                    delay = min(60, 2 ** self.restarts[name])
+                    logging.error(f"{name} worker exited with code {process.exitcode}, restarting in {delay} s")
+                    self._restart_at[name] = now + delay
+                elif now >= self._restart_at[name]:
+                    del self._restart_at[name]
+                    self._start_worker(name)
+
+            gps = self.processes.get('gps')
+            self.shared.gps_alive.value = bool(gps and gps.is_alive())
+            self._mirror_state()
+
+    def _mirror_state(self):
+        # The overlay and /status read these from the DVR
+        fix = self.shared.get_fix()
+        if fix:
+            self.dvr.last_gps_data = f"{fix[0]} {fix[1]}"
+        speed = self.shared.gps_speed.value
+        if speed >= 0:
+            self.dvr.last_gps_speed = speed
+        self.dvr.gps_available = bool(self.shared.gps_available.value)
+        self.shared.running.value = self.dvr.is_recording
+        self.shared.paused.value = self.dvr.paused
+
+    def report(self):
+        return {name: {'pid': process.pid, 'alive': process.is_alive(), 'restarts': self.restarts[name]}
+                for name, process in self.processes.items()}
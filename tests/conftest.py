@@ -0,0 +1,23 @@
+import importlib
+import sys
+
+import pytest
+
+from spyglass import simulator
+
+
+@pytest.fixture
+def simulated(monkeypatch):
+    """``picamera2`` and ``libcamera`` are the simulator for the duration of the test.
+
+    Returns a function that imports a spyglass module afresh, so that it is
+    bound to the simulator and not to whatever an earlier test imported.
+    """
+    for name, module in simulator.modules().items():
+        monkeypatch.setitem(sys.modules, name, module)
+
+    def load(module_name):
+        monkeypatch.delitem(sys.modules, module_name, raising=False)
+        return importlib.import_module(module_name)
+
+    return load
@@ -0,0 +1,152 @@
+import os
+import sys
+import time
+
+
+# Stands in for ffmpeg: writes the first half of the input
+HALVE = "import sys, time; time.sleep(float(sys.argv[3])); data = open(sys.argv[1], 'rb').read(); open(sys.argv[2], 'wb').write(data[:len(data) // 2])"
+
+
+def fake_command(delay=0):
+    return lambda mode, source, destination: [sys.executable, '-c', HALVE, source, destination, str(delay)]
+
+
+def make_archiver(tmp_path, **kwargs):
+    from spyglass.archive import ClipArchiver
+
+    kwargs.setdefault('max_load', 1000)
+    return ClipArchiver(str(tmp_path), 24, parked_minutes=0, poll_interval=0.05, **kwargs)
+
+
+def test_find_candidates(tmp_path):
+    from spyglass.archive import ARCHIVED_LIST, find_candidates
+
+    old = tmp_path / '2024-06-04'
+    old.mkdir()
+    (old / 'clip_2024-06-04_12-00-10.mp4').touch()
+    (old / 'clip_2024-06-04_12-00-00.mp4').touch()
+    (old / 'clip_2024-06-04_11-59-50.mp4').touch()
+    (old / 'clip_2024-06-04_12-00-00.proxy.mp4').touch()
+    (old / 'clip_2024-06-04_12-00-20.archive.tmp').touch()
+    (old / ARCHIVED_LIST).write_text('clip_2024-06-04_11-59-50\n')
+    new = tmp_path / '2024-06-05'
+    new.mkdir()
+    (new / 'clip_2024-06-05_12-00-00.mp4').touch()
+
+    before = time.mktime((2024, 6, 5, 0, 0, 0, 0, 0, -1))
+    assert find_candidates(str(tmp_path), before) == [str(old / 'clip_2024-06-04_12-00-00.mp4'),
+                                                      str(old / 'clip_2024-06-04_12-00-10.mp4')]
+    assert not (old / 'clip_2024-06-04_12-00-20.archive.tmp').exists()
+
+
+def test_archive_replaces_the_clip(tmp_path, monkeypatch):
+    from spyglass import archive
+    from spyglass.archive import ARCHIVED_LIST
+
+    monkeypatch.setattr(archive, 'archive_command', fake_command())
+    day = tmp_path / '2024-06-04'
+    day.mkdir()
+    clip = day / 'clip_2024-06-04_12-00-00.mp4'
+    clip.write_bytes(bytes(1000))
+
+    archiver = make_archiver(tmp_path)
+    assert archiver.archive(str(clip))
+    assert clip.read_bytes() == bytes(500)
+    assert sorted(os.listdir(day)) == [ARCHIVED_LIST, clip.name]
+    assert (day / ARCHIVED_LIST).read_text() == 'clip_2024-06-04_12-00-00\n'
+    assert archiver.report()['bytes_saved'] == 500
+
+
+def test_static_clips_are_evicted(tmp_path):
+    import json
+    from spyglass.clips import activity_path
+
+    day = tmp_path / '2024-06-04'
+    day.mkdir()
+    clip = day / 'clip_2024-06-04_12-00-00.mp4'
+    clip.write_bytes(bytes(1000))
+    (day / 'clip_2024-06-04_12-00-00.proxy.mp4').write_bytes(bytes(100))
+    with open(activity_path(str(clip)), 'w') as f:
+        json.dump({'activity': 0.01, 'static': True}, f)
+
+    archiver = make_archiver(tmp_path, evict_static=True)
+    assert archiver.archive(str(clip))
+    assert os.listdir(day) == ['clip_2024-06-04_12-00-00.activity.json']
+    assert archiver.report()['evicted'] == 1
+    assert archiver.report()['bytes_saved'] == 1100
+
+
+def test_parked_after_no_movement(tmp_path):
+    speeds = [50.0]
+    archiver = make_archiver(tmp_path, speed=lambda: speeds[0])
+    archiver.parked_minutes = 1
+    assert not archiver.parked()
+
+    speeds[0] = 0.5
+    assert not archiver.parked()
+    archiver.moved_at -= 61
+    assert archiver.parked()
+
+
+def test_busy_while_hot_or_dropping_frames(tmp_path, monkeypatch):
+    from spyglass import archive
+
+    drops = [0]
+    archiver = make_archiver(tmp_path, dropped_frames=lambda: drops[0])
+    monkeypatch.setattr(archive, 'cpu_temperature', lambda: 50.0)
+    assert archiver.busy_reason() is None
+    drops[0] = 3
+    assert archiver.busy_reason() == '3 frames dropped'
+    assert archiver.busy_reason() is None
+
+    monkeypatch.setattr(archive, 'cpu_temperature', lambda: 75.0)
+    assert archiver.busy_reason() == 'CPU at 75.0°C'
+
+
+def test_ffmpeg_is_paused_while_busy(tmp_path, monkeypatch):
+    from spyglass import archive
+
+    monkeypatch.setattr(archive, 'archive_command', fake_command(delay=0.3))
+    monkeypatch.setattr(archive, 'cpu_temperature', lambda: None)
+    day = tmp_path / '2024-06-04'
+    day.mkdir()
+    clip = day / 'clip_2024-06-04_12-00-00.mp4'
+    clip.write_bytes(bytes(1000))
+
+    busy = iter([False, True, True, True])
+    archiver = make_archiver(tmp_path)
+    archiver.busy_reason = lambda: 'test' if next(busy, False) else None
+
+    assert archiver.archive(str(clip))
+    assert archiver.report()['pauses'] == 1
+    assert clip.read_bytes() == bytes(500)
+
+
+def test_stop_ends_ffmpeg_held_stopped(tmp_path, monkeypatch):
+    import threading
+    from spyglass import archive
+
+    monkeypatch.setattr(archive, 'archive_command', fake_command(delay=30))
+    monkeypatch.setattr(archive, 'cpu_temperature', lambda: None)
+    day = tmp_path / '2024-06-04'
+    day.mkdir()
+    clip = day / 'clip_2024-06-04_12-00-00.mp4'
+    clip.write_bytes(bytes(1000))
+
+    archiver = make_archiver(tmp_path)
+    archiver.busy_reason = lambda: 'test'
+    results = []
+    thread = threading.Thread(target=lambda: results.append(archiver.archive(str(clip))))
+    thread.start()
+    deadline = time.monotonic() + 5
+    while archiver.report()['pauses'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    process = archiver._process
+    assert archiver.report()['pauses'] == 1
+
+    archiver.stop()
+    assert process.poll() is not None
+    thread.join(5)
+    assert results == [False]
+    assert archiver.report()['failed'] == 0
+    assert sorted(os.listdir(day)) == [clip.name]
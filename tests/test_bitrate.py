@@ -0,0 +1,55 @@
+import pytest
+
+
+def test_base_bitrate_scales_with_fps_and_resolution():
+    from spyglass.bitrate import base_bitrate, MEBIBIT
+    assert base_bitrate((1920, 1080), 30, 20) == 20 * MEBIBIT
+    assert base_bitrate((1920, 1080), 15, 20) == 10 * MEBIBIT
+    assert base_bitrate((960, 540), 30, 20) == 5 * MEBIBIT
+
+
+def test_complexity_moves_bitrate_within_limits():
+    from spyglass.bitrate import BitrateController
+    controller = BitrateController(10_000_000)
+    for _ in range(20):
+        night = controller.next_bitrate(10_000_000 / 8 * 60, 60, complexity=0.0)
+    assert night == pytest.approx(5_000_000, rel=0.01)
+    for _ in range(20):
+        highway = controller.next_bitrate(10_000_000 / 8 * 60, 60, complexity=1.0)
+    assert highway == pytest.approx(controller.max_bitrate, rel=0.001)
+
+
+def test_retention_budget_caps_bitrate():
+    from spyglass.bitrate import BitrateController
+    controller = BitrateController(10_000_000, min_bitrate=1_000_000, retention_hours=10)
+    # 9 GB for 10 hours allows 2 Mbit/s
+    free_bytes = 9_000_000_000
+    for _ in range(20):
+        bitrate = controller.next_bitrate(controller.bitrate / 8 * 60, 60, free_bytes)
+    assert bitrate == pytest.approx(2_000_000, rel=0.01)
+
+
+def test_undershooting_encoder_gets_a_higher_cap():
+    from spyglass.bitrate import BitrateController
+    controller = BitrateController(10_000_000, retention_hours=10)
+    for _ in range(20):
+        # The encoder only writes half of the requested bitrate
+        bitrate = controller.next_bitrate(controller.bitrate / 16 * 60, 60, 9_000_000_000)
+    assert bitrate == pytest.approx(4_000_000, rel=0.01)
+
+
+def test_simulation_replays_trace(tmp_path):
+    from spyglass.bitrate import BitrateController, read_trace, simulate
+    trace_path = tmp_path / 'bitrate_trace.csv'
+    rows = ['time,seconds,bytes,bitrate,complexity']
+    rows += [f'{i},60,{8_000_000 * 60 // 8},8000000,{0.1 if i % 2 else 0.9}' for i in range(100)]
+    trace_path.write_text('\n'.join(rows) + '\n')
+
+    trace = read_trace(str(trace_path))
+    result = simulate(trace, BitrateController(8_000_000), free_bytes=10 ** 12)
+    assert result['clips'] == 100
+    assert result['recorded_hours'] == pytest.approx(100 / 60)
+    assert result['min_bitrate'] < 8_000_000 < result['max_bitrate']
+
+    full = simulate(trace, BitrateController(8_000_000), free_bytes=60_000_000 * 10)
+    assert full['clips'] < 100
@@ -0,0 +1,61 @@
+import pytest
+
+
+@pytest.fixture
+def camera(simulated):
+    return simulated('spyglass.camera')
+
+
+def init(camera, **kwargs):
+    return camera.init_camera(1920, 1080, 640, 480, 30, 0, 0.0, 0, **kwargs)
+
+
+def test_buffer_count_follows_the_frame_rate(camera):
+    assert camera.buffer_count_for(5) == 3
+    assert camera.buffer_count_for(15) == 4
+    assert camera.buffer_count_for(30) == 5
+    assert camera.buffer_count_for(120) == 8
+
+
+def test_headless_camera_without_lores(camera):
+    picam2 = init(camera, headless=True, lores=False)
+    config = picam2.camera_configuration()
+    assert config['lores'] is None
+    assert config['buffer_count'] == 5
+
+    report = camera.pipeline_report(config, headless=True)
+    assert report['preview'] is False
+    assert report['lores'] is False
+    assert report['buffer_bytes'] == 5 * 1920 * 1080 * 4
+    # One main buffer and six lores buffers fewer than picamera2's defaults
+    assert report['saved_bytes'] == 1920 * 1080 * 4 + 6 * 640 * 480 * 1.5
+
+
+def test_headless_alone_drops_the_lores_stream():
+    from spyglass.cli import get_args, needs_lores
+    assert not needs_lores(get_args(['--headless']))
+    assert needs_lores(get_args(['--headless', '--hls_bitrate', '1000000']))
+    assert needs_lores(get_args([]))
+
+
+def test_report_of_an_unreadable_configuration(camera):
+    assert camera.pipeline_report({'buffer_count': 4, 'main': {'size': ()}}) is None
+
+
+def test_defaults_keep_the_lores_stream(camera):
+    picam2 = init(camera)
+    config = picam2.camera_configuration()
+    assert config['lores']['size'] == (640, 480)
+    # Only headless cameras size their buffers from the frame rate
+    assert config['buffer_count'] == 6
+    report = camera.pipeline_report(config)
+    assert report['preview'] is True
+    assert report['saved_bytes'] == 0
+
+
+def test_cma_info(camera, tmp_path):
+    meminfo = tmp_path / 'meminfo'
+    meminfo.write_text('MemTotal:        1000 kB\nCmaTotal:         262144 kB\nCmaFree:          131072 kB\n')
+    assert camera.cma_info(str(meminfo)) == {'CmaTotal': 256 * 1024 ** 2, 'CmaFree': 128 * 1024 ** 2}
+    meminfo.write_text('MemTotal:        1000 kB\n')
+    assert camera.cma_info(str(meminfo)) is None
@@ -0,0 +1,53 @@
+import json
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def mock_libcamera():
+    with patch.dict('sys.modules', {'libcamera': MagicMock()}):
+        yield
+
+
+class FakeCamera:
+    def __init__(self, controls):
+        self.camera_controls = controls
+
+
+CONTROLS = {
+    'Brightness': (-1.0, 1.0, 0.0),
+    'AwbEnable': (False, True, None),
+}
+
+
+def test_process_controls_is_case_insensitive():
+    from spyglass.camera_options import process_controls
+    camera = FakeCamera(CONTROLS)
+    assert process_controls(camera, [(' brightness', '-0.4'), ('AWBENABLE', 'False'), ('unknown', '1')]) == {
+        'Brightness': -0.4,
+        'AwbEnable': False,
+    }
+    assert process_controls(camera, None) == {}
+
+
+def test_cache_is_rebuilt_only_when_controls_change():
+    from spyglass.camera_options import ControlsCache
+    cache = ControlsCache()
+    camera = FakeCamera(CONTROLS)
+    first = cache.get(camera).etag
+    cards = cache.cards_html
+    assert cache.get(camera).cards_html is cards
+
+    camera.camera_controls = {'Sharpness': (0.0, 16.0, 1.0)}
+    assert cache.get(camera).etag != first
+    assert 'Sharpness' in cache.cards_html
+    assert json.loads(cache.json) == {'Sharpness': {'min': 0.0, 'max': 16.0, 'default': 1.0}}
+
+
+def test_html_page_contains_style_and_controls():
+    from spyglass.camera_options import parse_dictionary_to_html_page
+    page = parse_dictionary_to_html_page(FakeCamera(CONTROLS), [('<b>', '1')], {})
+    assert '.card-container' in page
+    assert '<h2>Brightness</h2>' in page
+    assert '&lt;b&gt;' in page
@@ -22,7 +22,9 @@ DEFAULT_TUNING_FILTER_DIR = None
 
 
 @pytest.fixture(autouse=True)
-def mock_libraries(mocker):
+def mock_libraries(mocker, monkeypatch, tmp_path):
+    # The DVR creates its clips folder, ./clips by default
+    monkeypatch.chdir(tmp_path)
     mock_libcamera = MagicMock()
     mock_picamera2 = MagicMock()
     mock_picamera2_encoders = MagicMock()
@@ -37,6 +39,8 @@ def mock_libraries(mocker):
     mocker.patch('libcamera.controls.AfModeEnum.Continuous', AF_MODE_ENUM_CONTINUOUS)
     mocker.patch('libcamera.controls.AfSpeedEnum.Normal', AF_SPEED_ENUM_NORMAL)
     mocker.patch('libcamera.controls.AfSpeedEnum.Fast', AF_SPEED_ENUM_FAST)
+    # Like run_server, recording and the threads it starts are not under test here
+    mocker.patch('spyglass.dvr.DVR.start')
 
 
 def test_parse_bindaddress():
@@ -390,7 +394,8 @@ def test_run_server_with_configuration_from_arguments(mock_spyglass_server, mock
         '-sn', 'snapshot-url',
         '-or', 'h'
     ])
-    spyglass.server.run_server.assert_called_once_with('1.2.3.4', 1234, ANY, ANY, 'streaming-url', 'snapshot-url', 1)
+    spyglass.server.run_server.assert_called_once_with('1.2.3.4', 1234, ANY, ANY, 'streaming-url', 'snapshot-url', 1,
+                                                       hls_stream=ANY, loop_lag_threshold=0.1, headless_camera=False)
 
 
 @patch("spyglass.server.run_server")
@@ -422,7 +427,10 @@ def test_run_server_with_orientation(mock_spyglass_server, mock_spyglass_camera,
         ANY,
         'streaming-url',
         'snapshot-url',
-        expected_output
+        expected_output,
+        hls_stream=ANY,
+        loop_lag_threshold=0.1,
+        headless_camera=False
     )
 
 
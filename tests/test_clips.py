@@ -0,0 +1,35 @@
+import datetime
+import os
+
+import pytest
+
+
+def test_clip_id_round_trip():
+    from spyglass.clips import clip_id_for, clip_start_time
+    start = datetime.datetime(2024, 6, 5, 13, 4, 59)
+    clip_id = clip_id_for(start)
+    assert clip_id == 'clip_2024-06-05_13-04-59'
+    assert clip_start_time(clip_id) == start
+
+
+def test_clip_path_is_inside_day_folder():
+    from spyglass.clips import clip_path, THUMBNAIL_SUFFIX
+    assert clip_path('clips', 'clip_2024-06-05_13-04-59') == os.path.join('clips', '2024-06-05', 'clip_2024-06-05_13-04-59.mp4')
+    assert clip_path('clips', 'clip_2024-06-05_13-04-59', THUMBNAIL_SUFFIX).endswith('clip_2024-06-05_13-04-59.thumb.jpg')
+
+
+@pytest.mark.parametrize("clip_id", [
+    '../secret',
+    'clip_2024-06-05_13-04-59/../../x',
+    'TMP_clip_2024-06-05_13-04-59',
+    'clip_2024-06-05',
+])
+def test_clip_path_rejects_invalid_ids(clip_id):
+    from spyglass.clips import clip_path
+    with pytest.raises(ValueError):
+        clip_path('clips', clip_id)
+
+
+def test_sidecar_path_replaces_extension():
+    from spyglass.clips import sidecar_path, SPRITE_SUFFIX
+    assert sidecar_path('/c/2024-06-05/clip_x.mp4', SPRITE_SUFFIX) == '/c/2024-06-05/clip_x.sprite.jpg'
@@ -0,0 +1,61 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+
+def make_request(metadata=None):
+    request = MagicMock()
+    request.get_metadata.return_value = metadata or {}
+    return request
+
+
+def test_burst_is_coalesced_into_one_set_controls():
+    from spyglass.control_queue import ControlUpdateQueue
+    camera = MagicMock()
+    queue = ControlUpdateQueue(camera)
+    for brightness in [0.1, 0.2, 0.3]:
+        queue.submit({'Brightness': brightness})
+    queue.process_frame(make_request())
+    queue.process_frame(make_request())
+    camera.set_controls.assert_called_once_with({'Brightness': 0.3})
+
+
+def test_unchanged_values_are_dropped():
+    from spyglass.control_queue import ControlUpdateQueue
+    camera = MagicMock()
+    queue = ControlUpdateQueue(camera)
+    queue.submit({'Brightness': 0.3})
+    queue.process_frame(make_request())
+    assert queue.submit({'Brightness': 0.3, 'Contrast': 1.5}) == {'Contrast': 1.5}
+
+    # Going back to the applied value cancels the pending change
+    queue.submit({'Contrast': 1.0})
+    queue.submit({'Brightness': 0.3})
+    assert queue.report()['pending'] == {'Contrast': 1.0}
+
+
+def test_latency_is_measured_from_frame_metadata():
+    from spyglass.control_queue import ControlUpdateQueue
+    queue = ControlUpdateQueue(MagicMock(), settle_frames=5)
+    queue.submit({'ExposureTime': 10000, 'AwbEnable': False})
+    queue.process_frame(make_request({'ExposureTime': 20000}))
+    queue.process_frame(make_request({'ExposureTime': 20000}))
+    queue.process_frame(make_request({'ExposureTime': 9990}))
+    for _ in range(5):
+        queue.process_frame(make_request({'ExposureTime': 9990}))
+
+    latencies = {entry['control']: entry for entry in queue.report()['latencies']}
+    assert latencies['ExposureTime']['frames'] == 2
+    assert latencies['AwbEnable']['frames'] is None
+
+
+@pytest.mark.parametrize("reported, requested, expected", [
+    (9990, 10000, True),
+    (9000, 10000, False),
+    ((1.5, 2.0), [1.5, 2.0], True),
+    (False, True, False),
+    ('auto', 'auto', True),
+])
+def test_values_match(reported, requested, expected):
+    from spyglass.control_queue import values_match
+    assert values_match(reported, requested) == expected
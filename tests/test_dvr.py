@@ -0,0 +1,162 @@
+import asyncio
+import os
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+SFTP_INFO = ('user', 'password', 'localhost', '/dashcam')
+
+
+@pytest.fixture
+def camera(simulated):
+    from spyglass import simulator
+
+    simulated('spyglass.camera')
+    camera = simulator.Picamera2(main_size=(1920, 1080), lores_size=(640, 480), fps=30)
+    yield camera
+    camera.stop_recording()
+
+
+def make_dvr(camera, tmp_path, **kwargs):
+    from spyglass.dvr import DVR
+
+    return DVR(camera, str(tmp_path), (1920, 1080), 30, 20, 10, 0, None, 0.1, 65.0, SFTP_INFO, **kwargs)
+
+
+def test_parameters_are_checked(camera, tmp_path):
+    dvr = make_dvr(camera, tmp_path)
+    with pytest.raises(ValueError):
+        dvr.request_reconfigure({'clip_resolution': '1920'})
+    with pytest.raises(ValueError):
+        dvr.request_reconfigure({'clip_resolution': '3840x2160'})
+    with pytest.raises(ValueError):
+        dvr.request_reconfigure({'clip_duration': 0})
+    with pytest.raises(ValueError):
+        dvr.request_reconfigure({'shutter': 1})
+
+    assert dvr.request_reconfigure({'clip_duration': 30, 'fps': None}) == {'clip_duration': 30}
+    assert dvr.request_reconfigure({'clip_resolution': '1280x720'}) == {'clip_duration': 30, 'clip_resolution': (1280, 720)}
+    assert dvr.recording_config()['current']['clip_resolution'] == '1920x1080'
+
+
+def test_resolution_change_restarts_the_camera(camera, tmp_path):
+    from spyglass.bitrate import base_bitrate
+
+    dvr = make_dvr(camera, tmp_path, thumbnail_interval=1, adaptive_bitrate=True)
+    camera.start()
+    dvr.request_reconfigure({'clip_resolution': '1280x720', 'resolution': '320x240', 'quality_factor': 10})
+    encoder, proxy_encoder = dvr._apply_config()
+
+    config = camera.camera_configuration()
+    assert config['main']['size'] == (1280, 720)
+    assert config['lores']['size'] == (320, 240)
+    assert dvr.thumbnailer.lores_size == (320, 240)
+    assert encoder.bitrate == base_bitrate((1280, 720), 30, 10)
+    assert proxy_encoder is None
+
+    report = dvr.recording_config()
+    assert report['pending'] == {}
+    assert report['applied'] == 1
+    assert report['last_change']['camera_restarted'] is True
+    assert report['current']['resolution'] == '320x240'
+
+
+def test_clip_duration_and_frame_rate_keep_the_camera_running(camera, tmp_path):
+    dvr = make_dvr(camera, tmp_path)
+    dvr.request_reconfigure({'clip_duration': 60, 'fps': 15})
+    dvr._apply_config()
+
+    assert dvr.clip_duration == 60
+    # Applied from the frame callback like any other control
+    dvr.control_queue.process_frame(camera.capture_frame())
+    assert camera.fps == 15
+    assert dvr.recording_config()['last_change']['camera_restarted'] is False
+
+
+def test_blackout_is_measured_from_the_frame_timing(camera, tmp_path):
+    dvr = make_dvr(camera, tmp_path)
+    writer = dvr.timing_writer
+    for first, last in [(100.0, 109.96), (110.0, 119.96)]:
+        writer.first_frame_time, writer.last_frame_time = first, last
+        dvr._measure_gap()
+    assert dvr.config_stats['clip_gap_ms'] == pytest.approx(40, abs=0.1)
+
+    dvr._blackout_pending = True
+    writer.first_frame_time, writer.last_frame_time = 120.25, 130.0
+    dvr._measure_gap()
+    assert dvr.config_stats['last_blackout_ms'] == pytest.approx(290, abs=0.1)
+    assert dvr.config_stats['clip_gap_ms'] == pytest.approx(40, abs=0.1)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_pause_releases_the_camera_and_resume_records_again(camera, tmp_path):
+    from spyglass import simulator
+    from spyglass.incidents import Incidents
+
+    opened = []
+
+    def open_camera():
+        opened.append(simulator.Picamera2(main_size=(1920, 1080), lores_size=(640, 480), fps=30))
+        return opened[-1]
+
+    dvr = make_dvr(camera, tmp_path, camera_factory=open_camera, event_pre_roll=0)
+    clips = []
+    dvr.upload_clips_manager = SimpleNamespace(add_file_to_queue=lambda file_path: clips.append(file_path))
+    dvr.incidents = Incidents(str(tmp_path), dvr.clip_duration, clips.append)
+    dvr.request_reconfigure({'clip_resolution': '1280x720'})
+    camera.start()
+    threading.Thread(target=asyncio.run, args=(dvr.start_recording(),), daemon=True).start()
+    assert wait_for(lambda: dvr.timing_writer.last_frame_time is not None)
+
+    # Ends the clip being recorded instead of waiting for its 10 seconds
+    report = dvr.pause()
+    assert report['paused'] and camera.closed
+    assert report['last_pause_ms'] < 1000
+    assert len(clips) == 1
+    assert dvr.pause()['pauses'] == 1
+
+    report = dvr.resume()
+    assert not report['paused']
+    assert report['last_resume_ms'] < 1000
+    assert dvr.picam2 is opened[0] and dvr.control_queue.camera is opened[0]
+    # The configuration changed while recording is kept
+    assert opened[0].camera_configuration()['main']['size'] == (1280, 720)
+    assert wait_for(lambda: opened[0].encoders)
+
+    dvr.pause()
+    assert opened[0].closed
+    assert len(clips) == 2
+
+
+def test_staged_clip_reaches_incidents_once_it_is_on_the_card(camera, tmp_path):
+    staging = tmp_path / 'staging'
+    staging.mkdir()
+    clips = tmp_path / 'clips'
+    clips.mkdir()
+    dvr = make_dvr(camera, clips, staging_folder=str(staging))
+    queued = []
+    dvr.upload_clips_manager = SimpleNamespace(add_file_to_queue=queued.append)
+    finished = []
+    tmp_file = staging / 'TMP_clip_2024-06-05_12-00-00.mp4'
+    tmp_file.write_bytes(bytes(1000))
+    final_file = str(clips / 'clip_2024-06-05_12-00-00.mp4')
+
+    dvr._finish_file(str(tmp_file), final_file, staged=True,
+                     finished=lambda path: finished.append((path, os.path.exists(path))))
+    dvr.write_behind.stop()
+    assert queued == [final_file]
+    assert finished == [(final_file, True)]
+
+
+def test_pausing_needs_a_camera_factory(camera, tmp_path):
+    dvr = make_dvr(camera, tmp_path)
+    with pytest.raises(RuntimeError):
+        dvr.pause()
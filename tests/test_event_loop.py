@@ -0,0 +1,60 @@
+import asyncio
+import threading
+import time
+
+
+def blocking_handler():
+    time.sleep(0.3)
+
+
+def test_watchdog_reports_where_the_loop_was_blocked():
+    from spyglass.event_loop import LoopWatchdog
+
+    async def main():
+        watchdog = LoopWatchdog(threshold=0.1, interval=0.02)
+        watchdog.start()
+        await asyncio.sleep(0.1)
+        blocking_handler()
+        await asyncio.sleep(0.1)
+        watchdog.stop()
+        return watchdog.report()
+
+    report = asyncio.run(main())
+    assert report['stalls'] == 1
+    assert report['max_lag_ms'] > 200
+    assert report['recent'][0]['where'].startswith('blocking_handler (test_event_loop.py:')
+
+
+def test_watchdog_stays_quiet_when_the_loop_is_free():
+    from spyglass.event_loop import LoopWatchdog
+
+    async def main():
+        watchdog = LoopWatchdog(threshold=0.1, interval=0.02)
+        watchdog.start()
+        await asyncio.sleep(0.3)
+        watchdog.stop()
+        return watchdog.report()
+
+    assert asyncio.run(main())['stalls'] == 0
+
+
+def test_run_blocking_keeps_the_loop_running():
+    from spyglass.event_loop import run_blocking
+
+    async def main():
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        thread = await run_blocking(lambda: time.sleep(0.2) or threading.current_thread().name)
+        task.cancel()
+        return ticks, thread
+
+    ticks, thread = asyncio.run(main())
+    assert ticks > 5
+    assert thread.startswith('io')
@@ -0,0 +1,50 @@
+import datetime
+import os
+
+
+def make_clip(clips_folder, start, name_suffix='.mp4'):
+    day_folder = clips_folder / start.strftime('%Y-%m-%d')
+    day_folder.mkdir(exist_ok=True)
+    path = day_folder / ('clip_' + start.strftime('%Y-%m-%d_%H-%M-%S') + name_suffix)
+    path.write_bytes(b'')
+    return str(path)
+
+
+def test_find_covering_clips_across_midnight(tmp_path):
+    from spyglass.export import find_covering_clips
+    before_midnight = datetime.datetime(2024, 6, 5, 23, 59, 50)
+    after_midnight = datetime.datetime(2024, 6, 6, 0, 0, 0)
+    later = datetime.datetime(2024, 6, 6, 0, 0, 20)
+    first = make_clip(tmp_path, before_midnight)
+    second = make_clip(tmp_path, after_midnight)
+    make_clip(tmp_path, later)
+    make_clip(tmp_path, after_midnight, '.proxy.mp4')
+    (tmp_path / '2024-06-06' / 'TMP_clip_2024-06-06_00-00-10.mp4').write_bytes(b'')
+
+    start = before_midnight.timestamp() + 5
+    end = after_midnight.timestamp() + 5
+    clips = find_covering_clips(str(tmp_path), start, end, 10)
+    assert clips == [
+        (os.path.abspath(first), before_midnight.timestamp()),
+        (os.path.abspath(second), after_midnight.timestamp()),
+    ]
+
+
+def test_find_covering_clips_without_matches(tmp_path):
+    from spyglass.export import find_covering_clips
+    make_clip(tmp_path, datetime.datetime(2024, 6, 5, 12, 0, 0))
+    start = datetime.datetime(2024, 6, 5, 13, 0, 0).timestamp()
+    assert find_covering_clips(str(tmp_path), start, start + 60, 10) == []
+
+
+def test_concat_list_trims_first_and_last_clip():
+    from spyglass.export import concat_list
+    clips = [('/c/a.mp4', 100.0), ("/c/it's.mp4", 110.0), ('/c/c.mp4', 120.0)]
+    assert concat_list(clips, 104, 125, 10).splitlines() == [
+        'ffconcat version 1.0',
+        "file '/c/a.mp4'",
+        'inpoint 4.000',
+        "file '/c/it'\\''s.mp4'",
+        "file '/c/c.mp4'",
+        'outpoint 5.000',
+    ]
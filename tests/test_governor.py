@@ -0,0 +1,125 @@
+import pytest
+
+
+def make_governor(**kwargs):
+    from spyglass.governor import Governor
+
+    kwargs.setdefault('temperatures', (70, 75, 78, 80))
+    return Governor(min_dwell=30, **kwargs)
+
+
+def ramp(start, end, seconds, step=5, load=None):
+    """A temperature trace going linearly from ``start`` to ``end`` °C."""
+    samples = seconds // step
+    return [{'time': i * step, 'temperature': start + (end - start) * i / samples, 'load': load}
+            for i in range(samples + 1)]
+
+
+def test_levels_follow_a_hot_afternoon():
+    from spyglass.governor import simulate
+
+    changes = []
+    governor = make_governor(on_change=lambda old, new: changes.append((old, new)))
+    # Parked in the sun, then driving with the A/C on
+    trace = ramp(60, 82, 600) + [dict(s, time=s['time'] + 605) for s in ramp(82, 55, 600)]
+    levels = simulate(trace, governor)
+
+    assert max(levels) == 4
+    assert levels[-1] == 0
+    # One level per step, up through all of them and back down
+    assert changes == [(0, 1), (1, 2), (2, 3), (3, 4), (4, 3), (3, 2), (2, 1), (1, 0)]
+    assert governor.active('stream_fps') is False
+
+
+def test_hysteresis_keeps_a_noisy_reading_from_flapping():
+    from spyglass.governor import simulate
+
+    governor = make_governor()
+    # ±1.5 °C of noise around the first threshold for ten minutes
+    trace = [{'time': t, 'temperature': 70 + (-1.5 if t % 10 else 1.5)} for t in range(0, 600, 5)]
+    levels = simulate(trace, governor)
+
+    assert levels[0] == 1
+    assert set(levels) == {1}
+    assert len(governor.transitions) == 1
+
+    # Only well below the threshold, and after the dwell time
+    assert governor.update(66, now=700) == 1
+    assert governor.update(64.9, now=705) == 0
+
+
+def test_level_is_held_for_the_dwell_time():
+    governor = make_governor()
+    assert governor.update(76, now=0) == 1
+    assert governor.update(76, now=5) == 2
+    assert governor.update(50, now=20) == 2
+    assert governor.update(50, now=35) == 1
+    assert governor.update(50, now=50) == 1
+    assert governor.update(50, now=65) == 0
+
+
+def test_load_adds_a_level():
+    governor = make_governor(max_load=3.0)
+    assert governor.update(50, 3.5, now=0) == 1
+    assert governor.update(72, 3.5, now=5) == 2
+    # The temperature gives its level back, the load is still above 80 % of the limit
+    assert governor.update(50, 2.5, now=60) == 1
+    assert governor.update(50, 2.5, now=95) == 1
+    assert governor.update(50, 2.0, now=100) == 0
+
+
+def test_load_spike_at_a_moderate_temperature():
+    from spyglass.governor import simulate
+
+    governor = make_governor(max_load=3.0)
+    # 72 °C all along, the load at 4 for half a minute
+    trace = [{'time': t, 'temperature': 72, 'load': 4.0 if 30 <= t < 60 else 0.1} for t in range(0, 300, 5)]
+    levels = simulate(trace, governor)
+
+    assert max(levels) == 2
+    # The load gives its level back after the dwell time, the temperature keeps the first one
+    assert levels[-1] == 1
+    assert [(t['from'], t['to']) for t in governor.transitions] == [(0, 1), (1, 2), (2, 1)]
+
+
+def test_actions_of_the_active_levels():
+    governor = make_governor(levels=('stream_fps', 'bitrate', 'background', 'viewers'), stream_fps=5,
+                             bitrate_factor=0.5)
+    assert governor.stream_interval() == 0
+    assert governor.clip_bitrate(1000) == 1000
+    assert governor.busy_reason() is None
+
+    governor.update(76, now=0)
+    governor.update(76, now=5)
+    assert governor.stream_interval() == 0.2
+    assert governor.clip_bitrate(1000) == 500
+    assert governor.busy_reason() is None
+    governor.update(78, now=10)
+    assert governor.busy_reason() == 'governor at level 3'
+    assert governor.report()['active'] == ['stream_fps', 'bitrate', 'background']
+
+
+def test_configuration_is_checked():
+    from spyglass.governor import Governor, parse_levels
+
+    with pytest.raises(ValueError):
+        Governor(temperatures=(70, 75))
+    with pytest.raises(ValueError):
+        Governor(temperatures=(80, 75, 78, 70))
+    with pytest.raises(ValueError):
+        parse_levels('bitrate,cooling')
+    assert parse_levels('bitrate, background') == ('bitrate', 'background')
+
+
+def test_replay_a_trace_file(tmp_path, capsys):
+    import json
+    from spyglass.governor import main
+
+    trace = tmp_path / 'trace.csv'
+    trace.write_text('time,temperature,load\n' + ''.join(f"{s['time']},{s['temperature']}," + '\n'
+                                                          for s in ramp(60, 80, 300)))
+    main([str(trace)])
+    result = json.loads(capsys.readouterr().out)
+    assert result['samples'] == 61
+    assert result['max_level'] == 4
+    assert sum(result['seconds_per_level']) == 300
@@ -0,0 +1,124 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from spyglass.simulator import box
+
+
+@pytest.mark.parametrize("frame, expected", [
+    (b'\x00\x00\x00\x01\x67\x64\x00\x28' + b'\x00\x00\x00\x01\x68\xee' + b'\x00\x00\x00\x01\x65\x88', True),
+    (b'\x00\x00\x00\x01\x65\x88\x84', True),
+    (b'\x00\x00\x00\x01\x41\x9a\x02', False),
+    (b'', False),
+])
+def test_is_keyframe(frame, expected):
+    from spyglass.hls import is_keyframe
+    assert is_keyframe(frame) == expected
+
+
+def test_ring_keeps_only_the_latest_segments():
+    from spyglass.hls import SegmentRing
+    ring = SegmentRing(size=3)
+    for i in range(5):
+        ring.add(b'segment %d' % i, 1.0)
+    assert ring.get(1) is None
+    assert ring.get(4).data == b'segment 4'
+    assert ring.next_sequence == 5
+
+
+def test_playlist_lists_the_ring():
+    from spyglass.hls import SegmentRing
+    ring = SegmentRing(size=2)
+    ring.add(b'a', 1.0)
+    ring.add(b'b', 0.98)
+    ring.add(b'c', 1.2)
+    assert ring.playlist().splitlines() == [
+        '#EXTM3U',
+        '#EXT-X-VERSION:7',
+        '#EXT-X-TARGETDURATION:2',
+        '#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES',
+        '#EXT-X-MEDIA-SEQUENCE:1',
+        '#EXT-X-MAP:URI="init.mp4"',
+        '#EXTINF:0.980,',
+        'segment_1.m4s',
+        '#EXTINF:1.200,',
+        'segment_2.m4s',
+    ]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_muxer_collects_the_init_segment_and_fragments(monkeypatch):
+    from spyglass import hls
+    # cat passes the boxes through like ffmpeg's fMP4 output
+    monkeypatch.setattr(hls, 'FFMPEG_FMP4_COMMAND', ['cat'])
+    muxer = hls.HlsMuxer(segments=2)
+    init = box(b'ftyp', b'isom') + box(b'moov', box(b'mvhd'))
+    muxer.write(init)
+    for i in range(3):
+        muxer.write(box(b'moof', b'%d' % i) + box(b'mdat', b'frame %d' % i))
+    # Flushes the pipe, cat exits once it has passed everything on
+    muxer.close()
+    assert wait_for(lambda: muxer.ring.next_sequence == 3)
+
+    assert muxer.ring.init_segment == init
+    assert muxer.ring.get(0) is None
+    assert muxer.ring.get(2).data == box(b'moof', b'2') + box(b'mdat', b'frame 2')
+    assert muxer.ring.get(2).duration == 1.0
+
+
+@pytest.fixture
+def server(simulated, monkeypatch):
+    server = simulated('spyglass.server')
+    monkeypatch.setattr(server, 'dvr', SimpleNamespace(paused=False))
+    return server
+
+
+def make_stream(server, monkeypatch):
+    from spyglass.hls import SegmentRing
+
+    ring = SegmentRing(size=3)
+    stream = SimpleNamespace(running=True, touched=0, muxer=SimpleNamespace(ring=ring))
+    stream.touch = lambda: setattr(stream, 'touched', stream.touched + 1)
+    monkeypatch.setattr(server, 'hls', stream)
+    return stream, ring
+
+
+def test_hls_endpoints_are_missing_without_a_bitrate(server):
+    for endpoint in (server.hls_playlist(None), server.hls_init_segment(), server.hls_segment(0)):
+        assert asyncio.run(endpoint).status_code == 404
+
+
+def test_hls_endpoints_serve_the_ring(server, monkeypatch):
+    stream, ring = make_stream(server, monkeypatch)
+    ring.init_segment = b'init'
+    ring.add(b'segment 0', 1.0)
+
+    playlist = asyncio.run(server.hls_playlist(0))
+    assert playlist.body.decode() == ring.playlist()
+    assert asyncio.run(server.hls_init_segment()).body == b'init'
+    assert asyncio.run(server.hls_segment(0)).body == b'segment 0'
+    assert asyncio.run(server.hls_segment(1)).status_code == 404
+    # Every request keeps the encoder running
+    assert stream.touched == 4
+
+
+def test_hls_playlist_blocks_until_the_requested_segment(server, monkeypatch):
+    stream, ring = make_stream(server, monkeypatch)
+
+    async def request_and_add():
+        playlist = asyncio.ensure_future(server.hls_playlist(1))
+        await asyncio.sleep(0.1)
+        assert not playlist.done()
+        ring.add(b'segment 0', 1.0)
+        ring.add(b'segment 1', 1.0)
+        return await playlist
+
+    assert 'segment_1.m4s' in asyncio.run(request_and_add()).body.decode()
@@ -0,0 +1,132 @@
+import datetime
+import os
+import time
+
+import pytest
+
+
+@pytest.fixture
+def ringbuffer(simulated):
+    return simulated('spyglass.ringbuffer')
+
+
+def feed(ring, frames, fps=30, keyframe_every=30, size=1000):
+    for i in range(frames):
+        ring.outputframe(bytes([i % 256]) * size, keyframe=i % keyframe_every == 0)
+
+
+def test_ring_buffer_is_bounded_and_starts_with_a_keyframe(ringbuffer):
+    ring = ringbuffer.H264RingBuffer(seconds=2, fps=30, bitrate=8 * 1000 * 30)
+    feed(ring, 30 * 10 + 5)
+    assert len(ring._frames) <= ring.max_frames
+    assert ring.size <= ring.max_bytes
+    assert ring._frames[0][1]
+
+    # A burst of large frames drops whole GOPs to stay within the byte limit
+    feed(ring, 60, size=20000)
+    assert ring.size <= ring.max_bytes
+    assert not ring._frames or ring._frames[0][1]
+
+
+def test_snapshot_starts_at_the_keyframe_before_the_pre_roll(ringbuffer):
+    ring = ringbuffer.H264RingBuffer(seconds=10, fps=30, bitrate=10_000_000)
+    now = time.time()
+    for i in range(90):
+        ring._frames.append((now - 3 + i / 30, i % 30 == 0, bytes([i])))
+
+    frames = ring.snapshot(now - 1.5, now)
+    # From the keyframe 2 seconds back
+    assert frames[0] == bytes([30])
+    assert len(frames) == 60
+
+
+def test_snapshot_after_a_gap_in_recording_is_empty(ringbuffer):
+    ring = ringbuffer.H264RingBuffer(seconds=10, fps=30, bitrate=10_000_000)
+    now = time.time()
+    # One clip that ended a minute ago, nothing recorded since
+    for i in range(90):
+        ring._frames.append((now - 63 + i / 30, i % 30 == 0, bytes([i])))
+
+    assert ring.snapshot(now - 10, now) == []
+    # Still the keyframe before the window, within one GOP
+    assert ring.snapshot(now - 61.5, now)[0] == bytes([30])
+
+
+def make_incidents(tmp_path, ring_buffer=None, pre_roll=10):
+    from spyglass.incidents import Incidents
+
+    requested = []
+    incidents = Incidents(str(tmp_path), 10, requested.append, ring_buffer, pre_roll=pre_roll, post_roll=10)
+    return incidents, requested
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_marking_locks_recorded_and_upcoming_clips(tmp_path):
+    from spyglass.clips import clip_id_for, is_locked
+
+    marked = datetime.datetime.now().replace(microsecond=0)
+    day = tmp_path / marked.strftime('%Y-%m-%d')
+    day.mkdir()
+    recorded = [str(day / (clip_id_for(marked - datetime.timedelta(seconds=s)) + '.mp4')) for s in (25, 15, 5)]
+    for path in recorded:
+        open(path, 'wb').close()
+
+    incidents, requested = make_incidents(tmp_path)
+    started = time.perf_counter()
+    event = incidents.mark(marked.timestamp(), 'button')
+    assert time.perf_counter() - started < 0.01
+    assert event['event'] == 'event_' + marked.strftime('%Y-%m-%d_%H-%M-%S')
+
+    assert wait_for(lambda: len(requested) == 2)
+    # The clip that ended 15 seconds before the incident is not part of it
+    assert sorted(requested) == recorded[1:]
+    assert not is_locked(recorded[0])
+    assert is_locked(recorded[1]) and is_locked(recorded[2])
+    assert is_locked(recorded[2].replace('.mp4', '.proxy.mp4'))
+
+    upcoming = str(day / (clip_id_for(marked + datetime.timedelta(seconds=5)) + '.mp4'))
+    later = str(day / (clip_id_for(marked + datetime.timedelta(seconds=15)) + '.mp4'))
+    incidents.clip_finished(upcoming)
+    incidents.clip_finished(later)
+    assert requested[-1] == upcoming
+    assert not is_locked(later)
+
+
+def test_pre_roll_is_written_from_the_ring_buffer(tmp_path, ringbuffer):
+    ring = ringbuffer.H264RingBuffer(seconds=10, fps=30, bitrate=10_000_000)
+    feed(ring, 60)
+    incidents, requested = make_incidents(tmp_path, ring)
+
+    event = incidents.mark(label='app')
+    assert event['pre_roll_frames'] == 60
+    assert wait_for(lambda: requested)
+    pre_roll = requested[0]
+    assert os.path.basename(pre_roll).startswith(event['event'])
+    if pre_roll.endswith('.h264'):
+        # Without ffmpeg the raw stream is kept
+        assert os.path.getsize(pre_roll) == 60 * 1000
+    assert wait_for(lambda: (tmp_path / 'events.csv').exists())
+    assert (tmp_path / 'events.csv').read_text().split(',')[1] == 'app'
+
+
+def test_marking_without_pre_roll_still_locks_the_clips(tmp_path):
+    from spyglass.clips import clip_id_for, is_locked
+
+    marked = datetime.datetime.now().replace(microsecond=0)
+    day = tmp_path / marked.strftime('%Y-%m-%d')
+    day.mkdir()
+    recording = str(day / (clip_id_for(marked - datetime.timedelta(seconds=5)) + '.mp4'))
+    open(recording, 'wb').close()
+
+    incidents, requested = make_incidents(tmp_path, pre_roll=0)
+    event = incidents.mark(marked.timestamp())
+    assert event['pre_roll_frames'] == 0
+    assert wait_for(lambda: requested == [recording])
+    assert is_locked(recording)
+    assert not [name for name in os.listdir(day) if name.startswith('event_')]
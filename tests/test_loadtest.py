@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+
+
+def multipart(frames, timestamp):
+    data = b''
+    for frame in frames:
+        data += (b'--FRAME\r\nContent-Type: image/jpeg\r\nContent-Length: ' + str(len(frame)).encode() +
+                 b'\r\nX-Timestamp: ' + f'{timestamp:.6f}'.encode() + b'\r\n\r\n' + frame + b'\r\n')
+    return data
+
+
+def test_read_parts_splits_frames_with_their_headers():
+    from spyglass.loadtest import read_parts
+
+    async def main():
+        reader = asyncio.StreamReader()
+        # A frame may contain the boundary, the length decides where it ends
+        reader.feed_data(multipart([b'\xff\xd8one\xff\xd9', b'--FRAME\r\n', b''], 1700000000.25))
+        reader.feed_eof()
+        return [part async for part in read_parts(reader, 'FRAME')]
+
+    parts = asyncio.run(main())
+    assert [body for _, body in parts] == [b'\xff\xd8one\xff\xd9', b'--FRAME\r\n', b'']
+    assert parts[0][0]['x-timestamp'] == '1700000000.250000'
+    assert parts[0][0]['content-type'] == 'image/jpeg'
+
+
+def test_multipart_boundary():
+    from spyglass.loadtest import HttpError, multipart_boundary
+
+    assert multipart_boundary('multipart/x-mixed-replace; boundary=FRAME') == 'FRAME'
+    assert multipart_boundary('multipart/x-mixed-replace;boundary="frame"') == 'frame'
+    with pytest.raises(HttpError):
+        multipart_boundary('image/jpeg')
+
+
+def test_run_reports_stream_and_snapshot_clients():
+    from spyglass.loadtest import run
+
+    async def handle(reader, writer):
+        request = await reader.readuntil(b'\r\n\r\n')
+        path = request.split()[1]
+        if path == b'/stream':
+            writer.write(b'HTTP/1.0 200 OK\r\nContent-Type: multipart/x-mixed-replace; boundary=FRAME\r\n\r\n')
+            try:
+                while True:
+                    writer.write(multipart([bytes(1000)], time.time() - 0.05))
+                    await writer.drain()
+                    await asyncio.sleep(0.02)
+            except ConnectionError:
+                pass
+        elif path == b'/snapshot':
+            writer.write(b'HTTP/1.0 200 OK\r\nX-Timestamp: %.6f\r\n\r\n' % time.time() + bytes(500))
+        else:
+            writer.write(b'HTTP/1.0 404 Not Found\r\n\r\n')
+        writer.close()
+
+    async def main():
+        server = await asyncio.start_server(handle, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await run(f'http://127.0.0.1:{port}', streams=2, snapshots=1, seconds=0.5)
+
+    report = asyncio.run(main())
+    stream = report['summary']['stream']
+    assert stream['clients'] == 2
+    assert stream['errors'] == 0
+    assert 20 <= stream['fps_mean'] <= 55
+    assert stream['bytes_per_s'] > 0
+    for client in report['clients']:
+        if client['kind'] == 'stream':
+            assert 40 <= client['age_ms']['p50'] < 1000
+    assert report['summary']['snapshot']['fps_mean'] > 0
+    assert report['clients'][2]['latency_ms']['p50'] > 0
+    # /status and /profile are not served here
+    assert report['server'] == {}
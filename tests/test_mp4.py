@@ -0,0 +1,30 @@
+import io
+import struct
+
+from spyglass.simulator import box
+
+
+def test_box_header_handles_large_sizes():
+    from spyglass.mp4 import box_header
+    data = struct.pack('>I4sQ', 1, b'mdat', 32) + b'\x00' * 16
+    assert box_header(data) == (32, 'mdat', 16)
+    assert box_header(b'\x00\x00') is None
+
+
+def test_splitter_returns_only_complete_boxes():
+    from spyglass.mp4 import BoxSplitter
+    stream = box(b'ftyp', b'isom') + box(b'moov', b'x' * 10) + box(b'moof', b'y' * 4)
+    splitter = BoxSplitter()
+    assert splitter.feed(stream[:5]) == []
+    boxes = splitter.feed(stream[5:-2])
+    assert [t for t, _ in boxes] == ['ftyp', 'moov']
+    assert boxes[1][1] == box(b'moov', b'x' * 10)
+    assert splitter.feed(stream[-2:]) == [('moof', box(b'moof', b'y' * 4))]
+
+
+def test_scan_boxes_stops_at_truncated_box():
+    from spyglass.mp4 import scan_boxes
+    data = box(b'ftyp', b'isom') + box(b'moof', b'1234') + box(b'mdat', b'abcdefgh')
+    truncated = io.BytesIO(data[:-3])
+    assert [(o, t) for o, _, t in scan_boxes(truncated)] == [(0, 'ftyp'), (12, 'moof')]
+    assert len(list(scan_boxes(io.BytesIO(data)))) == 3
@@ -0,0 +1,71 @@
+from unittest.mock import MagicMock
+
+
+def make_request(sequence, sensor_ts, frame_duration=33333):
+    request = MagicMock()
+    request.request.sequence = sequence
+    request.get_metadata.return_value = {'SensorTimestamp': sensor_ts, 'FrameDuration': frame_duration}
+    return request
+
+
+def test_capture_drops_are_counted_from_sequence_gaps():
+    from spyglass.profiler import FrameProfiler
+    profiler = FrameProfiler()
+    for sequence in [1, 2, 5, 6]:
+        profiler.frame_started(make_request(sequence, sequence * 33_333_000))
+    report = profiler.report()
+    assert report['frames'] == 4
+    assert report['stages']['capture']['dropped'] == 2
+    assert report['stages']['interval']['count'] == 3
+
+
+def test_percentiles_are_reported_in_milliseconds():
+    from spyglass.profiler import FrameProfiler
+    profiler = FrameProfiler(window=100)
+    for i in range(1, 101):
+        profiler.record('overlay', i / 1000)
+    stats = profiler.report()['stages']['overlay']
+    assert stats['p50'] == 50
+    assert stats['p99'] == 99
+    assert stats['max'] == 100
+    assert stats['count'] == 100
+
+
+def test_instrumented_output_times_encoder_and_counts_output_drops():
+    from spyglass.profiler import FrameProfiler
+    profiler = FrameProfiler()
+    profiler.frame_duration_us = 1000
+    encoder = MagicMock()
+    output = MagicMock()
+    outputframe = output.outputframe
+    assert profiler.instrument('h264', encoder, output) is output
+
+    for timestamp in [0, 1000, 4000]:
+        encoder.encode('main', None)
+        output.outputframe(b'frame', True, timestamp)
+
+    stages = profiler.report()['stages']
+    assert outputframe.call_count == 3
+    assert stages['h264.encode']['count'] == 3
+    assert stages['h264.output']['count'] == 3
+    assert stages['h264']['dropped'] == 2
+
+
+def test_encoder_is_only_wrapped_once():
+    from spyglass.profiler import FrameProfiler
+    profiler = FrameProfiler()
+    encoder = MagicMock()
+    profiler.instrument('h264', encoder, MagicMock())
+    wrapped_encode = encoder.encode
+    profiler.instrument('h264', encoder, MagicMock())
+    assert encoder.encode is wrapped_encode
+
+
+def test_dump_writes_collapsed_stacks(tmp_path):
+    from spyglass.profiler import FrameProfiler
+    dump_path = tmp_path / 'profile.folded'
+    profiler = FrameProfiler(dump_path=str(dump_path))
+    profiler.record('overlay', 0.002)
+    profiler.record('h264.encode', 0.001)
+    profiler.dump()
+    assert dump_path.read_text().splitlines() == ['frame;h264;encode 1000', 'frame;overlay 2000']
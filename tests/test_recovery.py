@@ -0,0 +1,97 @@
+import os
+import time
+
+from spyglass.simulator import box
+
+HEADER = box(b'ftyp', b'isom') + box(b'moov', bytes(20))
+FRAGMENT = box(b'moof', bytes(16)) + box(b'mdat', bytes(1000))
+
+
+def make_orphan(folder, name, data, age=60):
+    path = folder / name
+    path.write_bytes(data)
+    past = time.time() - age
+    os.utime(path, (past, past))
+    return path
+
+
+def test_final_name():
+    from spyglass.recovery import final_name
+    assert final_name('TMP_clip_2024-06-05_12-00-00.mp4') == 'clip_2024-06-05_12-00-00.mp4'
+    assert final_name('TMP_clip_2024-06-05_12-00-00.proxy.mp4') == 'clip_2024-06-05_12-00-00.proxy.mp4'
+    assert final_name('clip_2024-06-05_12-00-00.mp4.part') == 'clip_2024-06-05_12-00-00.mp4'
+    assert final_name('clip_2024-06-05_12-00-00.mp4') is None
+    assert final_name('clip_2024-06-05_12-00-00.thumb.jpg') is None
+
+
+def test_orphans_are_truncated_renamed_and_queued(tmp_path):
+    from spyglass.recovery import ClipRecovery
+
+    day = tmp_path / '2024-06-05'
+    day.mkdir()
+    # Power lost halfway through the third fragment
+    make_orphan(day, 'TMP_clip_2024-06-05_12-00-00.mp4', HEADER + FRAGMENT * 2 + FRAGMENT[:500])
+    # Power lost between a fragment's moof and its mdat
+    make_orphan(day, 'clip_2024-06-05_12-00-10.mp4.part', HEADER + FRAGMENT + FRAGMENT[:24])
+    (day / 'clip_2024-06-05_11-59-50.mp4').write_bytes(HEADER + FRAGMENT)
+
+    queued = []
+    recovery = ClipRecovery(str(tmp_path), queued.append)
+    recovery.run()
+
+    assert sorted(os.listdir(day)) == ['clip_2024-06-05_11-59-50.mp4', 'clip_2024-06-05_12-00-00.mp4',
+                                       'clip_2024-06-05_12-00-10.mp4']
+    assert (day / 'clip_2024-06-05_12-00-00.mp4').read_bytes() == HEADER + FRAGMENT * 2
+    assert (day / 'clip_2024-06-05_12-00-10.mp4').read_bytes() == HEADER + FRAGMENT
+    assert sorted(queued) == [str(day / 'clip_2024-06-05_12-00-00.mp4'), str(day / 'clip_2024-06-05_12-00-10.mp4')]
+    report = recovery.report()
+    assert report['finished']
+    assert report['recovered'] == 2
+    assert report['truncated_bytes'] == 500 + 24
+    assert report['entries'] == 3
+
+
+def test_clip_being_recorded_is_left_alone(tmp_path):
+    from spyglass.recovery import ClipRecovery
+
+    day = tmp_path / '2024-06-05'
+    day.mkdir()
+    recovery = ClipRecovery(str(tmp_path), [].append)
+    recording = make_orphan(day, 'TMP_clip_2024-06-05_12-00-00.mp4', HEADER + FRAGMENT, age=-1)
+    recovery.run()
+    assert recording.exists()
+    assert recovery.report()['recovered'] == 0
+
+
+def test_empty_and_unplayable_orphans(tmp_path):
+    from spyglass.recovery import BROKEN_SUFFIX, ClipRecovery
+
+    day = tmp_path / '2024-06-05'
+    day.mkdir()
+    make_orphan(day, 'TMP_clip_2024-06-05_12-00-00.mp4', b'')
+    make_orphan(day, 'TMP_clip_2024-06-05_12-00-10.mp4', HEADER)
+    # A regular MP4 has its moov at the end
+    make_orphan(day, 'TMP_clip_2024-06-05_12-00-20.mp4', box(b'ftyp') + box(b'mdat', bytes(100))[:60])
+
+    queued = []
+    recovery = ClipRecovery(str(tmp_path), queued.append)
+    recovery.run()
+
+    assert os.listdir(day) == ['clip_2024-06-05_12-00-20.mp4' + BROKEN_SUFFIX]
+    assert queued == []
+    assert recovery.report()['removed_empty'] == 2
+    assert recovery.report()['unrecoverable'] == 1
+
+
+def test_scan_stops_at_the_time_budget(tmp_path):
+    from spyglass.recovery import ClipRecovery
+
+    for day in ('2024-06-04', '2024-06-05'):
+        (tmp_path / day).mkdir()
+        make_orphan(tmp_path / day, f'TMP_clip_{day}_12-00-00.mp4', HEADER + FRAGMENT)
+
+    recovery = ClipRecovery(str(tmp_path), [].append, time_budget=0)
+    recovery.run()
+    report = recovery.report()
+    assert not report['finished']
+    assert report['recovered'] == 0
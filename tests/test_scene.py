@@ -0,0 +1,37 @@
+import pytest
+
+
+@pytest.fixture
+def scene(simulated):
+    pytest.importorskip('numpy')
+    return simulated('spyglass.scene')
+
+
+def test_activity_is_the_largest_motion(scene):
+    import numpy as np
+
+    stats = scene.SceneStats((64, 48))
+    still = np.full((6, 8), 100, dtype=np.int16)
+    for _ in range(9):
+        stats.add_luma(still)
+    # A car drives by in one sample
+    stats.add_luma(still + 64)
+    stats.add_luma(still)
+
+    assert stats.activity == 1.0
+    assert stats.motion == pytest.approx(0.4)
+
+    stats.reset()
+    assert stats.activity is None
+    stats.add_luma(still)
+    assert stats.activity == 0.0
+
+
+def test_activity_of_a_simulated_clip(scene):
+    from spyglass.simulator import Picamera2
+
+    camera = Picamera2(main_size=(320, 240), lores_size=(160, 120), fps=30)
+    stats = scene.SceneStats((160, 120), every=1)
+    camera.pre_callback = stats.sample
+    camera.run_frames(5)
+    assert 0 <= stats.activity <= 1
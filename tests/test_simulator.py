@@ -0,0 +1,108 @@
+import io
+import time
+
+import pytest
+
+
+def test_frames_reach_pre_callback_with_metadata():
+    pytest.importorskip('numpy')
+    from spyglass.simulator import MappedArray, Picamera2
+
+    camera = Picamera2(main_size=(320, 240), lores_size=(160, 120), fps=30)
+    seen = []
+
+    def pre_callback(request):
+        with MappedArray(request, 'main') as m:
+            m.array[0, 0] = 255
+            seen.append((request.request.sequence, request.get_metadata(), m.array.shape))
+
+    camera.pre_callback = pre_callback
+    camera.run_frames(3)
+
+    assert [sequence for sequence, _, _ in seen] == [1, 2, 3]
+    assert seen[0][1]['FrameDuration'] == 33333
+    assert seen[1][1]['SensorTimestamp'] > seen[0][1]['SensorTimestamp']
+    assert seen[0][2] == (240, 320, 4)
+
+
+def test_h264_encoder_writes_keyframes_every_iperiod(tmp_path):
+    from spyglass.mp4 import scan_boxes
+    from spyglass.simulator import FfmpegOutput, H264Encoder, KEYFRAME_HEADER, Picamera2
+
+    camera = Picamera2(fps=10)
+    keyframes = []
+    encoder = H264Encoder(bitrate=800000, iperiod=5)
+    output = FfmpegOutput(str(tmp_path / 'clip.mp4'))
+    outputframe = output.outputframe
+    output.outputframe = lambda frame, keyframe=True, timestamp=None: (keyframes.append(keyframe),
+                                                                         outputframe(frame, keyframe, timestamp))
+    camera.start_encoder(encoder, output, name='main')
+    camera.run_frames(10)
+    encoder.stop()
+    camera.run_frames(2)
+
+    assert keyframes == [True, False, False, False, False] * 2
+    with open(tmp_path / 'clip.mp4', 'rb') as f:
+        boxes = list(scan_boxes(f))
+        assert [box_type for _, _, box_type in boxes] == ['ftyp', 'mdat', 'moov']
+        offset, size, _ = boxes[1]
+        f.seek(offset + 8)
+        assert f.read(len(KEYFRAME_HEADER)) == KEYFRAME_HEADER
+    # One second of frames at the requested bit rate
+    assert size == pytest.approx(800000 / 8, rel=0.05)
+    assert camera.encoders == []
+
+
+def test_fragmented_output_writes_a_fragment_per_gop(tmp_path):
+    from spyglass.mp4 import scan_boxes
+    from spyglass.simulator import FfmpegOutput, H264Encoder, Picamera2
+
+    camera = Picamera2(fps=10)
+    encoder = H264Encoder(bitrate=800000, iperiod=5)
+    path = tmp_path / 'clip.mp4'
+    camera.start_encoder(encoder, FfmpegOutput(f'-movflags +frag_keyframe+empty_moov {path}'), name='main')
+    camera.run_frames(12)
+
+    def box_types():
+        with open(path, 'rb') as f:
+            return [box_type for _, _, box_type in scan_boxes(f)]
+
+    # The third GOP is written once it is complete
+    assert box_types() == ['ftyp', 'moov', 'moof', 'mdat', 'moof', 'mdat']
+    encoder.stop()
+    assert box_types() == ['ftyp', 'moov'] + ['moof', 'mdat'] * 3
+
+
+def test_encoder_latency_delays_output():
+    from spyglass.simulator import FileOutput, MJPEGEncoder, Picamera2
+
+    camera = Picamera2(lores_size=(64, 48), encoder_latency=0.05)
+    sink = io.BytesIO()
+    encoder = MJPEGEncoder()
+    camera.start_encoder(encoder, FileOutput(sink), name='lores')
+    camera.run_frames(1)
+    assert sink.tell() == 0
+    time.sleep(0.2)
+    assert sink.getvalue().startswith(b'\xff\xd8')
+    encoder.stop()
+
+
+def test_camera_thread_delivers_frames_at_fps():
+    from spyglass.simulator import Picamera2
+
+    camera = Picamera2(main_size=(64, 48), lores_size=(32, 24), fps=50)
+    camera.start()
+    time.sleep(0.5)
+    camera.stop()
+    assert 20 <= camera.sequence <= 30
+
+
+def test_modules_stand_in_for_picamera2_and_libcamera(simulated):
+    from spyglass import simulator
+
+    from libcamera import controls
+    from picamera2 import Picamera2
+    from picamera2.encoders import H264Encoder
+    assert Picamera2 is simulator.Picamera2
+    assert H264Encoder is simulator.H264Encoder
+    assert controls.AfModeEnum.Manual == 0
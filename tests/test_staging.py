@@ -0,0 +1,59 @@
+import os
+
+
+def test_move_writes_file_and_calls_back_after_sync(tmp_path):
+    from spyglass.staging import WriteBehind
+    staging = tmp_path / 'staging'
+    card = tmp_path / 'card'
+    card.mkdir()
+    write_behind = WriteBehind(str(staging), chunk_size=1000)
+
+    done = []
+    data = os.urandom(4500)
+    src = write_behind.staging_path('TMP_clip.mp4')
+    with open(src, 'wb') as f:
+        f.write(data)
+    write_behind.move(src, str(card / 'clip.mp4'), done.append)
+    write_behind.stop()
+
+    assert (card / 'clip.mp4').read_bytes() == data
+    assert not os.path.exists(src)
+    assert not (card / 'clip.mp4.part').exists()
+    assert done == [str(card / 'clip.mp4')]
+    stats = write_behind.stats()
+    assert stats['bytes_written'] == 4500
+    assert stats['files_written'] == 1
+    # One fsync for the file and one for its folder
+    assert stats['fsyncs'] == 2
+
+
+def test_files_are_synced_in_batches(tmp_path):
+    from spyglass.staging import WriteBehind
+    write_behind = WriteBehind(str(tmp_path / 'staging'))
+    write_behind.stop()
+
+    for i in range(3):
+        src = write_behind.staging_path(f'{i}.mp4')
+        with open(src, 'wb') as f:
+            f.write(b'x' * 100)
+        write_behind._copy(src, str(tmp_path / f'{i}.mp4'), None)
+    # Nothing has its final name before the batch is synced
+    assert sorted(os.listdir(tmp_path)) == ['0.mp4.part', '1.mp4.part', '2.mp4.part', 'staging']
+
+    write_behind._sync_batch()
+    assert sorted(os.listdir(tmp_path)) == ['0.mp4', '1.mp4', '2.mp4', 'staging']
+    # Three files, but the shared folder is only synced once
+    assert write_behind.fsyncs == 4
+
+
+def test_appends_are_buffered_until_flush(tmp_path):
+    from spyglass.staging import WriteBehind
+    write_behind = WriteBehind(str(tmp_path / 'staging'), append_flush_bytes=1000)
+    path = str(tmp_path / 'gps_data.csv')
+    write_behind.append(path, 'a,1\n')
+    write_behind.append(path, 'b,2\n')
+    assert not os.path.exists(path)
+
+    write_behind.stop()
+    with open(path) as f:
+        assert f.read() == 'a,1\nb,2\n'
@@ -0,0 +1,42 @@
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ['fastapi', 'uvicorn', 'picamera2', 'libcamera', 'cv2', 'numpy', 'paramiko', 'serial', 'pynmea2',
+                 'telegram_send']
+
+
+def test_cli_import_does_not_load_heavy_modules():
+    code = ('import sys, spyglass.cli; '
+            f'print(",".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))')
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
+
+
+def test_help_works_without_camera_libraries():
+    result = subprocess.run([sys.executable, '-m', 'spyglass', '--help'], capture_output=True, text=True)
+    assert result.returncode == 0
+    assert '--clips_folder' in result.stdout
+
+
+def test_process_start_time(tmp_path, monkeypatch):
+    from spyglass import startup
+    stat_file = tmp_path / 'stat'
+    # Fields after the command name, starttime is the 20th of them
+    fields = ['S'] + ['0'] * 18 + ['1000']
+    stat_file.write_text('1234 (python3 -m spyglass) ' + ' '.join(fields) + '\n')
+    uptime_file = tmp_path / 'uptime'
+    uptime_file.write_text('15.00 20.00\n')
+    monkeypatch.setattr(startup.os, 'sysconf', lambda name: 100)
+
+    # Started 10 s after boot, 5 s ago
+    assert abs(time.monotonic() - startup.process_start_time(str(stat_file), str(uptime_file)) - 5) < 0.1
+
+
+def test_mark_keeps_first_time():
+    from spyglass import startup
+    startup.mark('test_milestone')
+    first = startup.report()['test_milestone']
+    time.sleep(0.01)
+    startup.mark('test_milestone')
+    assert startup.report()['test_milestone'] == first
@@ -0,0 +1,141 @@
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+CLIP_ID = 'clip_2024-05-01_12-00-00'
+LORES_SIZE = (64, 48)
+
+
+@pytest.fixture
+def thumbnails(simulated, monkeypatch):
+    thumbnails = simulated('spyglass.thumbnails')
+    # The frames are processed by drain() instead of the worker thread
+    monkeypatch.setattr(thumbnails, 'Thread', lambda target, daemon: SimpleNamespace(start=lambda: None))
+    return thumbnails
+
+
+def drain(thumbnailer):
+    while not thumbnailer._queue.empty():
+        clip, item = thumbnailer._queue.get()
+        if isinstance(item, str):
+            thumbnailer._write(clip, item)
+        else:
+            thumbnailer._add_frame(clip, item)
+
+
+def lores_request(value=128):
+    import numpy as np
+    from spyglass.simulator import CompletedRequest
+
+    width, height = LORES_SIZE
+    frame = np.full((height * 3 // 2, width), value, dtype=np.uint8)
+    return CompletedRequest(0, 0, 33333, {'lores': frame}, {})
+
+
+def test_frames_are_sampled_once_per_interval(thumbnails, monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(thumbnails.time, 'monotonic', lambda: now[0])
+    thumbnailer = thumbnails.ClipThumbnailer(interval=2, lores_size=LORES_SIZE)
+
+    thumbnailer.sample(lores_request())
+    assert thumbnailer._queue.empty()
+
+    thumbnailer.start(clip_duration=10)
+    for t in (100.0, 101.0, 101.9, 102.0, 103.0, 104.5):
+        now[0] = t
+        thumbnailer.sample(lores_request())
+    drain(thumbnailer)
+    assert len(thumbnailer._clip.tiles) == 3
+
+
+def test_clip_images_are_written_as_jpeg(thumbnails, tmp_path, monkeypatch):
+    import cv2
+
+    now = [0.0]
+    monkeypatch.setattr(thumbnails.time, 'monotonic', lambda: now[0])
+    thumbnailer = thumbnails.ClipThumbnailer(interval=1, lores_size=LORES_SIZE, tile_width=32, columns=2)
+    thumbnailer.start(clip_duration=6)
+    for t in range(5):
+        now[0] = t
+        thumbnailer.sample(lores_request(value=40 * t))
+    clip_file = str(tmp_path / (CLIP_ID + '.mp4'))
+    thumbnailer.finish(clip_file)
+    drain(thumbnailer)
+
+    poster = cv2.imread(str(tmp_path / (CLIP_ID + '.thumb.jpg')))
+    sprite = cv2.imread(str(tmp_path / (CLIP_ID + '.sprite.jpg')))
+    assert poster.shape == (48, 64, 3)
+    assert sprite.shape == (3 * 24, 2 * 32, 3)
+    # The poster is the frame from the middle of the clip, the fourth of six seconds
+    middle = cv2.cvtColor(lores_request(value=120).make_array('lores'), cv2.COLOR_YUV2BGR_I420)
+    assert abs(poster.mean() - middle.mean()) < 3
+    with open(tmp_path / (CLIP_ID + '.thumb.jpg'), 'rb') as f:
+        assert f.read(2) == b'\xff\xd8'
+
+
+def test_clip_without_frames_writes_nothing(thumbnails, tmp_path):
+    thumbnailer = thumbnails.ClipThumbnailer(interval=1, lores_size=LORES_SIZE)
+    thumbnailer.start(clip_duration=6)
+    thumbnailer.finish(str(tmp_path / (CLIP_ID + '.mp4')))
+    drain(thumbnailer)
+    assert os.listdir(tmp_path) == []
+
+
+def test_sprite_fills_rows_left_to_right(thumbnails):
+    import numpy as np
+
+    tiles = [np.full((2, 3, 3), i, dtype=np.uint8) for i in range(5)]
+    sheet = thumbnails.pack_sprite(tiles, columns=2)
+    assert sheet.shape == (6, 6, 3)
+    assert sheet[0, 0, 0] == 0 and sheet[0, 3, 0] == 1
+    assert sheet[2, 0, 0] == 2 and sheet[4, 0, 0] == 4
+    # The rest of the last row stays black
+    assert not sheet[4:, 3:].any()
+
+
+def test_sprite_narrower_than_its_columns(thumbnails):
+    import numpy as np
+
+    tiles = [np.ones((2, 3, 3), dtype=np.uint8)] * 3
+    assert thumbnails.pack_sprite(tiles, columns=10).shape == (2, 9, 3)
+
+
+@pytest.fixture
+def server(thumbnails, simulated, monkeypatch, tmp_path):
+    server = simulated('spyglass.server')
+    monkeypatch.setattr(server, 'dvr', SimpleNamespace(paused=False, clips_folder=str(tmp_path), thumbnailer=None))
+    day_folder = tmp_path / '2024-05-01'
+    day_folder.mkdir()
+    (day_folder / (CLIP_ID + '.thumb.jpg')).write_bytes(b'\xff\xd8poster')
+    (day_folder / (CLIP_ID + '.sprite.jpg')).write_bytes(b'\xff\xd8sprite')
+    return server
+
+
+def test_thumbnail_endpoint(server):
+    response = asyncio.run(server.clip_thumbnail(CLIP_ID))
+    assert response.path.endswith(CLIP_ID + '.thumb.jpg')
+    assert response.media_type == 'image/jpeg'
+    assert 'immutable' in response.headers['cache-control']
+
+
+@pytest.mark.parametrize("clip_id", ['clip_2024-05-02_12-00-00', '..', 'clip_2024-05-01_12-00-00/../x'])
+def test_thumbnail_endpoint_of_an_unknown_clip(server, clip_id):
+    assert asyncio.run(server.clip_thumbnail(clip_id)).status_code == 404
+
+
+def test_sprite_endpoint_describes_the_sheet(server, thumbnails, monkeypatch):
+    thumbnailer = thumbnails.ClipThumbnailer(interval=2, lores_size=(320, 240), tile_width=160, columns=10)
+    monkeypatch.setattr(server.dvr, 'thumbnailer', thumbnailer)
+    response = asyncio.run(server.clip_sprite(CLIP_ID))
+    assert response.path.endswith(CLIP_ID + '.sprite.jpg')
+    assert response.headers['x-sprite-interval'] == '2'
+    assert response.headers['x-sprite-columns'] == '10'
+    assert response.headers['x-sprite-tile'] == '160x120'
+
+
+def test_sprite_endpoint_without_a_thumbnailer(server):
+    response = asyncio.run(server.clip_sprite(CLIP_ID))
+    assert response.path.endswith(CLIP_ID + '.sprite.jpg')
+    assert 'x-sprite-interval' not in response.headers
@@ -0,0 +1,83 @@
+import os
+import time
+
+import pytest
+
+
+def record_clip(tmp_path, frames=45, fps=30, iperiod=15):
+    from spyglass.simulator import FfmpegOutput, H264Encoder, Picamera2
+    from spyglass.timing import TimingWriter
+
+    camera = Picamera2(fps=fps)
+    encoder = H264Encoder(bitrate=1_000_000, iperiod=iperiod)
+    clip = str(tmp_path / 'clip_2024-06-05_12-00-00.mp4')
+    timing_file = str(tmp_path / 'clip_2024-06-05_12-00-00.timing')
+
+    writer = TimingWriter()
+    output = writer.instrument(encoder, FfmpegOutput(f'-movflags +frag_keyframe -f mp4 {clip}'))
+    writer.start(timing_file)
+    camera.start_encoder(encoder, output, name='main')
+    camera.run_frames(frames)
+    encoder.stop()
+    writer.finish(clip)
+    return clip, timing_file
+
+
+def test_records_every_frame_with_sensor_and_wall_clock_time(tmp_path):
+    from spyglass.timing import HEADER, RECORD, ClipTiming
+
+    before = time.time()
+    clip, timing_file = record_clip(tmp_path)
+    timing = ClipTiming(timing_file)
+
+    assert len(timing) == 45
+    assert timing.sensor_timestamp(1) > timing.sensor_timestamp(0)
+    assert before - 1 < timing.start <= timing.end < time.time() + 1
+    # Keyframes every 15 frames, one fragment each
+    assert [timing.record(i)[3] for i in (0, 14, 15, 44)] == [0, 0, 1, 2]
+    assert timing.record(15)[4] == 1 and timing.record(16)[4] == 0
+    assert len(timing.fragments) == 3
+    assert os.path.getsize(timing_file) < HEADER.size + 45 * RECORD.size + 64
+
+
+def test_seek_starts_at_the_fragment_of_the_keyframe_before(tmp_path):
+    from spyglass.mp4 import scan_boxes
+    from spyglass.timing import ClipTiming, clip_stream
+
+    clip, timing_file = record_clip(tmp_path)
+    timing = ClipTiming(timing_file)
+    with open(clip, 'rb') as f:
+        moofs = [offset for offset, _, box_type in scan_boxes(f) if box_type == 'moof']
+
+    assert timing.init_end == moofs[0]
+    assert timing.seek(timing.wall_time(20)) == (moofs[1], 15)
+    assert timing.seek(timing.wall_time(30)) == (moofs[2], 30)
+    assert timing.seek(timing.start - 1) is None
+    assert timing.frame_at(timing.end + 10) == 44
+
+    data = b''.join(clip_stream(clip, moofs[1], timing.init_end))
+    with open(clip, 'rb') as f:
+        whole = f.read()
+    assert data == whole[:moofs[0]] + whole[moofs[1]:]
+
+
+def test_sidecar_without_footer_still_maps_frames(tmp_path):
+    from spyglass.timing import ClipTiming
+
+    _, timing_file = record_clip(tmp_path)
+    timing = ClipTiming(timing_file)
+    with open(timing_file, 'rb') as f:
+        data = f.read()
+    # Power lost while the clip was recorded, halfway through a record
+    cut = tmp_path / 'cut.timing'
+    cut.write_bytes(data[:16 + 10 * 24 + 7])
+
+    cut_timing = ClipTiming(str(cut))
+    assert len(cut_timing) == 10
+    assert cut_timing.fragments == []
+    assert cut_timing.seek(timing.wall_time(5)) is None
+    assert cut_timing.frame_at(timing.wall_time(5)) == 5
+
+    (tmp_path / 'junk.timing').write_bytes(bytes(40))
+    with pytest.raises(ValueError):
+        ClipTiming(str(tmp_path / 'junk.timing'))
@@ -0,0 +1,332 @@
+import itertools
+import os
+import threading
+import time
+from queue import PriorityQueue
+from types import SimpleNamespace
+
+import pytest
+
+from spyglass.simulator import box
+
+
+def write_route_file(tmp_path, interface):
+    route_file = tmp_path / 'route'
+    route_file.write_text(
+        'Iface\tDestination\tGateway\tFlags\tRefCnt\tUse\tMetric\tMask\n'
+        'eth9\t0000A8C0\t00000000\t0001\t0\t0\t0\t00FFFFFF\n'
+        f'{interface}\t00000000\t0100A8C0\t0003\t0\t0\t600\t00000000\n'
+    )
+    return str(route_file)
+
+
+def test_default_route_interface(tmp_path):
+    from spyglass.upload_clips import default_route_interface
+    assert default_route_interface(write_route_file(tmp_path, 'wwan0')) == 'wwan0'
+    assert default_route_interface(str(tmp_path / 'missing')) is None
+
+
+@pytest.mark.parametrize("interface, expected", [('wlan0', True), ('wwan0', False)])
+def test_is_on_wifi(tmp_path, interface, expected):
+    from spyglass.upload_clips import is_on_wifi
+    os.makedirs(tmp_path / 'net' / 'wlan0' / 'wireless')
+    os.makedirs(tmp_path / 'net' / 'wwan0')
+    assert is_on_wifi(write_route_file(tmp_path, interface), str(tmp_path / 'net')) == expected
+
+
+def make_uploader(policy, static_policy='always'):
+    from spyglass.upload_clips import UploadClips
+    uploader = UploadClips.__new__(UploadClips)
+    uploader.clip_queue = PriorityQueue()
+    uploader._order = itertools.count()
+    uploader.full_upload_policy = policy
+    uploader.static_upload_policy = static_policy
+    uploader.deferred = []
+    uploader.requested = set()
+    uploader._deferred_lock = threading.Lock()
+    uploader._queued = {}
+    uploader.uploaded = set()
+    uploader.failures = {}
+    uploader._on_wifi = False
+    uploader._paused = threading.Event()
+    uploader.live_uploads = {}
+    return uploader
+
+
+def test_proxies_are_uploaded_before_full_clips():
+    uploader = make_uploader('always')
+    uploader.add_file_to_queue('a/clip_1.mp4')
+    uploader.add_file_to_queue('a/clip_1.proxy.mp4')
+    uploader.add_file_to_queue('a/clip_2.proxy.mp4')
+    order = [uploader.clip_queue.get()[2] for _ in range(3)]
+    assert order == ['a/clip_1.proxy.mp4', 'a/clip_2.proxy.mp4', 'a/clip_1.mp4']
+
+
+def test_requested_clips_skip_the_on_request_policy():
+    from spyglass.upload_clips import PRIORITY_FULL, PRIORITY_PROXY, PRIORITY_REQUESTED
+    uploader = make_uploader('on_request')
+    assert uploader._should_defer(PRIORITY_FULL, 'a/clip_1.mp4')
+    assert not uploader._should_defer(PRIORITY_PROXY, 'a/clip_1.proxy.mp4')
+
+    uploader.deferred.append('a/clip_1.mp4')
+    uploader.request_upload('a/clip_1.mp4')
+    assert uploader.deferred == []
+    assert uploader.clip_queue.get() == (PRIORITY_REQUESTED, 0, 'a/clip_1.mp4')
+
+
+def test_requested_clip_is_queued_once():
+    from spyglass.upload_clips import PRIORITY_REQUESTED
+    uploader = make_uploader('always')
+    uploader.add_file_to_queue('a/clip_1.mp4')
+    uploader.add_file_to_queue('a/clip_2.mp4')
+    uploader.request_upload('a/clip_2.mp4')
+    uploader.request_upload('a/clip_2.mp4')
+    uploader.add_file_to_queue('a/clip_2.mp4')
+
+    entries = []
+    while not uploader.clip_queue.empty():
+        entries.append(uploader._next_file())
+    # The entry clip_2 had before it was requested is skipped
+    assert [entry for entry in entries if entry] == [(PRIORITY_REQUESTED, 'a/clip_2.mp4'), (2, 'a/clip_1.mp4')]
+
+
+def test_clips_go_to_the_remote_folder_of_their_day():
+    uploader = make_uploader('always')
+    uploader.sftp_dir = '/dashcam'
+    assert uploader.remote_dir_for('clips/2024-06-05/clip_2024-06-05_12-00-00.mp4') == '/dashcam/2024-06-05'
+
+
+def test_clip_is_requeued_when_the_server_is_unreachable():
+    uploader = make_uploader('always')
+    uploader.retry_delay = 0
+    uploader.create_sftp_connection = lambda: None
+    uploader.upload_clip('a/clip_1.mp4', '/dashcam/a')
+    assert uploader.clip_queue.get()[2] == 'a/clip_1.mp4'
+
+
+def test_static_clips_of_a_parked_day_are_held_back(tmp_path):
+    import json
+    from spyglass.clips import activity_path
+
+    uploader = make_uploader('always', static_policy='on_request')
+    sizes = {}
+    for i in range(100):
+        clip = str(tmp_path / f'clip_2024-06-05_12-{i // 6:02d}-{i % 6 * 10:02d}.mp4')
+        proxy = clip.replace('.mp4', '.proxy.mp4')
+        # Something moves in one clip out of twenty
+        with open(activity_path(clip), 'w') as f:
+            json.dump({'activity': 0.01, 'static': i % 20 != 0}, f)
+        sizes[clip], sizes[proxy] = 4_000_000, 300_000
+        uploader.add_file_to_queue(proxy)
+        uploader.add_file_to_queue(clip)
+
+    uploaded = []
+    while not uploader.clip_queue.empty():
+        priority, _, file_path = uploader.clip_queue.get()
+        if not uploader._should_defer(priority, file_path):
+            uploaded.append(file_path)
+
+    assert len(uploaded) == 10
+    assert sum(sizes[path] for path in uploaded) * 10 <= sum(sizes.values())
+
+    # Still there when asked for
+    static_clip = str(tmp_path / 'clip_2024-06-05_12-00-10.mp4')
+    uploader.request_upload(static_clip)
+    assert uploader.clip_queue.get()[2] == static_clip
+
+
+def test_static_clips_are_released_on_wifi(tmp_path, monkeypatch):
+    import json
+    from spyglass import upload_clips
+    from spyglass.clips import activity_path
+    from spyglass.upload_clips import PRIORITY_STATIC
+
+    uploader = make_uploader('on_request', static_policy='wifi')
+    clip = str(tmp_path / 'clip_2024-06-05_12-00-00.mp4')
+    with open(activity_path(clip), 'w') as f:
+        json.dump({'activity': 0.01, 'static': True}, f)
+    proxy = clip.replace('.mp4', '.proxy.mp4')
+    uploader.deferred = [proxy, clip]
+
+    monkeypatch.setattr(upload_clips, 'is_on_wifi', lambda: True)
+    uploader._release_deferred()
+    # The full clip still waits for a request
+    assert uploader.deferred == [clip]
+    assert uploader.clip_queue.get() == (PRIORITY_STATIC, 0, proxy)
+
+
+def test_live_upload_sends_complete_fragments_while_recording(tmp_path):
+    from spyglass.simulator import FakeSFTPClient
+
+    uploader = make_uploader('always')
+    uploader.sftp_dir = '/dashcam'
+    uploader.remote_dirs = set()
+    server = tmp_path / 'server'
+    server.mkdir()
+    uploader.create_sftp_connection = lambda: FakeSFTPClient(str(server))
+    day = tmp_path / '2024-06-05'
+    day.mkdir()
+    recording = day / 'TMP_clip_2024-06-05_12-00-00.mp4'
+    final = day / 'clip_2024-06-05_12-00-00.mp4'
+    remote = server / 'dashcam' / '2024-06-05' / final.name
+
+    live_upload = uploader.start_live_upload(str(recording), str(final))
+    header = box(b'ftyp', b'isom') + box(b'moov')
+    fragment = box(b'moof', bytes(16)) + box(b'mdat', bytes(1000))
+    with open(recording, 'wb') as f:
+        # The second fragment is still being written
+        f.write(header + fragment + fragment[:30])
+        f.flush()
+        deadline = time.monotonic() + 5
+        while not (remote.exists() and remote.stat().st_size == len(header + fragment)):
+            assert time.monotonic() < deadline
+            time.sleep(0.05)
+        f.write(fragment[30:])
+    os.rename(recording, final)
+    live_upload.finish()
+    live_upload.join(5)
+
+    assert remote.read_bytes() == header + fragment * 2
+    assert live_upload.complete
+
+    # Once queued, the clip is not uploaded again
+    uploader.upload_clip(str(final), '/dashcam/2024-06-05')
+    assert not final.exists()
+
+
+def test_cut_short_live_upload_is_uploaded_again(tmp_path):
+    from spyglass.simulator import FakeSFTPClient
+
+    uploader = make_uploader('always')
+    uploader.sftp_dir = '/dashcam'
+    uploader.remote_dirs = set()
+    sftp = FakeSFTPClient(str(tmp_path / 'server'))
+    uploader.create_sftp_connection = lambda: sftp
+    final = tmp_path / 'clip_2024-06-05_12-00-00.mp4'
+    final.write_bytes(box(b'ftyp') + box(b'mdat', bytes(100))[:50])
+
+    live_upload = uploader.start_live_upload(str(final), str(final))
+    live_upload.finish()
+    uploader.upload_clip(str(final), '/dashcam/x')
+    assert not live_upload.complete
+    assert sftp.uploaded == ['/dashcam/x/clip_2024-06-05_12-00-00.mp4']
+
+
+def test_live_uploads_follow_the_upload_policy():
+    uploader = make_uploader('on_request')
+    assert uploader.start_live_upload('a/TMP_clip_1.mp4', 'a/clip_1.mp4') is None
+
+
+def test_no_live_uploads_while_paused():
+    uploader = make_uploader('always')
+    uploader.pause()
+    assert uploader.start_live_upload('a/TMP_clip_1.mp4', 'a/clip_1.mp4') is None
+
+
+def test_locked_clips_stay_on_the_card_after_upload(tmp_path):
+    from spyglass.clips import lock_clip
+    from spyglass.simulator import FakeSFTPClient
+
+    uploader = make_uploader('always')
+    uploader.remote_dirs = set()
+    sftp = FakeSFTPClient(str(tmp_path / 'server'))
+    uploader.create_sftp_connection = lambda: sftp
+    locked = tmp_path / 'clip_2024-06-05_12-00-00.mp4'
+    other = tmp_path / 'clip_2024-06-05_12-00-10.mp4'
+    locked.write_bytes(bytes(10))
+    other.write_bytes(bytes(10))
+    lock_clip(str(locked))
+
+    uploader.upload_clip(str(locked), '/dashcam/x')
+    uploader.upload_clip(str(other), '/dashcam/x')
+    assert len(sftp.uploaded) == 2
+    assert locked.exists()
+    assert not other.exists()
+
+
+def test_sidecars_are_removed_with_the_last_uploaded_file(tmp_path):
+    from spyglass.simulator import FakeSFTPClient
+
+    uploader = make_uploader('always')
+    uploader.remote_dirs = set()
+    uploader.create_sftp_connection = lambda: FakeSFTPClient(str(tmp_path / 'server'))
+    day = tmp_path / '2024-06-05'
+    day.mkdir()
+    names = ['clip_2024-06-05_12-00-00' + suffix
+             for suffix in ('.mp4', '.proxy.mp4', '.timing', '.activity.json', '.thumb.jpg', '.sprite.jpg')]
+    for name in names:
+        (day / name).write_bytes(bytes(10))
+
+    uploader.upload_clip(str(day / names[1]), '/dashcam/2024-06-05')
+    # The full clip still needs its activity and thumbnails
+    assert sorted(os.listdir(day)) == sorted(names[:1] + names[2:])
+    uploader.upload_clip(str(day / names[0]), '/dashcam/2024-06-05')
+    assert os.listdir(day) == []
+
+
+def upload_queued(uploader):
+    # What process_queue does with a queue nothing is deferred from
+    while not uploader.clip_queue.empty():
+        entry = uploader._next_file()
+        if entry:
+            uploader.upload_clip(entry[1], uploader.remote_dir_for(entry[1]))
+
+
+def test_clip_of_an_incident_is_uploaded_once(tmp_path):
+    from spyglass.clips import lock_clip
+    from spyglass.simulator import FakeSFTPClient
+
+    uploader = make_uploader('always')
+    uploader.remote_dirs = set()
+    sftp = FakeSFTPClient(str(tmp_path / 'server'))
+    uploader.create_sftp_connection = lambda: sftp
+    uploader.sftp_dir = '/dashcam'
+    clip = tmp_path / '2024-06-05' / 'clip_2024-06-05_12-00-00.mp4'
+    clip.parent.mkdir()
+    clip.write_bytes(bytes(10))
+
+    # Queued when it was finished, then locked and requested by the incident
+    uploader.add_file_to_queue(str(clip))
+    lock_clip(str(clip))
+    uploader.request_upload(str(clip))
+    upload_queued(uploader)
+    # An incident marked later covers it again
+    uploader.request_upload(str(clip))
+    assert uploader.clip_queue.empty()
+    assert sftp.uploaded == ['/dashcam/2024-06-05/clip_2024-06-05_12-00-00.mp4']
+
+
+def test_failing_upload_is_retried_later_then_left_on_the_card(tmp_path, monkeypatch):
+    from spyglass import upload_clips
+
+    class FailingSFTP:
+        def put(self, local_path, remote_path):
+            raise PermissionError(13, 'Permission denied')
+
+        def close(self):
+            pass
+
+    delays = []
+
+    def timer(delay, function, args):
+        # Queues the clip again right away, the delay is only recorded
+        delays.append(delay)
+        return SimpleNamespace(start=lambda: function(*args))
+
+    monkeypatch.setattr(upload_clips, 'Timer', timer)
+    uploader = make_uploader('always')
+    uploader.retry_delay = 10
+    uploader.remote_dirs = {'/dashcam/2024-06-05'}
+    uploader.create_sftp_connection = FailingSFTP
+    clip = tmp_path / '2024-06-05' / 'clip_2024-06-05_12-00-00.mp4'
+    clip.parent.mkdir()
+    clip.write_bytes(bytes(10))
+    uploader.remote_dir_for = lambda file_path: '/dashcam/2024-06-05'
+
+    uploader.add_file_to_queue(str(clip))
+    upload_queued(uploader)
+    assert delays == [10, 20, 40, 80]
+    assert uploader.failures[str(clip)] == upload_clips.MAX_UPLOAD_ATTEMPTS
+    assert uploader.clip_queue.empty()
+    assert clip.exists()
+
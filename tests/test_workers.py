@@ -0,0 +1,98 @@
+import sys
+import time
+from types import SimpleNamespace
+
+
+def make_dvr(tmp_path):
+    return SimpleNamespace(clips_folder=str(tmp_path), sftp_user='u', sftp_password='p', sftp_server='127.0.0.1',
+                           sftp_dir='/', full_upload_policy='always', static_upload_policy='always', disk_alert_threshold=0.1,
+                           cpu_temp_alert_threshold=65.0, gps_serial_port=None, is_recording=True,
+                           last_gps_data=None, gps_available=False, thread=None, governor=None, paused=False)
+
+
+def test_gps_fix_is_shared_through_worker_dvr(tmp_path):
+    import multiprocessing
+    from spyglass.workers import SharedState, WorkerDVR
+    shared = SharedState(multiprocessing.get_context('spawn'))
+    worker_dvr = WorkerDVR(shared, str(tmp_path))
+    assert worker_dvr.last_gps_data is None
+
+    worker_dvr.last_gps_data = '41.38 2.17'
+    assert shared.get_fix() == (41.38, 2.17)
+    assert worker_dvr.last_gps_data == '41.38 2.17'
+
+
+def test_worker_dvr_reports_the_system_status(tmp_path):
+    import multiprocessing
+    from spyglass.workers import SharedState, WorkerDVR
+    shared = SharedState(multiprocessing.get_context('spawn'))
+    shared.paused.value = True
+
+    status = WorkerDVR(shared, str(tmp_path)).get_system_status()
+    assert status['recording'] and status['paused']
+    assert not status['gps_thread_alive']
+
+
+def test_status_worker_reports_once_per_iteration(tmp_path, monkeypatch):
+    import asyncio
+    import multiprocessing
+    import types
+    from spyglass.workers import SharedState, WorkerDVR
+    shared = SharedState(multiprocessing.get_context('spawn'))
+    sent = []
+
+    async def send(messages, parse_mode=None):
+        sent.extend(messages)
+
+    async def sleep(seconds):
+        # One iteration, the worker stops with the camera process
+        shared.running.value = False
+
+    monkeypatch.setitem(sys.modules, 'telegram_send', types.SimpleNamespace(send=send))
+    monkeypatch.setattr(asyncio, 'sleep', sleep)
+    worker_dvr = WorkerDVR(shared, str(tmp_path))
+    asyncio.run(worker_dvr.gather_status(0.1, 65.0))
+    assert len(sent) == 1 and 'System Status Report' in sent[0]
+
+
+def test_supervisor_mirrors_shared_state_into_the_dvr(tmp_path):
+    from spyglass.workers import Supervisor
+    dvr = make_dvr(tmp_path)
+    supervisor = Supervisor(dvr)
+    supervisor.shared.set_fix(41.38, 2.17)
+    supervisor.shared.gps_available.value = True
+    dvr.is_recording = False
+    dvr.paused = True
+
+    supervisor._mirror_state()
+    assert dvr.last_gps_data == '41.38 2.17'
+    assert dvr.gps_available
+    assert not supervisor.shared.running.value
+    assert supervisor.shared.paused.value
+    assert not dvr.thread.is_alive()
+
+
+def test_upload_client_forwards_clips(tmp_path):
+    from spyglass.workers import Supervisor
+    supervisor = Supervisor(make_dvr(tmp_path))
+    supervisor.uploads.add_file_to_queue('a/clip_1.mp4')
+    supervisor.uploads.request_upload('a/clip_2.mp4')
+    assert supervisor.upload_events.get(timeout=1) == ('add', 'a/clip_1.mp4')
+    assert supervisor.upload_events.get(timeout=1) == ('request', 'a/clip_2.mp4')
+
+
+def test_supervisor_notices_a_dead_worker(tmp_path):
+    from spyglass.workers import Supervisor
+    supervisor = Supervisor(make_dvr(tmp_path), poll_interval=0.05)
+    supervisor.workers = {'crash': (sys.exit, (3,))}
+    supervisor.restarts = {'crash': 0}
+    supervisor.start()
+    try:
+        deadline = time.monotonic() + 10
+        while supervisor.restarts['crash'] == 0 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert supervisor.restarts['crash'] == 1
+        assert supervisor.report()['crash']['alive'] is False
+        assert supervisor.processes['crash'].exitcode == 3
+    finally:
+        supervisor._stopped.set()